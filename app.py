@@ -1,35 +1,50 @@
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, session, send_file
+from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, session, send_file, abort, g, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
 import os
+import sys
 import csv
 import json
 import re
 from PyPDF2 import PdfReader
 from datetime import datetime, date, timedelta
+from collections import namedtuple
 try:
     import spacy
     import spacy.cli
     SPACY_AVAILABLE = True
 except ImportError:
     SPACY_AVAILABLE = False
-    print("spaCy não está disponível. Algumas funcionalidades de NLP estarão desabilitadas.")
+    print("spaCy não está disponível. Algumas funcionalidades de NLP estarão desabilitadas.", file=sys.stderr)
     
 import click
 from flask.cli import with_appcontext
 from flask_caching import Cache
-from sqlalchemy.orm import aliased
+from sqlalchemy.orm import aliased, joinedload
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
-from sqlalchemy import func
-import random
+from sqlalchemy import func, insert, select, delete, update, case, text, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import sort_tables_and_constraints
 from flask_wtf import FlaskForm
 from wtforms import HiddenField
 import uuid
+import hashlib
+import base64
+import gzip
+import zlib
+import shutil
+import tempfile
+import mimetypes
 import io
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import time
 
 app = Flask(__name__)
 
@@ -38,6 +53,8 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'uma-chave-secreta-padrao-par
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///service_desk.db').replace('postgres://', 'postgresql://')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['ATTACHMENT_STORE_DIR'] = os.getenv('ATTACHMENT_STORE_DIR', os.path.join(app.instance_path, 'attachments'))
+app.config['IMPORT_DIR'] = os.getenv('IMPORT_DIR', os.path.join(app.instance_path, 'imports'))
 app.config['WTF_CSRF_ENABLED'] = True
 app.config['WTF_CSRF_SECRET_KEY'] = os.getenv('CSRF_SECRET_KEY', app.config['SECRET_KEY'])
 
@@ -66,7 +83,7 @@ if SPACY_AVAILABLE:
     try:
         nlp = spacy.load('pt_core_news_sm')
     except OSError:
-        print("Modelo pt_core_news_sm não encontrado. Funcionalidades de NLP estarão desabilitadas.")
+        print("Modelo pt_core_news_sm não encontrado. Funcionalidades de NLP estarão desabilitadas.", file=sys.stderr)
         nlp = None
 
 # --- MODELOS DA BASE DE DADOS ---
@@ -126,9 +143,27 @@ class FAQ(db.Model):
     image_url = db.Column(db.String(500))
     video_url = db.Column(db.String(500))
     file_name = db.Column(db.String(255))
-    file_data = db.Column(db.LargeBinary)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     category = db.relationship('Category', backref='faqs')
+    attachment = db.relationship('FAQAttachment', uselist=False, cascade='all, delete-orphan', backref='faq')
+
+class FAQAttachment(db.Model):
+    # Referência da FAQ ao conteúdo do anexo no armazenamento endereçado por SHA-256
+    __tablename__ = 'faq_attachment'
+    faq_id = db.Column(db.Integer, db.ForeignKey('faq.id'), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), db.ForeignKey('attachment_blob.sha256'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class AttachmentBlob(db.Model):
+    # Conteúdo guardado uma única vez em disco (ATTACHMENT_STORE_DIR), com contagem de referências
+    __tablename__ = 'attachment_blob'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    stored_size = db.Column(db.Integer, nullable=False)
+    compression = db.Column(db.String(10), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Ticket(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -155,6 +190,7 @@ class Challenge(db.Model):
     expected_output = db.Column(db.Text, nullable=True)
 
 class UserChallenge(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'challenge_id', name='uq_user_challenge_user_challenge'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     challenge_id = db.Column(db.Integer, db.ForeignKey('challenge.id'), nullable=False)
@@ -186,6 +222,7 @@ class LearningPath(db.Model):
     challenges = db.relationship('PathChallenge', order_by='PathChallenge.step', cascade='all, delete-orphan', back_populates='path')
 
 class UserPathProgress(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'path_id', name='uq_user_path_progress_user_path'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     path_id = db.Column(db.Integer, db.ForeignKey('learning_path.id'), nullable=False)
@@ -193,6 +230,22 @@ class UserPathProgress(db.Model):
     user = db.relationship('User')
     path = db.relationship('LearningPath')
 
+class UserPathProgressCount(db.Model):
+    # Progresso materializado: passos concluídos / total de passos por utilizador e trilha
+    __tablename__ = 'user_path_progress_counts'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    path_id = db.Column(db.Integer, db.ForeignKey('learning_path.id'), primary_key=True, index=True)
+    completed_steps = db.Column(db.Integer, nullable=False, default=0)
+    total_steps = db.Column(db.Integer, nullable=False, default=0)
+
+class PointsLedger(db.Model):
+    # Extrato das recompensas pagas em massa (equipas, batalhas, eventos globais)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    points = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Achievement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
@@ -200,8 +253,10 @@ class Achievement(db.Model):
     icon = db.Column(db.String(255), nullable=True)
     trigger_type = db.Column(db.String(50), nullable=False)
     trigger_value = db.Column(db.Integer, nullable=False)
+    backfill_requested_at = db.Column(db.DateTime, nullable=True) # Atribuição retroativa pendente (criada ou editada)
 
 class UserAchievement(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'achievement_id', name='uq_user_achievement_user_achievement'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     achievement_id = db.Column(db.Integer, db.ForeignKey('achievement.id'), nullable=False)
@@ -209,6 +264,17 @@ class UserAchievement(db.Model):
     user = db.relationship('User', backref='achievements')
     achievement = db.relationship('Achievement')
 
+class UserNotification(db.Model):
+    # Avisos gerados fora de um pedido do utilizador (ex.: conquistas atribuídas em massa),
+    # mostrados como flash na próxima visita ao dashboard
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    message = db.Column(db.String(255), nullable=False)
+    category = db.Column(db.String(20), nullable=False, default='success')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    read_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (db.Index('ix_user_notification_user_unread', 'user_id', 'read_at'),)
+
 class DailyChallenge(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     day = db.Column(db.Date, unique=True, nullable=False, default=date.today)
@@ -239,6 +305,7 @@ class BossFightStep(db.Model):
     expected_answer = db.Column(db.String(500), nullable=False)
 
 class TeamBossProgress(db.Model):
+    __table_args__ = (db.UniqueConstraint('team_id', 'step_id', name='uq_team_boss_progress_team_step'),)
     id = db.Column(db.Integer, primary_key=True)
     team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False)
     step_id = db.Column(db.Integer, db.ForeignKey('boss_fight_step.id'), nullable=False)
@@ -249,6 +316,7 @@ class TeamBossProgress(db.Model):
     user = db.relationship('User')
 
 class TeamBossCompletion(db.Model):
+    __table_args__ = (db.UniqueConstraint('team_id', 'boss_fight_id', name='uq_team_boss_completion_team_boss'),)
     id = db.Column(db.Integer, primary_key=True)
     team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False)
     boss_fight_id = db.Column(db.Integer, db.ForeignKey('boss_fight.id'), nullable=False)
@@ -256,6 +324,13 @@ class TeamBossCompletion(db.Model):
     team = db.relationship('Team')
     boss_fight = db.relationship('BossFight')
 
+class TeamBossProgressCount(db.Model):
+    # Progresso materializado: tarefas concluídas por equipa e Boss Fight
+    __tablename__ = 'team_boss_progress_counts'
+    team_id = db.Column(db.Integer, db.ForeignKey('team.id'), primary_key=True)
+    boss_fight_id = db.Column(db.Integer, db.ForeignKey('boss_fight.id'), primary_key=True, index=True)
+    completed_steps = db.Column(db.Integer, nullable=False, default=0)
+
 class ScavengerHunt(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), unique=True, nullable=False)
@@ -292,9 +367,12 @@ class GlobalEvent(db.Model):
     end_date = db.Column(db.DateTime, nullable=False)
     is_active = db.Column(db.Boolean, default=False)
     reward_points_on_win = db.Column(db.Integer, default=200)
+    defeated_at = db.Column(db.DateTime, nullable=True) # Preenchido uma única vez, pelo golpe que zera a vida
+    finalized_at = db.Column(db.DateTime, nullable=True) # Recompensas distribuídas e ranking congelado
     # Poderíamos adicionar uma conquista aqui também no futuro
     
 class GlobalEventContribution(db.Model):
+    __table_args__ = (db.UniqueConstraint('event_id', 'user_id', name='uq_global_event_contribution_user'),)
     id = db.Column(db.Integer, primary_key=True)
     event_id = db.Column(db.Integer, db.ForeignKey('global_event.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -302,6 +380,18 @@ class GlobalEventContribution(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     event = db.relationship('GlobalEvent', backref=db.backref('contributions', cascade='all, delete-orphan'))
     user = db.relationship('User', backref='event_contributions')
+
+class GlobalEventRanking(db.Model):
+    # Ranking de contribuidores congelado quando o evento é finalizado
+    __table_args__ = (db.Index('ix_global_event_ranking_event_rank', 'event_id', 'rank'),)
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('global_event.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    contribution_points = db.Column(db.Integer, nullable=False)
+    reward_points = db.Column(db.Integer, nullable=False, default=0)
+    event = db.relationship('GlobalEvent', backref=db.backref('ranking', cascade='all, delete-orphan'))
+    user = db.relationship('User')
     
 class TeamBattle(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -316,6 +406,40 @@ class TeamBattle(db.Model):
     challenged_team = db.relationship('Team', foreign_keys=[challenged_team_id])
     winner_team = db.relationship('Team', foreign_keys=[winner_team_id])
 
+class JobLock(db.Model):
+    # Bloqueio partilhado entre processos para as tarefas agendadas
+    name = db.Column(db.String(100), primary_key=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    owner = db.Column(db.String(100), nullable=True)
+
+class ImportJob(db.Model):
+    # Importação executada em segundo plano (ex.: FAQs extraídas de um PDF), com progresso para o admin
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    file_name = db.Column(db.String(255), nullable=False)
+    source_path = db.Column(db.String(500), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    total_pages = db.Column(db.Integer, nullable=True)
+    processed_pages = db.Column(db.Integer, nullable=False, default=0)
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    duplicates = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class ContentSyncState(db.Model):
+    # Hash do conteúdo de cada entidade sincronizada a partir de um pacote de conteúdo
+    __tablename__ = 'content_sync_state'
+    entity_type = db.Column(db.String(30), primary_key=True)
+    key_hash = db.Column(db.String(64), primary_key=True)  # SHA-256 do nome/título/pergunta
+    entity_id = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class TeamBattleChallenge(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     battle_id = db.Column(db.Integer, db.ForeignKey('team_battle.id'), nullable=False)
@@ -337,12 +461,114 @@ LEVELS = {
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Nível e equipa vêm na mesma consulta: templates e context processors usam-nos em todos os pedidos
+    return User.query.options(joinedload(User.level), joinedload(User.team)).filter_by(id=int(user_id)).first()
+
+def ensure_column(column):
+    """Adiciona a coluna à tabela existente se ela ainda não existir (o db.create_all não altera tabelas)."""
+    table_name = column.table.name
+    existing = {c['name'] for c in db.inspect(db.engine).get_columns(table_name)}
+    if column.name not in existing:
+        column_type = column.type.compile(dialect=db.engine.dialect)
+        # Nomes citados pelo dialeto: 'user', por exemplo, é palavra reservada no PostgreSQL
+        preparer = db.engine.dialect.identifier_preparer
+        db.session.execute(text(f'ALTER TABLE {preparer.format_table(column.table)} '
+                                f'ADD COLUMN {preparer.format_column(column)} {column_type}'))
+        db.session.commit()
+
+def ensure_unique_index(table, name, columns, dedupe_sql=()):
+    """
+    Cria um índice único em tabelas existentes. As instruções de dedupe_sql são
+    executadas antes, para resolver duplicados criados pelo código antigo.
+    """
+    inspector = db.inspect(db.engine)
+    existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+    existing |= {uc['name'] for uc in inspector.get_unique_constraints(table.name)}
+    if name in existing:
+        return
+    for statement in dedupe_sql:
+        db.session.execute(text(statement))
+    preparer = db.engine.dialect.identifier_preparer
+    db.session.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS {preparer.quote(name)} ON {preparer.format_table(table)} '
+                            f'({", ".join(preparer.quote(column) for column in columns)})'))
+    db.session.commit()
+
+def migrate_faq_attachments():
+    """
+    Move para o armazenamento de anexos o conteúdo ainda guardado na base de dados
+    (antiga coluna faq.file_data e coluna faq_attachment.data), um anexo de cada vez
+    para limitar a memória e permitir retomar a migração, e remove essas colunas.
+    """
+    inspector = db.inspect(db.engine)
+    if 'file_data' in {c['name'] for c in inspector.get_columns('faq')}:
+        faq_ids = [row[0] for row in db.session.execute(text('SELECT id FROM faq WHERE file_data IS NOT NULL'))]
+        for faq_id in faq_ids:
+            row = db.session.execute(text('SELECT file_data, file_name FROM faq WHERE id = :id'), {'id': faq_id}).one()
+            if db.session.get(FAQAttachment, faq_id) is None:
+                sha256, size = store_attachment(io.BytesIO(row.file_data), row.file_name)
+                db.session.add(FAQAttachment(faq_id=faq_id, sha256=sha256, size=size))
+            db.session.execute(text('UPDATE faq SET file_data = NULL WHERE id = :id'), {'id': faq_id})
+            db.session.commit()
+            db.session.expunge_all()
+        drop_column('faq', 'file_data')
+    if 'data' in {c['name'] for c in inspector.get_columns('faq_attachment')}:
+        pending = db.session.execute(text(
+            'SELECT faq_id FROM faq_attachment WHERE sha256 NOT IN (SELECT sha256 FROM attachment_blob)'))
+        for faq_id in [row[0] for row in pending]:
+            row = db.session.execute(text(
+                'SELECT a.data, f.file_name FROM faq_attachment a JOIN faq f ON f.id = a.faq_id WHERE a.faq_id = :id'
+            ), {'id': faq_id}).one()
+            sha256, size = store_attachment(io.BytesIO(row.data), row.file_name)
+            db.session.execute(text('UPDATE faq_attachment SET sha256 = :sha256, size = :size WHERE faq_id = :id'),
+                               {'sha256': sha256, 'size': size, 'id': faq_id})
+            db.session.commit()
+        if not drop_column('faq_attachment', 'data'):
+            db.session.execute(text('UPDATE faq_attachment SET data = :empty'), {'empty': b''})
+            db.session.commit()
+
+def drop_column(table_name, column_name):
+    """Remove a coluna; devolve False se a base de dados não o suportar (SQLite antigo)."""
+    try:
+        preparer = db.engine.dialect.identifier_preparer
+        db.session.execute(text(f'ALTER TABLE {preparer.quote(table_name)} DROP COLUMN {preparer.quote(column_name)}'))
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        return False
+
+def upgrade_schema():
+    """Aplica às bases de dados existentes as colunas e restrições adicionadas aos modelos."""
+    migrate_faq_attachments()
+    ensure_column(GlobalEvent.__table__.c.defeated_at)
+    ensure_column(GlobalEvent.__table__.c.finalized_at)
+    ensure_column(Achievement.__table__.c.backfill_requested_at)
+    ensure_unique_index(GlobalEventContribution.__table__, 'uq_global_event_contribution_user', ['event_id', 'user_id'], dedupe_sql=(
+        """UPDATE global_event_contribution SET contribution_points = (
+               SELECT SUM(c2.contribution_points) FROM global_event_contribution c2
+               WHERE c2.event_id = global_event_contribution.event_id AND c2.user_id = global_event_contribution.user_id)
+           WHERE id IN (SELECT MIN(id) FROM global_event_contribution GROUP BY event_id, user_id HAVING COUNT(*) > 1)""",
+        """DELETE FROM global_event_contribution
+           WHERE id NOT IN (SELECT MIN(id) FROM global_event_contribution GROUP BY event_id, user_id)""",
+    ))
+    # Conclusões duplicadas (criadas por submissões concorrentes) são removidas, mantendo a primeira
+    for model, name, columns in (
+        (UserChallenge, 'uq_user_challenge_user_challenge', ['user_id', 'challenge_id']),
+        (UserPathProgress, 'uq_user_path_progress_user_path', ['user_id', 'path_id']),
+        (UserAchievement, 'uq_user_achievement_user_achievement', ['user_id', 'achievement_id']),
+        (TeamBossProgress, 'uq_team_boss_progress_team_step', ['team_id', 'step_id']),
+        (TeamBossCompletion, 'uq_team_boss_completion_team_boss', ['team_id', 'boss_fight_id']),
+    ):
+        table = model.__table__.name
+        ensure_unique_index(model.__table__, name, columns, dedupe_sql=(
+            f'DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {", ".join(columns)})',
+        ))
 
 def initialize_database():
     """Inicializa o banco de dados com dados padrão"""
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         
         for level_name, level_data in LEVELS.items():
             if not Level.query.filter_by(name=level_name).first():
@@ -355,7 +581,14 @@ def initialize_database():
                 category = Category(name=category_name)
                 db.session.add(category)
         
+        # Preenche o progresso materializado das trilhas em bases de dados já existentes
+        if not db.session.query(UserPathProgressCount.user_id).first() and db.session.query(UserChallenge.id).first():
+            rebuild_path_progress_counts()
+        if not db.session.query(TeamBossProgressCount.team_id).first() and db.session.query(TeamBossProgress.id).first():
+            rebuild_boss_progress_counts()
+        
         db.session.commit()
+        invalidate_path_index()
     
 def generate_invitation_code():
     """Gera um código de convite único."""
@@ -396,11 +629,8 @@ def suggest_solution(message):
 def extract_faqs_from_pdf(file_path):
     try:
         faqs = []
-        pdf_reader = PdfReader(file_path)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        lines = [line.strip() for line in text.split("\n") if line.strip()]
+        lines = [line.strip() for page_text in extract_pdf_text(file_path)
+                 for line in page_text.split("\n") if line.strip()]
         for i in range(0, len(lines) - 1, 2):
             question = lines[i]
             answer = lines[i + 1]
@@ -422,6 +652,169 @@ def is_video_url(url):
     video_extensions = ('.mp4', '.webm', '.ogg')
     return any(url.lower().endswith(ext) for ext in video_extensions) or 'youtube.com' in url.lower() or 'youtu.be' in url.lower()
 
+# --- ARMAZENAMENTO DE ANEXOS ---
+ATTACHMENT_CHUNK_SIZE = 256 * 1024
+ATTACHMENT_ORPHAN_GRACE_SECONDS = 3600
+ATTACHMENT_MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/xml', 'application/javascript', 'application/rtf', 'image/svg+xml'}
+
+def attachment_path(sha256, compression=None):
+    path = os.path.join(app.config['ATTACHMENT_STORE_DIR'], sha256[:2], sha256[2:4], sha256)
+    return path + '.gz' if compression == 'gzip' else path
+
+def is_compressible(file_name):
+    mimetype = mimetypes.guess_type(file_name or '')[0] or ''
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES
+
+def store_attachment(stream, file_name):
+    """
+    Guarda o conteúdo de `stream` no armazenamento endereçado por SHA-256, lido e escrito
+    em blocos. Conteúdo repetido fica guardado uma só vez (a referência é contada em
+    attachment_blob) e os tipos de texto ficam comprimidos com gzip quando compensa.
+    Devolve (sha256, tamanho original). Não faz commit.
+    """
+    store_dir = app.config['ATTACHMENT_STORE_DIR']
+    os.makedirs(store_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=store_dir, prefix='upload-', delete=False) as temp:
+        for chunk in iter(lambda: stream.read(ATTACHMENT_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            temp.write(chunk)
+            size += len(chunk)
+    sha256 = digest.hexdigest()
+    compressed_path = temp.name + '.gz'
+    try:
+        compression, stored_size, source = None, size, temp.name
+        if size >= ATTACHMENT_MIN_COMPRESS_SIZE and is_compressible(file_name):
+            with open(temp.name, 'rb') as raw, gzip.open(compressed_path, 'wb') as compressed:
+                shutil.copyfileobj(raw, compressed, ATTACHMENT_CHUNK_SIZE)
+            if os.path.getsize(compressed_path) < size * 0.9:
+                compression, stored_size, source = 'gzip', os.path.getsize(compressed_path), compressed_path
+        stmt = dialect_insert(AttachmentBlob).values(
+            sha256=sha256, size=size, stored_size=stored_size, compression=compression,
+            ref_count=1, created_at=datetime.utcnow()
+        ).on_conflict_do_update(
+            index_elements=['sha256'],
+            set_={'ref_count': AttachmentBlob.__table__.c.ref_count + 1}
+        ).returning(AttachmentBlob.__table__.c.compression)
+        # Se o conteúdo já existia, vale a forma em que foi guardado da primeira vez. O ficheiro é
+        # sempre (re)escrito depois do upsert, com a linha já bloqueada: se o upsert reavivar uma
+        # linha que collect_orphan_attachments acabou de apagar, o ficheiro volta a existir
+        compression = db.session.execute(stmt).scalar()
+        if compression == 'gzip' and source != compressed_path:
+            with open(temp.name, 'rb') as raw, gzip.open(compressed_path, 'wb') as compressed:
+                shutil.copyfileobj(raw, compressed, ATTACHMENT_CHUNK_SIZE)
+            source = compressed_path
+        elif compression is None:
+            source = temp.name
+        path = attachment_path(sha256, compression)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source, path)
+    finally:
+        for leftover in (temp.name, compressed_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return sha256, size
+
+def release_attachment(sha256):
+    """Retira uma referência ao conteúdo; o ficheiro é apagado por collect_orphan_attachments."""
+    db.session.execute(update(AttachmentBlob).where(AttachmentBlob.sha256 == sha256)
+                       .values(ref_count=AttachmentBlob.ref_count - 1))
+
+def set_faq_attachment(faq, file_name, stream):
+    """Guarda (ou substitui) o anexo da FAQ, libertando a referência ao conteúdo anterior."""
+    sha256, size = store_attachment(stream, file_name)
+    if faq.attachment is not None:
+        release_attachment(faq.attachment.sha256)
+    faq.file_name = file_name
+    faq.attachment = FAQAttachment(sha256=sha256, size=size)
+    return faq.attachment
+
+def release_faq_attachments(faq_ids):
+    """Liberta as referências aos anexos das FAQ que vão ser apagadas. Devolve os sha256 afetados."""
+    counts = db.session.query(FAQAttachment.sha256, func.count()).filter(FAQAttachment.faq_id.in_(faq_ids))\
+        .group_by(FAQAttachment.sha256).all()
+    for sha256, references in counts:
+        db.session.execute(update(AttachmentBlob).where(AttachmentBlob.sha256 == sha256)
+                           .values(ref_count=AttachmentBlob.ref_count - references))
+    return [sha256 for sha256, _ in counts]
+
+def collect_orphan_attachments(sha256s=None):
+    """
+    Apaga os conteúdos sem referências (linha e ficheiro). Sem argumentos, corrige antes as
+    contagens a partir de faq_attachment e remove também ficheiros perdidos no armazenamento
+    (uploads interrompidos) com mais de uma hora. Devolve quantos ficheiros foram apagados.
+    """
+    if sha256s is None:
+        references = select(func.count(FAQAttachment.faq_id)).where(FAQAttachment.sha256 == AttachmentBlob.sha256).scalar_subquery()
+        db.session.execute(update(AttachmentBlob).where(AttachmentBlob.ref_count != references)
+                           .values(ref_count=references).execution_options(synchronize_session=False))
+    stmt = delete(AttachmentBlob).where(AttachmentBlob.ref_count <= 0)
+    if sha256s is not None:
+        if not sha256s:
+            return 0
+        stmt = stmt.where(AttachmentBlob.sha256.in_(sha256s))
+    orphans = db.session.execute(stmt.returning(AttachmentBlob.sha256, AttachmentBlob.compression)
+                                 .execution_options(synchronize_session=False)).all()
+    # Os ficheiros são apagados antes do commit, com as linhas ainda bloqueadas pelo DELETE:
+    # um upload concorrente do mesmo conteúdo espera pelo commit e só depois volta a escrever o ficheiro
+    removed = 0
+    for orphan in orphans:
+        path = attachment_path(orphan.sha256, orphan.compression)
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    db.session.commit()
+    if sha256s is None:
+        removed += sweep_attachment_store()
+    return removed
+
+def sweep_attachment_store():
+    """Remove do disco ficheiros sem linha em attachment_blob, mais antigos que o período de graça."""
+    store_dir = app.config['ATTACHMENT_STORE_DIR']
+    if not os.path.isdir(store_dir):
+        return 0
+    cutoff = time.time() - ATTACHMENT_ORPHAN_GRACE_SECONDS
+    candidates = {}
+    for directory, _, file_names in os.walk(store_dir):
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            if os.path.getmtime(path) < cutoff:
+                candidates[path] = file_name.split('.')[0]
+    known = set()
+    hashes = list(set(candidates.values()))
+    for start in range(0, len(hashes), 500):
+        known.update(row.sha256 for row in db.session.query(AttachmentBlob.sha256)
+                     .filter(AttachmentBlob.sha256.in_(hashes[start:start + 500])))
+    removed = 0
+    for path, sha256 in candidates.items():
+        if sha256 not in known:
+            os.remove(path)
+            removed += 1
+    return removed
+
+def send_faq_attachment(file_name, sha256, size, compression, modified_at):
+    """
+    Resposta de download do anexo com ETag (SHA-256 do conteúdo), pedidos condicionais (304)
+    e Range. Conteúdo não comprimido é enviado a partir do ficheiro (sendfile/X-Sendfile);
+    o comprimido é descomprimido em streaming.
+    """
+    path = attachment_path(sha256, compression)
+    if compression is None:
+        response = send_file(path, download_name=file_name, as_attachment=True, conditional=True,
+                             etag=sha256, last_modified=modified_at)
+        response.accept_ranges = 'bytes'
+        return response
+    stream = gzip.open(path, 'rb')
+    response = send_file(stream, download_name=file_name, as_attachment=True, conditional=False, etag=False)
+    response.response = wrap_file(request.environ, stream, buffer_size=ATTACHMENT_CHUNK_SIZE)
+    response.content_length = size
+    response.last_modified = modified_at
+    response.set_etag(sha256)
+    response.accept_ranges = 'bytes'
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=size)
+
 def format_faq_response(faq_id, question, answer, image_url=None, video_url=None, file_name=None):
     formatted_response = f"<strong>{question}</strong><br><br>"
     has_sections = any(section in answer for section in ["Pré-requisitos:", "Etapa", "Atenção:", "Finalizar:", "Pós-instalação:"])
@@ -462,23 +855,1356 @@ def format_faq_response(faq_id, question, answer, image_url=None, video_url=None
     
     return formatted_response
 
-def get_or_create_daily_challenge():
+DAILY_CHALLENGE_PLAN_DAYS = int(os.getenv('DAILY_CHALLENGE_PLAN_DAYS', 7))
+DAILY_CHALLENGE_REPEAT_WINDOW_DAYS = 30
+
+def plan_daily_challenges(days=DAILY_CHALLENGE_PLAN_DAYS, start=None):
+    """
+    Agenda o desafio do dia para os próximos `days` dias (a partir de hoje) que ainda não o têm.
+    A escolha é feita em SQL (ORDER BY random()), excluindo os desafios usados nos 30 dias
+    anteriores enquanto houver alternativas; o ON CONFLICT no dia torna a criação concorrente segura.
+    Devolve quantos dias foram agendados.
+    """
+    start = start or date.today()
+    planned_days = {row.day for row in db.session.query(DailyChallenge.day).filter(
+        DailyChallenge.day >= start, DailyChallenge.day < start + timedelta(days=days))}
+    planned = 0
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        if day in planned_days:
+            continue
+        last_used = select(func.max(DailyChallenge.day)).where(
+            DailyChallenge.challenge_id == Challenge.id,
+            DailyChallenge.day > day - timedelta(days=DAILY_CHALLENGE_REPEAT_WINDOW_DAYS),
+            DailyChallenge.day < day
+        ).scalar_subquery()
+        # Desafios usados nos últimos 30 dias só são escolhidos se não houver mais nenhum,
+        # e nesse caso o usado há mais tempo (o WHERE evita a ambiguidade do upsert no SQLite)
+        candidate = select(db.literal(day), Challenge.id).where(Challenge.id.isnot(None))\
+            .order_by(last_used.nulls_first(), func.random()).limit(1)
+        stmt = dialect_insert(DailyChallenge).from_select(['day', 'challenge_id'], candidate)\
+            .on_conflict_do_nothing(index_elements=['day'])
+        planned += db.session.execute(stmt).rowcount
+    db.session.commit()
+    return planned
+
+# --- IMPORTAÇÃO DE FAQ ---
+FAQ_IMPORT_BATCH_SIZE = int(os.getenv('FAQ_IMPORT_BATCH_SIZE', 1000))
+FAQ_IMPORT_READ_SIZE = 64 * 1024
+FAQ_IMPORT_MAX_ERRORS = 10
+# Tamanho máximo de um elemento da lista JSON; acima disto o elemento é dado como inválido
+FAQ_IMPORT_MAX_ITEM_SIZE = int(os.getenv('FAQ_IMPORT_MAX_ITEM_SIZE', 1024 * 1024))
+
+def iter_json_array(stream, read_size=FAQ_IMPORT_READ_SIZE):
+    """
+    Lê incrementalmente uma lista JSON (`[{...}, {...}]`) de um ficheiro binário e devolve
+    um elemento de cada vez. Só o elemento corrente e um bloco de leitura ficam em memória;
+    um elemento inválido é rejeitado logo que o erro não possa ser só o fim do bloco lido.
+    """
+    reader = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    # Estado do analisador: 'start' (antes de '['), 'first' (elemento ou ']'), 'value' (elemento,
+    # depois de uma vírgula) ou 'separator' (',' ou ']', depois de um elemento)
+    state = 'start'
+    count = 0
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('JSON incompleto: a lista de FAQs não foi fechada.')
+            chunk = reader.read(read_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        char = buffer[pos]
+        if state == 'start':
+            if char != '[':
+                raise ValueError('O ficheiro JSON deve conter uma lista de FAQs.')
+            state = 'first'
+            pos += 1
+        elif char == ']' and state != 'value':
+            # Depois da lista só pode haver espaço em branco até ao fim do ficheiro
+            rest = buffer[pos + 1:]
+            while True:
+                if rest.strip():
+                    raise ValueError('JSON inválido: conteúdo depois do fim da lista de FAQs.')
+                rest = reader.read(read_size)
+                if not rest:
+                    return
+        elif state == 'separator':
+            if char != ',':
+                raise ValueError(f'JSON inválido: esperava "," ou "]" e encontrou {char!r}.')
+            state = 'value'
+            pos += 1
+        elif char == ']':
+            raise ValueError(f'JSON inválido: falta o elemento {count + 1} depois da vírgula.')
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # Um erro longe do fim do bloco (exceto uma string por fechar, que o JSON indica no
+                # início da string) ou um elemento demasiado grande não se resolvem lendo mais
+                truncated = e.msg.startswith('Unterminated string') or e.pos >= len(buffer) - 64
+                if eof or not truncated or len(buffer) - pos > FAQ_IMPORT_MAX_ITEM_SIZE:
+                    raise ValueError(f'JSON inválido no elemento {count + 1} da lista: {e.msg}.') from None
+                end = None
+            # Elemento incompleto ou que pode continuar no bloco seguinte (um número cortado no fim do
+            # bloco ou antes do '.', do expoente ou do sinal): lê mais e tenta outra vez
+            if end is None or (not eof and (end == len(buffer) or not buffer[end:].strip('.eE+-'))):
+                chunk = reader.read(read_size)
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            yield item
+            pos, state, count = end, 'separator', count + 1
+
+def iter_csv_rows(stream):
+    """Lê um CSV com cabeçalho linha a linha a partir de um ficheiro binário."""
+    return csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+
+def clean_faq_row(row):
+    """Valida uma linha importada; devolve (valores, None) ou (None, motivo)."""
+    if not isinstance(row, dict):
+        return None, 'não é um objeto'
+    values = {}
+    for field in ('question', 'answer'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, f'campo "{field}" em falta'
+        values[field] = value.strip()
+    for field in ('image_url', 'video_url'):
+        value = row.get(field)
+        if value is not None and not isinstance(value, str):
+            return None, f'campo "{field}" inválido'
+        value = (value or '').strip() or None
+        if value and len(value) > 500:
+            return None, f'campo "{field}" com mais de 500 caracteres'
+        values[field] = value
+    return values, None
+
+def import_faq_rows(rows, category_id, batch_size=FAQ_IMPORT_BATCH_SIZE, progress=None):
+    """
+    Importa FAQs de um iterável de linhas (dicts) para a categoria indicada, em lotes de
+    `batch_size`: cada lote é validado, deduplicado (pela pergunta, no ficheiro e contra as
+    FAQs já existentes na categoria), inserido com um único INSERT e confirmado. `progress`
+    é chamado com as estatísticas no fim de cada lote.
+    Devolve {'read', 'imported', 'duplicates', 'invalid', 'errors'}.
+    """
+    stats = {'read': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'errors': []}
+    # Resumos das perguntas já vistas, para deduplicar sem guardar o texto completo
+    seen = set()
+    batch = []
+
+    def flush():
+        existing = {row.question for row in db.session.query(FAQ.question).filter(
+            FAQ.category_id == category_id, FAQ.question.in_([values['question'] for values in batch]))}
+        fresh = [values for values in batch if values['question'] not in existing]
+        stats['duplicates'] += len(batch) - len(fresh)
+        if fresh:
+            now = datetime.utcnow()
+            db.session.execute(insert(FAQ), [dict(values, category_id=category_id, created_at=now) for values in fresh])
+        db.session.commit()
+        stats['imported'] += len(fresh)
+        batch.clear()
+        if progress:
+            progress(stats)
+
+    for row in rows:
+        stats['read'] += 1
+        values, error = clean_faq_row(row)
+        if error:
+            stats['invalid'] += 1
+            if len(stats['errors']) < FAQ_IMPORT_MAX_ERRORS:
+                stats['errors'].append(f'Linha {stats["read"]}: {error}')
+            continue
+        key = hashlib.sha1(values['question'].encode('utf-8')).digest()
+        if key in seen:
+            stats['duplicates'] += 1
+            continue
+        seen.add(key)
+        batch.append(values)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return stats
+
+def import_faqs_from_file(stream, file_format, category_id, batch_size=FAQ_IMPORT_BATCH_SIZE, progress=None):
+    """Importa FAQs de um ficheiro JSON (lista de objetos) ou CSV (com cabeçalho) lido em streaming."""
+    rows = iter_json_array(stream) if file_format == 'json' else iter_csv_rows(stream)
+    return import_faq_rows(rows, category_id, batch_size=batch_size, progress=progress)
+
+# --- EXPORTAÇÃO DE FAQ ---
+FAQ_EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+FAQ_EXPORT_FIELDS = ['category', 'question', 'answer', 'image_url', 'video_url']
+FAQ_EXPORT_BATCH_SIZE = 1000
+FAQ_EXPORT_FLUSH_SIZE = 64 * 1024
+
+def iter_faq_export_rows():
+    """
+    FAQs com o nome da categoria (JOIN), só com as colunas exportadas e lidas em blocos
+    de um cursor do lado do servidor (yield_per): a memória não depende do número de FAQs.
+    """
+    query = db.session.query(Category.name, FAQ.question, FAQ.answer, FAQ.image_url, FAQ.video_url)\
+        .join(Category, Category.id == FAQ.category_id).order_by(FAQ.id)\
+        .execution_options(yield_per=FAQ_EXPORT_BATCH_SIZE)
+    for row in query:
+        yield dict(zip(FAQ_EXPORT_FIELDS, row))
+
+def serialize_faq_export(rows, file_format):
+    """Converte as linhas em blocos de texto (~64 KB) no formato pedido: json (lista), ndjson ou csv."""
+    buffer = io.StringIO()
+    if file_format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=FAQ_EXPORT_FIELDS)
+        writer.writeheader()
+    elif file_format == 'json':
+        buffer.write('[')
+    first = True
+    for row in rows:
+        if file_format == 'csv':
+            writer.writerow(row)
+        elif file_format == 'json':
+            buffer.write(('\n' if first else ',\n') + json.dumps(row, ensure_ascii=False))
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+        first = False
+        if buffer.tell() >= FAQ_EXPORT_FLUSH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if file_format == 'json':
+        buffer.write('\n]\n')
+    yield buffer.getvalue()
+
+def encode_export(chunks, compress=False):
+    """Codifica os blocos em UTF-8 e, se pedido, comprime-os em gzip à medida que são gerados."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+def export_faqs_stream(file_format='json', compress=False):
+    return encode_export(serialize_faq_export(iter_faq_export_rows(), file_format), compress)
+
+# --- IMPORTAÇÃO DE PDF EM SEGUNDO PLANO ---
+PDF_IMPORT_WORKERS = int(os.getenv('PDF_IMPORT_WORKERS', min(4, os.cpu_count() or 1)))
+PDF_IMPORT_PAGES_PER_TASK = 8
+PDF_IMPORT_SENTENCE_BATCH = 32
+PDF_IMPORT_STALE_SECONDS = 900
+# Os processos do pool são arrancados com 'spawn' (um fork a partir de uma thread do servidor pode
+# herdar bloqueios de outras threads): importam este módulo, mas não inicializam a base de dados
+# nem o agendador
+PDF_IMPORT_MP_CONTEXT = multiprocessing.get_context('spawn')
+IS_WORKER_PROCESS = multiprocessing.parent_process() is not None
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+_sentence_nlp = None
+
+def extract_pdf_pages(path, start, stop):
+    """Extrai o texto das páginas [start, stop) do PDF. Corre nos processos do pool."""
+    reader = PdfReader(path)
+    return [reader.pages[number].extract_text() or '' for number in range(start, stop)]
+
+def count_pdf_pages(path):
+    return len(PdfReader(path).pages)
+
+def iter_pdf_page_chunks(path, total_pages, workers=PDF_IMPORT_WORKERS):
+    """
+    Devolve, por ordem, listas com o texto de PDF_IMPORT_PAGES_PER_TASK páginas. Com mais
+    de um worker a extração é repartida por um pool de processos (o PyPDF2 é CPU-bound).
+    """
+    ranges = [(start, min(start + PDF_IMPORT_PAGES_PER_TASK, total_pages))
+              for start in range(0, total_pages, PDF_IMPORT_PAGES_PER_TASK)]
+    if workers <= 1 or len(ranges) <= 1:
+        for start, stop in ranges:
+            yield extract_pdf_pages(path, start, stop)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=PDF_IMPORT_MP_CONTEXT) as executor:
+        yield from executor.map(extract_pdf_pages, [path] * len(ranges),
+                                [start for start, _ in ranges], [stop for _, stop in ranges])
+
+def extract_pdf_text(path):
+    """Lista com o texto de cada página do PDF."""
+    return [text for chunk in iter_pdf_page_chunks(path, count_pdf_pages(path)) for text in chunk]
+
+def split_sentences(texts):
+    """
+    Para cada texto devolve a lista das suas frases. Com spaCy usa um pipeline só com o
+    `sentencizer` (sem parser) processado em lotes com nlp.pipe; sem spaCy, uma regra simples.
+    """
+    global _sentence_nlp
+    if not SPACY_AVAILABLE:
+        for page_text in texts:
+            yield [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(page_text) if sentence.strip()]
+        return
+    if _sentence_nlp is None:
+        sentence_nlp = spacy.blank('pt')
+        sentence_nlp.add_pipe('sentencizer')
+        _sentence_nlp = sentence_nlp
+    for doc in _sentence_nlp.pipe(texts, batch_size=PDF_IMPORT_SENTENCE_BATCH):
+        yield [sentence.text.strip() for sentence in doc.sents if sentence.text.strip()]
+
+def update_import_job(job_id, **values):
+    db.session.execute(update(ImportJob).where(ImportJob.id == job_id)
+                       .values(updated_at=datetime.utcnow(), **values)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+
+def claim_import_job(job_id):
+    """Passa a tarefa de pendente a em execução; só um processo/thread a consegue obter."""
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(ImportJob).where(ImportJob.id == job_id, ImportJob.status == 'pending')
+        .values(status='running', started_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+    db.session.commit()
+    return claimed
+
+def run_pdf_import_job(job_id):
+    """
+    Extrai as frases do PDF da tarefa e importa-as como FAQs (em lotes, com deduplicação),
+    atualizando o progresso à medida que as páginas são processadas.
+    """
+    if not claim_import_job(job_id):
+        return False
+    job = db.session.get(ImportJob, job_id)
+    path, category_id = job.source_path, job.category_id
+    try:
+        total_pages = count_pdf_pages(path)
+        update_import_job(job_id, total_pages=total_pages)
+        processed = {'pages': 0}
+
+        def rows():
+            for chunk in iter_pdf_page_chunks(path, total_pages):
+                for sentences in split_sentences(chunk):
+                    for sentence in sentences:
+                        yield {'question': sentence[:200], 'answer': sentence}
+                processed['pages'] += len(chunk)
+                update_import_job(job_id, processed_pages=processed['pages'])
+
+        def report_progress(stats):
+            update_import_job(job_id, imported=stats['imported'], duplicates=stats['duplicates'])
+
+        stats = import_faq_rows(rows(), category_id, progress=report_progress)
+        update_import_job(job_id, status='done', imported=stats['imported'], duplicates=stats['duplicates'],
+                          finished_at=datetime.utcnow())
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception(f'Erro na importação {job_id}')
+        update_import_job(job_id, status='failed', message=str(e)[:1000], finished_at=datetime.utcnow())
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+def create_pdf_import_job(stream, file_name, category_id, user_id=None):
+    """Guarda o PDF enviado em IMPORT_DIR e regista a tarefa pendente. Faz commit."""
+    os.makedirs(app.config['IMPORT_DIR'], exist_ok=True)
+    path = os.path.join(app.config['IMPORT_DIR'], f'{uuid.uuid4().hex}.pdf')
+    with open(path, 'wb') as target:
+        shutil.copyfileobj(stream, target, ATTACHMENT_CHUNK_SIZE)
+    job = ImportJob(kind='faq_pdf', file_name=file_name, source_path=path, category_id=category_id, created_by=user_id)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def start_import_job(job_id):
+    """Executa a tarefa numa thread, fora do pedido HTTP."""
+    def work():
+        with app.app_context():
+            run_pdf_import_job(job_id)
+            db.session.remove()
+    threading.Thread(target=work, name=f'import-job-{job_id}', daemon=True).start()
+
+def process_import_jobs():
+    """
+    Tarefa agendada: executa as importações pendentes (ex.: o processo que as recebeu terminou
+    antes de as iniciar) e marca como falhadas as que deixaram de dar sinal de vida.
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=PDF_IMPORT_STALE_SECONDS)
+    db.session.execute(
+        update(ImportJob).where(ImportJob.status == 'running', ImportJob.updated_at < stale_before)
+        .values(status='failed', message='A importação foi interrompida.', finished_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    pending = [row.id for row in db.session.query(ImportJob.id).filter(ImportJob.status == 'pending').order_by(ImportJob.id)]
+    return sum(1 for job_id in pending if run_pdf_import_job(job_id))
+
+def import_job_as_dict(job):
+    return {
+        'id': job.id,
+        'file_name': job.file_name,
+        'status': job.status,
+        'total_pages': job.total_pages,
+        'processed_pages': job.processed_pages,
+        'imported': job.imported,
+        'duplicates': job.duplicates,
+        'message': job.message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+# --- IMPORTAÇÃO DE PACOTES DE CONTEÚDO ---
+# Secções do pacote: (rótulo, modelo, campo que identifica o item)
+CONTENT_SECTIONS = {
+    'faqs': ('FAQs', FAQ, 'question'),
+    'desafios': ('Desafios', Challenge, 'title'),
+    'trilhas': ('Trilhas', LearningPath, 'name'),
+    'boss_fights': ('Boss Fights', BossFight, 'name'),
+    'caca_tesouros': ('Caças ao Tesouro', ScavengerHunt, 'name'),
+    'eventos_globais': ('Eventos Globais', GlobalEvent, 'name'),
+}
+CONTENT_LOOKUP_CHUNK = 500
+
+def content_values(model, data):
+    """Só os campos do pacote que são colunas do modelo (sem o id)."""
+    columns = model.__table__.columns
+    return {key: value for key, value in data.items() if key in columns and key != 'id'}
+
+def missing_fields(model, values, provided=()):
+    return [column.name for column in model.__table__.columns
+            if not column.nullable and column.default is None and not column.primary_key
+            and column.name not in values and column.name not in provided]
+
+def existing_keys(column, values, *extra_columns):
+    """
+    Valores de `column` (de entre `values`) que já existem, com um IN por bloco de 500.
+    Com `extra_columns` devolve um dict valor -> (colunas extra).
+    """
+    values = list(set(values))
+    found = {}
+    for start in range(0, len(values), CONTENT_LOOKUP_CHUNK):
+        query = db.session.query(column, *extra_columns).filter(column.in_(values[start:start + CONTENT_LOOKUP_CHUNK]))
+        for row in query:
+            found[row[0]] = row[1:]
+    return found if extra_columns else set(found)
+
+def check_children(item, child_key, child_model, provided):
+    children = item.get(child_key) or []
+    if not isinstance(children, list) or not all(isinstance(child, dict) for child in children):
+        return f'"{child_key}" inválido'
+    for child in children:
+        missing = missing_fields(child_model, content_values(child_model, child), provided)
+        if missing:
+            return f'{child_key}: falta {", ".join(missing)}'
+
+def prepare_content_item(section, item, values):
+    """Validações e conversões específicas de cada secção. Devolve o motivo se o item for inválido."""
+    if section == 'faqs' and not item.get('category'):
+        return 'falta "category"'
+    if section == 'trilhas':
+        return check_children(item, 'challenges', PathChallenge, ('path_id', 'challenge_id'))
+    if section == 'boss_fights':
+        error = check_children(item, 'stages', BossFightStage, ('boss_fight_id',))
+        for stage in item.get('stages') or []:
+            error = error or check_children(stage, 'steps', BossFightStep, ('stage_id',))
+        return error
+    if section == 'caca_tesouros':
+        return check_children(item, 'steps', ScavengerHuntStep, ('hunt_id',))
+    if section == 'eventos_globais':
+        try:
+            values['start_date'] = datetime.fromisoformat(item['start_date'])
+            values['end_date'] = datetime.fromisoformat(item['end_date'])
+        except (KeyError, TypeError, ValueError):
+            return 'datas inválidas'
+        values['current_hp'] = values.get('total_hp')
+
+# Colunas preenchidas pelo importador e não pelo pacote
+CONTENT_PROVIDED_FIELDS = {'faqs': ('category_id',), 'eventos_globais': ('current_hp', 'start_date', 'end_date')}
+
+def validate_content_items(section, items, warnings):
+    """
+    Valida os itens de uma secção do pacote. Devolve ([(item, valores das colunas)], inválidos);
+    os motivos vão para `warnings`.
+    """
+    label, model, key = CONTENT_SECTIONS[section]
+    valid, invalid = [], 0
+    for index, item in enumerate(items or []):
+        values = content_values(model, item) if isinstance(item, dict) else {}
+        error = None if values.get(key) else f'falta "{key}"'
+        if error is None:
+            error = prepare_content_item(section, item, values)
+        missing = missing_fields(model, values, CONTENT_PROVIDED_FIELDS.get(section, ()))
+        if error is None and missing:
+            error = f'falta {", ".join(missing)}'
+        if error:
+            invalid += 1
+            warnings.append(f'{label} #{index + 1}: {error}')
+            continue
+        valid.append((item, values))
+    return valid, invalid
+
+def plan_content_pack(content, sections):
+    """
+    Calcula, sem escrever nada, o que a importação do pacote faria: por secção os itens
+    novos, quantos já existem (pelo nome/título, no pacote ou na base de dados) e quantos são
+    inválidos, mais avisos (ex.: passos de trilhas com desafios desconhecidos).
+    Todas as pesquisas são feitas com um IN por tipo de entidade e só às colunas-chave.
+    """
+    plan = {'sections': {}, 'warnings': []}
+    for section in CONTENT_SECTIONS:
+        if section not in sections:
+            continue
+        key = CONTENT_SECTIONS[section][2]
+        candidates, invalid = validate_content_items(section, content.get(section), plan['warnings'])
+        summary = plan['sections'][section] = {'create': [], 'existing': 0, 'invalid': invalid}
+        existing = existing_keys(getattr(CONTENT_SECTIONS[section][1], key), [values[key] for _, values in candidates])
+        seen = set()
+        for item, values in candidates:
+            if values[key] in existing or values[key] in seen:
+                summary['existing'] += 1
+                continue
+            seen.add(values[key])
+            summary['create'].append((item, values))
+
+    if 'faqs' in plan['sections']:
+        names = {item['category'] for item, _ in plan['sections']['faqs']['create']}
+        known = existing_keys(Category.name, names, Category.id)
+        plan['categories'] = {name: row[0] for name, row in known.items()}
+        plan['new_categories'] = sorted(names - set(known))
+    if 'trilhas' in plan['sections']:
+        paths = plan['sections']['trilhas']['create']
+        titles = {step.get('title') for item, _ in paths for step in item.get('challenges') or []}
+        known = existing_keys(Challenge.title, titles, Challenge.id)
+        plan['challenges'] = {title: row[0] for title, row in known.items()}
+        new_titles = {values['title'] for _, values in plan['sections'].get('desafios', {}).get('create', [])}
+        for item, _ in paths:
+            for step in item.get('challenges') or []:
+                if step.get('title') not in known and step.get('title') not in new_titles:
+                    plan['warnings'].append(f'Trilha "{item["name"]}": desafio "{step.get("title")}" não encontrado')
+    return plan
+
+def insert_returning(model, rows, *columns):
+    """INSERT em massa que devolve as colunas pedidas, pela ordem das linhas."""
+    if not rows:
+        return []
+    stmt = insert(model).returning(*columns, sort_by_parameter_order=True)
+    return db.session.execute(stmt, rows).all()
+
+def path_step_rows(path_id, item, challenge_ids):
+    steps = {}
+    for step in item.get('challenges') or []:
+        challenge_id = challenge_ids.get(step.get('title'))
+        if challenge_id is not None:
+            steps[challenge_id] = step['step']
+    return [{'path_id': path_id, 'challenge_id': challenge_id, 'step': step} for challenge_id, step in steps.items()]
+
+def insert_boss_stages(stages):
+    """Insere as etapas [(dados do pacote, valores)] e as respetivas tarefas."""
+    stage_ids = [row.id for row in insert_returning(BossFightStage, [values for _, values in stages], BossFightStage.id)]
+    steps = [dict(content_values(BossFightStep, step), stage_id=stage_id)
+             for stage_id, (stage, _) in zip(stage_ids, stages) for step in stage.get('steps') or []]
+    if steps:
+        db.session.execute(insert(BossFightStep), steps)
+
+def apply_content_plan(plan):
+    """
+    Aplica o plano de plan_content_pack com INSERTs em massa por tipo de entidade, usando
+    os ids devolvidos (RETURNING) para ligar os filhos; os ids criados ficam em
+    plan['sections'][secção]['ids']. Não faz commit. Devolve {secção: itens criados}.
+    """
+    sections = plan['sections']
+    counts = {section: len(summary['create']) for section, summary in sections.items()}
+    if 'faqs' in sections:
+        categories = dict(plan['categories'])
+        for category_id, name in insert_returning(Category, [{'name': name} for name in plan['new_categories']],
+                                                  Category.id, Category.name):
+            categories[name] = category_id
+        rows = [dict(values, category_id=categories[item['category']]) for item, values in sections['faqs']['create']]
+        sections['faqs']['ids'] = [row.id for row in insert_returning(FAQ, rows, FAQ.id)]
+    challenge_ids = dict(plan.get('challenges', {}))
+    if 'desafios' in sections:
+        created = insert_returning(Challenge, [values for _, values in sections['desafios']['create']],
+                                   Challenge.id, Challenge.title)
+        challenge_ids.update({title: challenge_id for challenge_id, title in created})
+        sections['desafios']['ids'] = [challenge_id for challenge_id, _ in created]
+    if 'trilhas' in sections:
+        created = sections['trilhas']['create']
+        path_ids = sections['trilhas']['ids'] = [row.id for row in insert_returning(LearningPath, [values for _, values in created], LearningPath.id)]
+        steps = [row for path_id, (item, _) in zip(path_ids, created) for row in path_step_rows(path_id, item, challenge_ids)]
+        if steps:
+            db.session.execute(insert(PathChallenge), steps)
+        db.session.flush()
+        rebuild_path_progress_counts(path_ids)
+    if 'boss_fights' in sections:
+        created = sections['boss_fights']['create']
+        boss_ids = sections['boss_fights']['ids'] = [row.id for row in insert_returning(BossFight, [values for _, values in created], BossFight.id)]
+        insert_boss_stages([(stage, dict(content_values(BossFightStage, stage), boss_fight_id=boss_id))
+                            for boss_id, (item, _) in zip(boss_ids, created) for stage in item.get('stages') or []])
+    if 'caca_tesouros' in sections:
+        created = sections['caca_tesouros']['create']
+        hunt_ids = sections['caca_tesouros']['ids'] = [row.id for row in insert_returning(ScavengerHunt, [values for _, values in created], ScavengerHunt.id)]
+        steps = [dict(content_values(ScavengerHuntStep, step), hunt_id=hunt_id)
+                 for hunt_id, (item, _) in zip(hunt_ids, created) for step in item.get('steps') or []]
+        if steps:
+            db.session.execute(insert(ScavengerHuntStep), steps)
+    if 'eventos_globais' in sections:
+        rows = [values for _, values in sections['eventos_globais']['create']]
+        sections['eventos_globais']['ids'] = [row.id for row in insert_returning(GlobalEvent, rows, GlobalEvent.id)]
+    return counts
+
+def content_plan_report(plan):
+    """Resumo do plano para mostrar ao admin (simulação) ou imprimir na linha de comando."""
+    rows = []
+    for section, summary in plan['sections'].items():
+        label, _, key = CONTENT_SECTIONS[section]
+        rows.append({'label': label, 'create': len(summary['create']), 'existing': summary['existing'],
+                     'invalid': summary['invalid'], 'names': [values[key] for _, values in summary['create'][:20]]})
+    return {'rows': rows, 'new_categories': plan.get('new_categories', []), 'warnings': plan['warnings']}
+
+def invalidate_imported_content(counts, boss_ids=()):
+    """Invalida as caches afetadas pela importação. Chamar só depois do commit."""
+    if counts.get('desafios'):
+        invalidate_challenges_cache()
+        invalidate_daily_challenge_cache()
+    if counts.get('trilhas'):
+        invalidate_path_index()
+    if counts.get('eventos_globais'):
+        invalidate_active_event_cache()
+    if counts.get('caca_tesouros'):
+        invalidate_dashboard_cache()
+    for boss_id in boss_ids:
+        invalidate_boss_tree(boss_id)
+
+# --- SINCRONIZAÇÃO DE CONTEÚDO ---
+def content_key_hash(key):
+    return hashlib.sha256(str(key).encode('utf-8')).hexdigest()
+
+def content_hash(item):
+    """Hash do item tal como está no pacote (incluindo filhos), independente da ordem das chaves."""
+    return hashlib.sha256(json.dumps(item, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+def ensure_categories(names):
+    """Devolve {nome: id} das categorias, criando as que faltam."""
+    categories = {name: row[0] for name, row in existing_keys(Category.name, names, Category.id).items()}
+    missing = [{'name': name} for name in sorted(set(names) - set(categories))]
+    for category_id, name in insert_returning(Category, missing, Category.id, Category.name):
+        categories[name] = category_id
+    return categories
+
+def delete_synced_entities(section, ids):
+    """Apaga as entidades (e dependências), como as rotas de administração, mas em massa."""
+    if section == 'faqs':
+        return bulk_delete_faqs(ids, {})
+    if section == 'desafios':
+        bulk_delete_challenges(ids, {})
+    elif section == 'trilhas':
+        for model in (UserPathProgress, UserPathProgressCount, PathChallenge):
+            db.session.execute(delete(model).where(model.path_id.in_(ids)))
+        db.session.execute(delete(LearningPath).where(LearningPath.id.in_(ids)))
+    elif section == 'boss_fights':
+        stage_ids = select(BossFightStage.id).where(BossFightStage.boss_fight_id.in_(ids))
+        delete_boss_steps(select(BossFightStep.id).where(BossFightStep.stage_id.in_(stage_ids)))
+        db.session.execute(delete(BossFightStage).where(BossFightStage.boss_fight_id.in_(ids)))
+        for model in (TeamBossCompletion, TeamBossProgressCount):
+            db.session.execute(delete(model).where(model.boss_fight_id.in_(ids)))
+        db.session.execute(delete(BossFight).where(BossFight.id.in_(ids)))
+    elif section == 'caca_tesouros':
+        for model in (UserHuntProgress, ScavengerHuntStep):
+            db.session.execute(delete(model).where(model.hunt_id.in_(ids)))
+        db.session.execute(delete(ScavengerHunt).where(ScavengerHunt.id.in_(ids)))
+    elif section == 'eventos_globais':
+        for model in (GlobalEventContribution, GlobalEventRanking):
+            db.session.execute(delete(model).where(model.event_id.in_(ids)))
+        db.session.execute(delete(GlobalEvent).where(GlobalEvent.id.in_(ids)))
+    return []
+
+def delete_boss_steps(step_ids):
+    db.session.execute(delete(TeamBossProgress).where(TeamBossProgress.step_id.in_(step_ids)))
+    db.session.execute(delete(BossFightStep).where(BossFightStep.id.in_(step_ids)))
+
+def update_boss_stages(updated):
+    """
+    Acerta as etapas e tarefas dos Boss Fights [(id, dados do pacote)]: etapas emparelhadas pela
+    ordem e tarefas pela posição, para manter o progresso das equipas nas tarefas que não mudam.
+    """
+    boss_ids = [boss_id for boss_id, _ in updated]
+    stages = {}
+    for stage in db.session.query(BossFightStage.id, BossFightStage.boss_fight_id, BossFightStage.order)\
+            .filter(BossFightStage.boss_fight_id.in_(boss_ids)):
+        stages[(stage.boss_fight_id, stage.order)] = stage.id
+    steps = {}
+    for step in db.session.query(BossFightStep.id, BossFightStep.stage_id).filter(BossFightStep.stage_id.in_(stages.values()))\
+            .order_by(BossFightStep.id):
+        steps.setdefault(step.stage_id, []).append(step.id)
+    stage_updates, step_updates, new_steps, new_stages, kept_stages, removed_steps = [], [], [], [], set(), []
+    for boss_id, item in updated:
+        for stage in item.get('stages') or []:
+            values = dict(content_values(BossFightStage, stage), boss_fight_id=boss_id)
+            stage_id = stages.get((boss_id, values['order']))
+            if stage_id is None or stage_id in kept_stages:
+                new_stages.append((stage, values))
+                continue
+            kept_stages.add(stage_id)
+            stage_updates.append(dict(values, id=stage_id))
+            existing_steps = steps.get(stage_id, [])
+            pack_steps = stage.get('steps') or []
+            for step_id, step in zip(existing_steps, pack_steps):
+                step_updates.append(dict(content_values(BossFightStep, step), id=step_id))
+            new_steps.extend(dict(content_values(BossFightStep, step), stage_id=stage_id) for step in pack_steps[len(existing_steps):])
+            removed_steps.extend(existing_steps[len(pack_steps):])
+    removed_stages = [stage_id for stage_id in stages.values() if stage_id not in kept_stages]
+    removed_steps.extend(step_id for stage_id in removed_stages for step_id in steps.get(stage_id, []))
+    if removed_steps:
+        delete_boss_steps(removed_steps)
+    if removed_stages:
+        db.session.execute(delete(BossFightStage).where(BossFightStage.id.in_(removed_stages)))
+    for model, rows in ((BossFightStage, stage_updates), (BossFightStep, step_updates)):
+        if rows:
+            db.session.execute(update(model), rows)
+    if new_steps:
+        db.session.execute(insert(BossFightStep), new_steps)
+    insert_boss_stages(new_stages)
+
+def update_hunt_steps(updated):
+    """Acerta os passos das caças [(id, dados do pacote)], emparelhados pelo número do passo."""
+    hunt_ids = [hunt_id for hunt_id, _ in updated]
+    existing = {(row.hunt_id, row.step_number): row.id for row in db.session.query(
+        ScavengerHuntStep.id, ScavengerHuntStep.hunt_id, ScavengerHuntStep.step_number).filter(ScavengerHuntStep.hunt_id.in_(hunt_ids))}
+    kept, updates, inserts = set(), [], []
+    for hunt_id, item in updated:
+        for step in item.get('steps') or []:
+            values = dict(content_values(ScavengerHuntStep, step), hunt_id=hunt_id)
+            step_id = existing.get((hunt_id, values['step_number']))
+            if step_id is None or step_id in kept:
+                inserts.append(values)
+            else:
+                kept.add(step_id)
+                updates.append(dict(values, id=step_id))
+    removed = [step_id for step_id in existing.values() if step_id not in kept]
+    if removed:
+        db.session.execute(delete(ScavengerHuntStep).where(ScavengerHuntStep.id.in_(removed)))
+    if updates:
+        db.session.execute(update(ScavengerHuntStep), updates)
+    if inserts:
+        db.session.execute(insert(ScavengerHuntStep), inserts)
+
+def update_synced_entities(section, updated):
+    """Atualiza as entidades [(id, dados do pacote, valores das colunas)] e os seus filhos."""
+    model = CONTENT_SECTIONS[section][1]
+    rows = [dict(values, id=entity_id) for entity_id, _, values in updated]
+    if section == 'faqs':
+        categories = ensure_categories({item['category'] for _, item, _ in updated})
+        rows = [dict(row, category_id=categories[item['category']]) for row, (_, item, _) in zip(rows, updated)]
+    elif section == 'eventos_globais':
+        # A vida atual é estado do jogo, não conteúdo
+        rows = [{key: value for key, value in row.items() if key != 'current_hp'} for row in rows]
+    db.session.execute(update(model), rows)
+    if section == 'trilhas':
+        path_ids = [entity_id for entity_id, _, _ in updated]
+        titles = {step.get('title') for _, item, _ in updated for step in item.get('challenges') or []}
+        challenge_ids = {title: row[0] for title, row in existing_keys(Challenge.title, titles, Challenge.id).items()}
+        db.session.execute(delete(PathChallenge).where(PathChallenge.path_id.in_(path_ids)))
+        steps = [row for path_id, item, _ in updated for row in path_step_rows(path_id, item, challenge_ids)]
+        if steps:
+            db.session.execute(insert(PathChallenge), steps)
+        db.session.flush()
+        rebuild_path_progress_counts(path_ids)
+    elif section == 'boss_fights':
+        update_boss_stages([(entity_id, item) for entity_id, item, _ in updated])
+    elif section == 'caca_tesouros':
+        update_hunt_steps([(entity_id, item) for entity_id, item, _ in updated])
+
+def sync_content_pack(content, sections, dry_run=False):
+    """
+    Sincroniza as secções indicadas com o pacote, que passa a ser a fonte de verdade para as
+    entidades que sincroniza: compara o hash de cada item com o guardado em content_sync_state
+    e só insere os novos, atualiza os alterados e apaga os que saíram do pacote. Entidades que
+    já existiam com o mesmo nome/título (sem estado) são adotadas e atualizadas uma vez.
+    Com `dry_run` só calcula as diferenças. Não faz commit.
+    Devolve {'sections': {secção: {'create', 'update', 'delete', 'unchanged', 'invalid', 'names'}}, 'warnings',
+    'released_attachments', 'boss_ids'}; os Boss Fights alterados são invalidados pelo chamador depois do commit.
+    """
+    report = {'sections': {}, 'warnings': [], 'boss_ids': []}
+    released_attachments = []
+    for section in CONTENT_SECTIONS:
+        # Uma secção ausente do pacote não é sincronizada (uma lista vazia apaga tudo o que foi sincronizado)
+        if section not in sections or section not in content:
+            continue
+        label, model, key = CONTENT_SECTIONS[section]
+        valid, invalid = validate_content_items(section, content.get(section), report['warnings'])
+        challenge_ids = {}
+        if section == 'trilhas':
+            titles = {step.get('title') for item, _ in valid for step in item.get('challenges') or []}
+            challenge_ids = {title: row[0] for title, row in existing_keys(Challenge.title, titles, Challenge.id).items()}
+        items = {}
+        for item, values in valid:
+            key_hash = content_key_hash(values[key])
+            if key_hash in items:
+                report['warnings'].append(f'{label}: "{values[key]}" repetido no pacote')
+                continue
+            if section == 'trilhas':
+                # Os ids resolvidos entram no hash: se um desafio da trilha for recriado, a trilha é religada
+                item_hash = content_hash({'item': item, 'challenge_ids': [challenge_ids.get(step.get('title'))
+                                                                          for step in item.get('challenges') or []]})
+            else:
+                item_hash = content_hash(item)
+            items[key_hash] = (item, values, item_hash)
+
+        states = {row.key_hash: row for row in db.session.query(
+            ContentSyncState.key_hash, ContentSyncState.entity_id, ContentSyncState.content_hash, model.id.label('current_id')
+        ).outerjoin(model, model.id == ContentSyncState.entity_id).filter(ContentSyncState.entity_type == section)}
+        unmatched = [values[key] for key_hash, (_, values, _) in items.items()
+                     if key_hash not in states or states[key_hash].current_id is None]
+        adopted = {content_key_hash(name): row[0] for name, row in existing_keys(getattr(model, key), unmatched, model.id).items()}
+
+        create, updated, unchanged, synced = [], [], 0, []
+        for key_hash, (item, values, item_hash) in items.items():
+            state = states.get(key_hash)
+            if state is not None and state.current_id is not None:
+                if state.content_hash == item_hash:
+                    unchanged += 1
+                    continue
+                entity_id = state.entity_id
+            else:
+                entity_id = adopted.get(key_hash)
+            if entity_id is None:
+                create.append((item, values))
+            else:
+                updated.append((entity_id, item, values))
+                synced.append((key_hash, entity_id, item_hash))
+        removed = {key_hash: state for key_hash, state in states.items() if key_hash not in items}
+        delete_ids = [state.entity_id for state in removed.values() if state.current_id is not None]
+
+        names = [values[key] for _, values in create[:20]]
+        report['sections'][section] = {'create': len(create), 'update': len(updated), 'delete': len(delete_ids),
+                                       'unchanged': unchanged, 'invalid': invalid, 'names': names}
+        if dry_run:
+            continue
+
+        if delete_ids:
+            released_attachments += delete_synced_entities(section, delete_ids)
+        if updated:
+            update_synced_entities(section, updated)
+        if create:
+            plan = {'sections': {section: {'create': create, 'existing': 0, 'invalid': 0}}, 'warnings': []}
+            if section == 'faqs':
+                plan['categories'] = ensure_categories({item['category'] for item, _ in create})
+                plan['new_categories'] = []
+            elif section == 'trilhas':
+                plan['challenges'] = challenge_ids
+            apply_content_plan(plan)
+            synced += [(content_key_hash(values[key]), entity_id, items[content_key_hash(values[key])][2])
+                       for entity_id, (_, values) in zip(plan['sections'][section]['ids'], create)]
+        if removed:
+            removed_hashes = list(removed)
+            for start in range(0, len(removed_hashes), CONTENT_LOOKUP_CHUNK):
+                db.session.execute(delete(ContentSyncState).where(
+                    ContentSyncState.entity_type == section,
+                    ContentSyncState.key_hash.in_(removed_hashes[start:start + CONTENT_LOOKUP_CHUNK])))
+        if synced:
+            now = datetime.utcnow()
+            stmt = dialect_insert(ContentSyncState)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['entity_type', 'key_hash'],
+                set_={'entity_id': stmt.excluded.entity_id, 'content_hash': stmt.excluded.content_hash,
+                      'synced_at': stmt.excluded.synced_at})
+            db.session.execute(stmt, [{'entity_type': section, 'key_hash': key_hash, 'entity_id': entity_id,
+                                       'content_hash': item_hash, 'synced_at': now}
+                                      for key_hash, entity_id, item_hash in synced])
+        if section == 'boss_fights':
+            db.session.flush()
+            rebuild_boss_progress_counts(boss_ids=[entity_id for entity_id, _, _ in updated])
+            report['boss_ids'] = [entity_id for entity_id, _, _ in updated] + delete_ids
+    report['released_attachments'] = released_attachments
+    return report
+
+def content_sync_report(report):
+    """Linhas do relatório de sincronização para o template e a linha de comando."""
+    return {'rows': [dict(summary, label=CONTENT_SECTIONS[section][0]) for section, summary in report['sections'].items()],
+            'warnings': report['warnings']}
+
+def content_sync_changes(report):
+    """{secção: número de entidades alteradas}, no formato de invalidate_imported_content."""
+    return {section: summary['create'] + summary['update'] + summary['delete']
+            for section, summary in report['sections'].items()}
+
+# --- CACHES GLOBAIS DE GAMIFICAÇÃO ---
+GAMIFICATION_CACHE_TIMEOUT = 3600
+ACTIVE_EVENT_CACHE_TIMEOUT = 30
+
+# Desafio de hoje memorizado no processo até à meia-noite: (dia, info)
+_daily_challenge_memo = (None, None, None)
+
+def get_daily_challenge_version():
+    """Carimbo partilhado entre processos; muda sempre que os desafios do dia são alterados."""
+    version = cache.get('daily_challenge:version')
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set('daily_challenge:version', version, timeout=0)
+    return version
+
+def get_daily_challenge_info(day=None, create=False):
+    """
+    Devolve {'challenge_id', 'bonus_points', 'title', 'description'} do desafio do dia.
+    O de hoje fica em memória até à meia-noite enquanto o carimbo de versão partilhado não
+    mudar; os restantes passam pela cache. Com create=True agenda o dia na hora se o
+    planeamento ainda não o fez.
+    """
+    global _daily_challenge_memo
     today = date.today()
-    daily_challenge_entry = DailyChallenge.query.filter_by(day=today).first()
-    if daily_challenge_entry:
-        return daily_challenge_entry
-    thirty_days_ago = today - timedelta(days=30)
-    recent_daily_ids = [dc.challenge_id for dc in DailyChallenge.query.filter(DailyChallenge.day > thirty_days_ago).all()]
-    available_challenges = Challenge.query.filter(Challenge.id.notin_(recent_daily_ids)).all()
-    if not available_challenges:
-        available_challenges = Challenge.query.all()
-    if available_challenges:
-        selected_challenge = random.choice(available_challenges)
-        new_daily = DailyChallenge(challenge_id=selected_challenge.id)
-        db.session.add(new_daily)
+    day = day or today
+    version = get_daily_challenge_version()
+    if day == today and _daily_challenge_memo[:2] == (today, version):
+        return _daily_challenge_memo[2]
+    cache_key = f'daily_challenge:{version}:{day.isoformat()}'
+    info = cache.get(cache_key)
+    if info is None or (create and info['challenge_id'] is None):
+        query = db.session.query(DailyChallenge.challenge_id, DailyChallenge.bonus_points, Challenge.title, Challenge.description)\
+            .join(Challenge, Challenge.id == DailyChallenge.challenge_id).filter(DailyChallenge.day == day)
+        entry = query.first()
+        if entry is None and create:
+            plan_daily_challenges(days=1, start=day)
+            entry = query.first()
+        info = entry._asdict() if entry else {'challenge_id': None, 'bonus_points': 0, 'title': None, 'description': None}
+        # Um dia ainda sem desafio é guardado por pouco tempo: pode ser criado a qualquer momento
+        cache.set(cache_key, info, timeout=GAMIFICATION_CACHE_TIMEOUT if entry else 60)
+    if day == today and info['challenge_id'] is not None:
+        _daily_challenge_memo = (today, version, info)
+    return info
+
+def invalidate_daily_challenge_cache():
+    """Muda o carimbo partilhado: todos os processos esquecem a memória e a cache de todos os dias."""
+    global _daily_challenge_memo
+    _daily_challenge_memo = (None, None, None)
+    cache.set('daily_challenge:version', uuid.uuid4().hex, timeout=0)
+
+def get_active_event_info():
+    """Devolve o evento global ativo ({'id', 'name', 'start_date', 'end_date'}) ou None, em cache curto."""
+    info = cache.get('events:active')
+    if info is None:
+        event = db.session.query(GlobalEvent.id, GlobalEvent.name, GlobalEvent.start_date, GlobalEvent.end_date).filter(
+            GlobalEvent.is_active == True,
+            GlobalEvent.end_date >= datetime.utcnow(),
+            GlobalEvent.current_hp > 0
+        ).order_by(GlobalEvent.start_date).first()
+        info = event._asdict() if event else {'id': None}
+        cache.set('events:active', info, timeout=ACTIVE_EVENT_CACHE_TIMEOUT)
+    now = datetime.utcnow()
+    if info['id'] is None or not (info['start_date'] <= now <= info['end_date']):
+        return None
+    return info
+
+def invalidate_active_event_cache():
+    cache.delete('events:active')
+    invalidate_dashboard_cache()
+
+def get_levels_ladder():
+    """Devolve os níveis ordenados por min_points (em cache) como dicionários."""
+    ladder = cache.get('levels:ladder')
+    if ladder is None:
+        ladder = [row._asdict() for row in db.session.query(Level.id, Level.name, Level.min_points, Level.insignia).order_by(Level.min_points)]
+        cache.set('levels:ladder', ladder, timeout=GAMIFICATION_CACHE_TIMEOUT)
+    return ladder
+
+def invalidate_levels_cache():
+    cache.delete('levels:ladder')
+    invalidate_challenges_cache()
+
+def get_achievements_catalog():
+    """Devolve todas as conquistas (em cache) como dicionários."""
+    catalog = cache.get('achievements:catalog')
+    if catalog is None:
+        catalog = [row._asdict() for row in db.session.query(
+            Achievement.id, Achievement.name, Achievement.trigger_type, Achievement.trigger_value)]
+        cache.set('achievements:catalog', catalog, timeout=GAMIFICATION_CACHE_TIMEOUT)
+    return catalog
+
+def invalidate_achievements_cache():
+    cache.delete('achievements:catalog')
+
+def dialect_insert(model):
+    """Devolve um INSERT com suporte a ON CONFLICT para o dialeto em uso (PostgreSQL ou SQLite)."""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+def insert_if_absent(model, index_elements, **values):
+    """
+    INSERT ... ON CONFLICT DO NOTHING sobre a chave natural (restrição única) do modelo.
+    Devolve True se a linha foi inserida, ou seja, se quem chamou deve atribuir a recompensa.
+    """
+    stmt = dialect_insert(model).values(**values).on_conflict_do_nothing(index_elements=index_elements)
+    return db.session.execute(stmt).rowcount == 1
+
+def apply_event_damage(event_id, user_id, damage):
+    """
+    Aplica dano ao evento global sem ler-modificar-escrever: decremento atómico da vida
+    e upsert da contribuição. Devolve None se o boss já estava derrotado, senão um booleano
+    que só é True para o golpe que o derrotou (detetado exatamente uma vez).
+    """
+    hit = db.session.execute(
+        update(GlobalEvent)
+        .where(GlobalEvent.id == event_id, GlobalEvent.current_hp > 0)
+        .values(current_hp=case((GlobalEvent.current_hp > damage, GlobalEvent.current_hp - damage), else_=0))
+        .execution_options(synchronize_session=False)
+    )
+    if hit.rowcount == 0:
+        return None
+    contribution = dialect_insert(GlobalEventContribution).values(
+        event_id=event_id, user_id=user_id, contribution_points=damage, created_at=datetime.utcnow())
+    db.session.execute(contribution.on_conflict_do_update(
+        index_elements=['event_id', 'user_id'],
+        set_={'contribution_points': GlobalEventContribution.__table__.c.contribution_points + contribution.excluded.contribution_points}
+    ))
+    kill = db.session.execute(
+        update(GlobalEvent)
+        .where(GlobalEvent.id == event_id, GlobalEvent.current_hp <= 0, GlobalEvent.defeated_at.is_(None))
+        .values(defeated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return kill.rowcount == 1
+
+def bulk_update_levels(user_ids=None, exclude_level_ids=None):
+    """
+    Recalcula o nível dos utilizadores indicados (ids ou subconsulta), ou de todos,
+    com um único UPDATE ... FROM contra a escada de níveis (faixas de min_points
+    calculadas com LAG/LEAD; o nível mais baixo acolhe também quem está abaixo dele).
+    Os níveis em exclude_level_ids são ignorados. Devolve quantos utilizadores mudaram de nível.
+    """
+    ladder = select(
+        Level.id,
+        Level.min_points,
+        func.lag(Level.min_points).over(order_by=Level.min_points).label('previous_min_points'),
+        func.lead(Level.min_points).over(order_by=Level.min_points).label('next_min_points')
+    )
+    if exclude_level_ids:
+        ladder = ladder.where(Level.id.notin_(exclude_level_ids))
+    ladder = ladder.subquery('ladder')
+    stmt = update(User).where(
+        (ladder.c.previous_min_points.is_(None)) | (User.points >= ladder.c.min_points),
+        (ladder.c.next_min_points.is_(None)) | (User.points < ladder.c.next_min_points),
+        User.level_id.is_distinct_from(ladder.c.id)
+    ).values(level_id=ladder.c.id)
+    if user_ids is not None:
+        stmt = stmt.where(User.id.in_(user_ids))
+    return db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+
+def recompute_all_levels():
+    """Tarefa: reatribui o nível de todos os utilizadores após mudanças na escada. Devolve quantos mudaram."""
+    moved = bulk_update_levels()
+    db.session.commit()
+    return moved
+
+def flash_levels_recomputed(moved):
+    if moved is None:
+        flash('O recálculo de níveis já está a ser executado por outro processo.', 'info')
+    elif moved:
+        flash(f'{moved} utilizador(es) mudaram de nível.', 'info')
+
+# --- SERVIÇO DE RECOMPENSAS ---
+def credit_points(user_ids, points, reason):
+    """
+    Credita `points` a um conjunto de utilizadores (lista de ids ou subconsulta de User.id)
+    com um único UPDATE, regista o movimento no extrato em massa e recalcula os níveis.
+    Devolve quantos utilizadores foram creditados.
+    """
+    if isinstance(user_ids, (list, tuple, set)):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return 0
+    if not points:
+        return 0
+    credited = db.session.execute(
+        update(User).where(User.id.in_(user_ids)).values(points=User.points + points)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.execute(insert(PointsLedger).from_select(
+        ['user_id', 'points', 'reason', 'created_at'],
+        select(User.id, db.literal(points), db.literal(reason), db.literal(datetime.utcnow())).where(User.id.in_(user_ids))
+    ))
+    bulk_update_levels(user_ids)
+    return credited
+
+def credit_teams(team_points, reason):
+    """
+    Credita a todos os membros de várias equipas, com valores por equipa ({team_id: pontos}),
+    usando um único UPDATE e um único INSERT ... SELECT no extrato. Devolve quantos utilizadores foram creditados.
+    """
+    team_points = {team_id: points for team_id, points in team_points.items() if points}
+    if not team_points:
+        return 0
+    points_for_team = case(team_points, value=User.team_id, else_=0)
+    credited = db.session.execute(
+        update(User).where(User.team_id.in_(team_points.keys())).values(points=User.points + points_for_team)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.execute(insert(PointsLedger).from_select(
+        ['user_id', 'points', 'reason', 'created_at'],
+        select(User.id, points_for_team, db.literal(reason), db.literal(datetime.utcnow())).where(User.team_id.in_(team_points.keys()))
+    ))
+    bulk_update_levels(select(User.id).where(User.team_id.in_(team_points.keys())))
+    return credited
+
+# --- EVENTOS GLOBAIS ---
+EVENT_LEADERBOARD_CACHE_TIMEOUT = 60
+
+def finalize_global_events(event_ids=None):
+    """
+    Finaliza os eventos globais cujo boss foi derrotado ou cujo prazo terminou:
+    congela o ranking de contribuidores e, em caso de vitória, credita a recompensa
+    a todos os contribuidores com um único UPDATE. Devolve quantos eventos finalizou.
+    """
+    now = datetime.utcnow()
+    query = db.session.query(GlobalEvent.id).filter(
+        GlobalEvent.finalized_at.is_(None),
+        (GlobalEvent.current_hp <= 0) | (GlobalEvent.end_date < now)
+    )
+    if event_ids is not None:
+        query = query.filter(GlobalEvent.id.in_(event_ids))
+    due_ids = [row.id for row in query]
+
+    finalized_count = 0
+    for event_id in due_ids:
+        # Reclama o evento com um UPDATE condicional: só um processo o finaliza
+        claimed = db.session.execute(
+            update(GlobalEvent)
+            .where(GlobalEvent.id == event_id, GlobalEvent.finalized_at.is_(None))
+            .values(finalized_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if claimed.rowcount == 0:
+            continue
+        current_hp, reward = db.session.query(GlobalEvent.current_hp, GlobalEvent.reward_points_on_win)\
+            .filter(GlobalEvent.id == event_id).one()
+        reward = (reward or 0) if current_hp <= 0 else 0
+
+        ranked = select(
+            GlobalEventContribution.event_id,
+            GlobalEventContribution.user_id,
+            func.rank().over(order_by=GlobalEventContribution.contribution_points.desc()),
+            GlobalEventContribution.contribution_points,
+            db.literal(reward)
+        ).where(GlobalEventContribution.event_id == event_id)
+        db.session.execute(insert(GlobalEventRanking).from_select(
+            ['event_id', 'user_id', 'rank', 'contribution_points', 'reward_points'], ranked))
+
+        if reward:
+            credit_points(select(GlobalEventContribution.user_id).where(GlobalEventContribution.event_id == event_id),
+                          reward, f'global_event:{event_id}')
+        cache.delete(f'events:leaderboard:{event_id}')
+        finalized_count += 1
+
+    if finalized_count:
         db.session.commit()
-        return new_daily
-    return None
+        invalidate_active_event_cache()
+    return finalized_count
+
+def get_event_leaderboard(event_id, limit=10):
+    """Top contribuidores de um evento: ranking congelado se finalizado, senão ao vivo (em cache curto)."""
+    cache_key = f'events:leaderboard:{event_id}'
+    leaderboard = cache.get(cache_key)
+    if leaderboard is None:
+        event = db.session.get(GlobalEvent, event_id)
+        if event.finalized_at:
+            rows = db.session.query(GlobalEventRanking.rank, User.name, GlobalEventRanking.contribution_points, GlobalEventRanking.reward_points)\
+                .join(User, User.id == GlobalEventRanking.user_id)\
+                .filter(GlobalEventRanking.event_id == event_id)\
+                .order_by(GlobalEventRanking.rank, User.name).limit(limit).all()
+        else:
+            rows = db.session.query(
+                func.rank().over(order_by=GlobalEventContribution.contribution_points.desc()),
+                User.name, GlobalEventContribution.contribution_points, db.literal(0)
+            ).join(User, User.id == GlobalEventContribution.user_id)\
+                .filter(GlobalEventContribution.event_id == event_id)\
+                .order_by(GlobalEventContribution.contribution_points.desc(), User.name).limit(limit).all()
+        leaderboard = {
+            'event_name': event.name,
+            'finalized': event.finalized_at is not None,
+            'won': event.current_hp <= 0,
+            'entries': [{'rank': r[0], 'name': r[1], 'contribution_points': r[2], 'reward_points': r[3]} for r in rows]
+        }
+        timeout = 0 if event.finalized_at else EVENT_LEADERBOARD_CACHE_TIMEOUT
+        cache.set(cache_key, leaderboard, timeout=timeout)
+    return leaderboard
+
+# --- DASHBOARD ---
+DASHBOARD_GLOBALS_CACHE_TIMEOUT = 30
+DASHBOARD_USER_CACHE_TIMEOUT = 60
+
+def get_dashboard_globals():
+    """
+    Partes do dashboard iguais para todos (caça ao tesouro ativa com as pistas, evento global
+    ativo e ranking de contribuidores), montadas numa só passagem e guardadas em cache curto.
+    """
+    snapshot = cache.get('dashboard:globals')
+    if snapshot is None:
+        hunt = db.session.query(ScavengerHunt.id, ScavengerHunt.name, ScavengerHunt.description)\
+            .filter_by(is_active=True).first()
+        active_hunt = None
+        if hunt:
+            active_hunt = hunt._asdict()
+            active_hunt['clues'] = dict(db.session.query(ScavengerHuntStep.step_number, ScavengerHuntStep.clue_text)
+                                        .filter_by(hunt_id=hunt.id))
+        event = db.session.query(
+            GlobalEvent.id, GlobalEvent.name, GlobalEvent.description, GlobalEvent.total_hp,
+            GlobalEvent.current_hp, GlobalEvent.end_date, GlobalEvent.reward_points_on_win
+        ).filter(
+            GlobalEvent.is_active == True,
+            GlobalEvent.end_date >= datetime.utcnow(),
+            GlobalEvent.current_hp > 0
+        ).first()
+        event_progress = 0
+        event_leaderboard = None
+        if event:
+            event_progress = ((event.total_hp - event.current_hp) / event.total_hp) * 100
+            event_leaderboard = get_event_leaderboard(event.id)
+        else:
+            last_finalized = db.session.query(GlobalEvent.id).filter(GlobalEvent.finalized_at.isnot(None))\
+                .order_by(GlobalEvent.finalized_at.desc()).first()
+            if last_finalized:
+                event_leaderboard = get_event_leaderboard(last_finalized.id)
+        snapshot = {
+            'active_hunt': active_hunt,
+            'active_event': event._asdict() if event else None,
+            'event_progress': event_progress,
+            'event_leaderboard': event_leaderboard,
+        }
+        cache.set('dashboard:globals', snapshot, timeout=DASHBOARD_GLOBALS_CACHE_TIMEOUT)
+    return snapshot
+
+def invalidate_dashboard_cache():
+    cache.delete('dashboard:globals')
+
+def get_dashboard_user_snapshot(user_id, hunt_id):
+    """Partes do dashboard próprias do utilizador (progresso na caça ativa), em cache curto."""
+    cache_key = f'dashboard:user:{user_id}'
+    snapshot = cache.get(cache_key)
+    if snapshot is None or snapshot['hunt_id'] != hunt_id:
+        hunt_progress = None
+        if hunt_id:
+            hunt_progress = db.session.query(UserHuntProgress.current_step, UserHuntProgress.completed_at)\
+                .filter_by(user_id=user_id, hunt_id=hunt_id).first()
+        snapshot = {'hunt_id': hunt_id, 'hunt_progress': hunt_progress._asdict() if hunt_progress else None}
+        cache.set(cache_key, snapshot, timeout=DASHBOARD_USER_CACHE_TIMEOUT)
+    return snapshot
+
+def invalidate_dashboard_user_cache(user_id):
+    cache.delete(f'dashboard:user:{user_id}')
+
+def get_level_progress(user):
+    """
+    Nível atual, insígnia e progresso para o próximo nível, a partir da escada de níveis em cache.
+    Memorizado no pedido enquanto os pontos e o nível do utilizador não mudarem.
+    """
+    memo_key = (user.id, user.level_id, user.points)
+    memo = g.setdefault('level_progress', {})
+    if memo_key in memo:
+        return memo[memo_key]
+    ladder = get_levels_ladder()
+    progress = {'percentage': 0, 'next_level_points': None, 'level_name': None, 'insignia': ''}
+    for position, level in enumerate(ladder):
+        if level['id'] != user.level_id:
+            continue
+        progress['level_name'] = level['name']
+        progress['insignia'] = level['insignia'] or ''
+        next_level = ladder[position + 1] if position + 1 < len(ladder) else None
+        if next_level:
+            points_for_level = next_level['min_points'] - level['min_points']
+            points_achieved = user.points - level['min_points']
+            progress['percentage'] = max(0, min(100, (points_achieved / points_for_level) * 100 if points_for_level > 0 else 100))
+            progress['next_level_points'] = next_level['min_points']
+        else:
+            progress['percentage'] = 100
+        break
+    memo[memo_key] = progress
+    return progress
+
+# --- CONTEXTO DO UTILIZADOR ---
+USER_CONTEXT_CACHE_TIMEOUT = 300
+
+def get_user_version(user_id):
+    """Devolve o carimbo de versão dos dados derivados do utilizador (muda a cada escrita relevante)."""
+    version = cache.get(f'user:version:{user_id}')
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(f'user:version:{user_id}', version, timeout=0)
+    return version
+
+def bump_user_version(user_id):
+    cache.set(f'user:version:{user_id}', uuid.uuid4().hex, timeout=0)
+
+def get_completed_challenge_ids(user):
+    """
+    Ids dos desafios completados pelo utilizador, memorizados no pedido (g) e em cache
+    chaveada pela versão do utilizador e do catálogo de desafios.
+    """
+    memo = g.setdefault('completed_challenge_ids', {})
+    if user.id not in memo:
+        cache_key = f'user:completed:{user.id}'
+        stamp = (get_user_version(user.id), get_challenges_version())
+        cached = cache.get(cache_key)
+        if cached is None or cached['stamp'] != stamp:
+            ids = frozenset(row.challenge_id for row in db.session.query(UserChallenge.challenge_id).filter_by(user_id=user.id))
+            cached = {'stamp': stamp, 'ids': ids}
+            cache.set(cache_key, cached, timeout=USER_CONTEXT_CACHE_TIMEOUT)
+        memo[user.id] = cached['ids']
+    return memo[user.id]
+
+# --- CACHE DE DESAFIOS ---
+CHALLENGES_CACHE_TIMEOUT = 600
+
+def get_challenges_version():
+    """Devolve o carimbo de versão do catálogo de desafios (muda a cada edição do admin)."""
+    version = cache.get('challenges:version')
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set('challenges:version', version, timeout=0)
+    return version
+
+def invalidate_challenges_cache():
+    """Invalida o cache de desafios disponíveis de todos os utilizadores."""
+    cache.set('challenges:version', uuid.uuid4().hex, timeout=0)
+
+def invalidate_user_challenges_cache(user_id):
+    """Invalida o cache de desafios disponíveis e os desafios completados de um utilizador."""
+    cache.delete(f'challenges:available:{user_id}')
+    bump_user_version(user_id)
+    g.pop('completed_challenge_ids', None)
+
+def get_available_challenges(user):
+    """
+    Devolve os desafios ainda não completados pelo utilizador, divididos em
+    desbloqueados e bloqueados, com uma única consulta (anti-join) e cache por utilizador.
+    """
+    cache_key = f'challenges:available:{user.id}'
+    stamp = (user.level_id, get_challenges_version())
+    cached = cache.get(cache_key)
+    if cached is not None and cached['stamp'] == stamp:
+        return cached['unlocked'], cached['locked']
+
+    RequiredLevel = aliased(Level)
+    rows = db.session.query(
+        Challenge.id,
+        Challenge.title,
+        Challenge.description,
+        Challenge.level_required,
+        Challenge.points_reward,
+        Challenge.challenge_type,
+        Challenge.is_team_challenge,
+        Challenge.hint_cost,
+        (RequiredLevel.min_points <= user.level.min_points).label('is_unlocked')
+    ).join(RequiredLevel, Challenge.level_required == RequiredLevel.name)\
+        .outerjoin(UserChallenge, (UserChallenge.challenge_id == Challenge.id) & (UserChallenge.user_id == user.id))\
+        .filter(UserChallenge.id.is_(None))\
+        .order_by(Challenge.id).all()
+
+    unlocked, locked = [], []
+    for row in rows:
+        challenge = row._asdict()
+        (unlocked if challenge.pop('is_unlocked') else locked).append(challenge)
+    cache.set(cache_key, {'stamp': stamp, 'unlocked': unlocked, 'locked': locked}, timeout=CHALLENGES_CACHE_TIMEOUT)
+    return unlocked, locked
 
 def find_faqs_by_keywords(message):
     search_words = set(message.lower().split())
@@ -518,172 +2244,955 @@ def find_faq_by_nlp(message):
 
 def update_user_level(user):
     current_level_id = user.level_id
-    new_level = Level.query.filter(Level.min_points <= user.points).order_by(Level.min_points.desc()).first()
-    if new_level and new_level.id != current_level_id:
-        user.level_id = new_level.id
-        flash(f'Subiu de nível! Você agora é {new_level.name}!', 'success')
-
-def check_and_award_achievements(user):
-    user_achievements_ids = {ua.achievement_id for ua in user.achievements}
-    potential_achievements = Achievement.query.filter(Achievement.id.notin_(user_achievements_ids)).all()
+    new_level = None
+    for level in get_levels_ladder():
+        if level['min_points'] <= user.points:
+            new_level = level
+    if new_level and new_level['id'] != current_level_id:
+        user.level_id = new_level['id']
+        flash(f'Subiu de nível! Você agora é {new_level["name"]}!', 'success')
+
+def check_and_award_achievements(user, challenges_completed_count=None, paths_completed_count=None, earned_ids=None):
+    """
+    Atribui as conquistas que o utilizador passou a merecer. Os contadores e as conquistas
+    já obtidas podem ser passados já calculados para evitar consultas.
+    """
+    catalog = get_achievements_catalog()
+    if not catalog:
+        return
+    if earned_ids is None:
+        earned_ids = {row.achievement_id for row in db.session.query(UserAchievement.achievement_id).filter_by(user_id=user.id)}
+    potential_achievements = [achievement for achievement in catalog if achievement['id'] not in earned_ids]
     if not potential_achievements:
         return
-    challenges_completed_count = len(user.completed_challenges)
-    paths_completed_count = UserPathProgress.query.filter_by(user_id=user.id).count()
+    if challenges_completed_count is None:
+        challenges_completed_count = UserChallenge.query.filter_by(user_id=user.id).count()
+    if paths_completed_count is None:
+        paths_completed_count = UserPathProgress.query.filter_by(user_id=user.id).count()
     for achievement in potential_achievements:
         unlocked = False
-        if achievement.trigger_type == 'challenges_completed':
-            if challenges_completed_count >= achievement.trigger_value:
+        if achievement['trigger_type'] == 'challenges_completed':
+            if challenges_completed_count >= achievement['trigger_value']:
                 unlocked = True
-        elif achievement.trigger_type == 'points_earned':
-            if user.points >= achievement.trigger_value:
+        elif achievement['trigger_type'] == 'points_earned':
+            if user.points >= achievement['trigger_value']:
                 unlocked = True
-        elif achievement.trigger_type == 'paths_completed':
-            if paths_completed_count >= achievement.trigger_value:
+        elif achievement['trigger_type'] == 'paths_completed':
+            if paths_completed_count >= achievement['trigger_value']:
                 unlocked = True
-        elif achievement.trigger_type == 'first_team_join':
-            if user.team_id is not None and achievement.trigger_value == 1:
+        elif achievement['trigger_type'] == 'first_team_join':
+            if user.team_id is not None and achievement['trigger_value'] == 1:
                 unlocked = True
-        if unlocked:
-            user_achievement = UserAchievement(user_id=user.id, achievement_id=achievement.id)
-            db.session.add(user_achievement)
-            flash(f'Nova conquista desbloqueada: {achievement.name}!', 'success')
-
-def check_boss_fight_completion(team_id, boss_id):
-    boss = BossFight.query.get(boss_id)
-    team = Team.query.get(team_id)
-    if TeamBossCompletion.query.filter_by(team_id=team_id, boss_fight_id=boss_id).first():
+        if unlocked and insert_if_absent(UserAchievement, ['user_id', 'achievement_id'], user_id=user.id, achievement_id=achievement['id']):
+            flash(f'Nova conquista desbloqueada: {achievement["name"]}!', 'success')
+
+def achievement_qualifiers(trigger_type):
+    """
+    Subconsulta (user_id, valor) com o valor agregado de cada utilizador para o tipo de gatilho,
+    ou None se o tipo não for conhecido.
+    """
+    if trigger_type == 'challenges_completed':
+        return select(UserChallenge.user_id, func.count(UserChallenge.id).label('value'))\
+            .group_by(UserChallenge.user_id).subquery()
+    if trigger_type == 'points_earned':
+        return select(User.id.label('user_id'), User.points.label('value')).subquery()
+    if trigger_type == 'paths_completed':
+        return select(UserPathProgress.user_id, func.count(UserPathProgress.id).label('value'))\
+            .group_by(UserPathProgress.user_id).subquery()
+    if trigger_type == 'first_team_join':
+        return select(User.id.label('user_id'), db.literal(1).label('value')).where(User.team_id.isnot(None)).subquery()
+    return None
+
+def backfill_achievements(achievement_ids=None):
+    """
+    Atribui as conquistas indicadas (ou todas) a todos os utilizadores que já as merecem,
+    com um INSERT ... SELECT agregado por tipo de gatilho, e deixa uma notificação a cada
+    utilizador premiado. Devolve quantas conquistas foram atribuídas.
+    """
+    query = db.session.query(Achievement.trigger_type).distinct()
+    if achievement_ids is not None:
+        achievement_ids = list(achievement_ids)
+        if not achievement_ids:
+            return 0
+        query = query.filter(Achievement.id.in_(achievement_ids))
+    awarded_at = datetime.utcnow()
+    awarded = []
+    for (trigger_type,) in query.all():
+        qualifiers = achievement_qualifiers(trigger_type)
+        if qualifiers is None:
+            continue
+        candidates = select(qualifiers.c.user_id, Achievement.id, db.literal(awarded_at))\
+            .join(Achievement, (Achievement.trigger_type == trigger_type) & (qualifiers.c.value >= Achievement.trigger_value))
+        if trigger_type == 'first_team_join':
+            candidates = candidates.where(Achievement.trigger_value == 1)
+        if achievement_ids is not None:
+            candidates = candidates.where(Achievement.id.in_(achievement_ids))
+        stmt = dialect_insert(UserAchievement).from_select(['user_id', 'achievement_id', 'earned_at'], candidates)\
+            .on_conflict_do_nothing(index_elements=['user_id', 'achievement_id'])\
+            .returning(UserAchievement.user_id, UserAchievement.achievement_id)
+        # Só as linhas realmente inseridas (as já existentes são ignoradas pelo ON CONFLICT) geram notificação
+        awarded.extend(db.session.execute(stmt).all())
+    if awarded:
+        names = dict(db.session.query(Achievement.id, Achievement.name)
+                     .filter(Achievement.id.in_({achievement_id for _, achievement_id in awarded})))
+        # INSERT direto na tabela (sem a camada ORM): pode haver uma linha por utilizador da plataforma
+        db.session.execute(insert(UserNotification.__table__), [
+            {'user_id': user_id, 'message': f'Nova conquista desbloqueada: {names[achievement_id]}!',
+             'category': 'success', 'created_at': awarded_at}
+            for user_id, achievement_id in awarded])
+    db.session.commit()
+    return len(awarded)
+
+def request_achievement_backfill(achievement_ids):
+    """
+    Marca as conquistas criadas ou editadas para atribuição retroativa e inicia-a numa thread,
+    fora do pedido HTTP. Se outro processo a estiver a executar, a tarefa agendada trata-as depois.
+    """
+    achievement_ids = list(achievement_ids)
+    if not achievement_ids:
         return
-    total_steps_required = db.session.query(func.count(BossFightStep.id))\
-        .join(BossFightStage).filter(BossFightStage.boss_fight_id == boss_id).scalar()
-    steps_completed_by_team = TeamBossProgress.query.filter_by(team_id=team_id)\
-        .join(BossFightStep).join(BossFightStage)\
-        .filter(BossFightStage.boss_fight_id == boss_id).count()
-    if total_steps_required > 0 and steps_completed_by_team >= total_steps_required:
-        for member in team.members:
-            member.points += boss.reward_points
-            update_user_level(member)
-        completion_record = TeamBossCompletion(team_id=team_id, boss_fight_id=boss_id)
-        db.session.add(completion_record)
-        db.session.commit()
-        flash(f'Parabéns Equipe "{team.name}"! Vocês derrotaram o Boss "{boss.name}" e cada membro ganhou {boss.reward_points} pontos!', 'success')
+    db.session.execute(update(Achievement).where(Achievement.id.in_(achievement_ids))
+                       .values(backfill_requested_at=datetime.utcnow()).execution_options(synchronize_session=False))
+    db.session.commit()
+    def work():
+        with app.app_context():
+            try:
+                run_locked_job('backfill_achievements', process_achievement_backfills)
+            except Exception:
+                app.logger.exception('Erro na atribuição retroativa de conquistas')
+            db.session.remove()
+    threading.Thread(target=work, name='achievement-backfill', daemon=True).start()
+    flash('As conquistas serão atribuídas em segundo plano aos utilizadores que já cumprem os requisitos.', 'info')
+
+def process_achievement_backfills():
+    """
+    Tarefa agendada: faz a atribuição retroativa só das conquistas marcadas. A marca só é
+    limpa se não mudou entretanto (uma edição durante a execução volta a ser processada).
+    Devolve quantas conquistas foram atribuídas.
+    """
+    requested = db.session.query(Achievement.id, Achievement.backfill_requested_at)\
+        .filter(Achievement.backfill_requested_at.isnot(None)).all()
+    if not requested:
+        return 0
+    awarded = backfill_achievements([row.id for row in requested])
+    for row in requested:
+        db.session.execute(update(Achievement).where(
+            Achievement.id == row.id, Achievement.backfill_requested_at == row.backfill_requested_at
+        ).values(backfill_requested_at=None).execution_options(synchronize_session=False))
+    db.session.commit()
+    return awarded
+
+def deliver_notifications(user_id):
+    """Mostra como flash as notificações por ler do utilizador e marca-as como lidas."""
+    notifications = db.session.query(UserNotification.id, UserNotification.message, UserNotification.category)\
+        .filter(UserNotification.user_id == user_id, UserNotification.read_at.is_(None))\
+        .order_by(UserNotification.id).all()
+    if not notifications:
+        return
+    for notification in notifications:
+        flash(notification.message, notification.category)
+    db.session.execute(update(UserNotification).where(
+        UserNotification.id.in_([notification.id for notification in notifications])
+    ).values(read_at=datetime.utcnow()))
+    db.session.commit()
+
+# --- BOSS FIGHTS ---
+BOSS_TREE_CACHE_TIMEOUT = 3600
+
+# Árvore imutável boss -> etapas -> tarefas, partilhada entre pedidos através da cache
+BossTree = namedtuple('BossTree', 'id name description reward_points is_active image_url stages total_steps')
+BossStageNode = namedtuple('BossStageNode', 'id name order steps')
+BossStepNode = namedtuple('BossStepNode', 'id description expected_answer')
+
+def get_boss_tree(boss_id):
+    """
+    Devolve a árvore de um Boss Fight (em cache), carregada com uma única consulta,
+    ou None se o boss não existir. Invalidada por invalidate_boss_tree quando o admin a edita.
+    """
+    cache_key = f'bosses:tree:{boss_id}'
+    tree = cache.get(cache_key)
+    if tree is None:
+        rows = db.session.query(
+            BossFight.id, BossFight.name, BossFight.description, BossFight.reward_points,
+            BossFight.is_active, BossFight.image_url,
+            BossFightStage.id, BossFightStage.name, BossFightStage.order,
+            BossFightStep.id, BossFightStep.description, BossFightStep.expected_answer
+        ).outerjoin(BossFightStage, BossFightStage.boss_fight_id == BossFight.id)\
+            .outerjoin(BossFightStep, BossFightStep.stage_id == BossFightStage.id)\
+            .filter(BossFight.id == boss_id)\
+            .order_by(BossFightStage.order, BossFightStage.id, BossFightStep.id).all()
+        if not rows:
+            return None
+        stages = {}
+        for row in rows:
+            stage_id = row[6]
+            if stage_id is None:
+                continue
+            stage = stages.setdefault(stage_id, (row[7], row[8], []))
+            if row[9] is not None:
+                stage[2].append(BossStepNode(row[9], row[10], row[11]))
+        stages = tuple(BossStageNode(stage_id, name, order, tuple(steps)) for stage_id, (name, order, steps) in stages.items())
+        boss = rows[0]
+        tree = BossTree(boss[0], boss[1], boss[2], boss[3], boss[4], boss[5], stages,
+                        sum(len(stage.steps) for stage in stages))
+        cache.set(cache_key, tree, timeout=BOSS_TREE_CACHE_TIMEOUT)
+    return tree
+
+def invalidate_boss_tree(boss_id):
+    cache.delete(f'bosses:tree:{boss_id}')
+
+def rebuild_boss_progress_counts(team_ids=None, boss_ids=None):
+    """
+    Recalcula (em SQL) a tabela team_boss_progress_counts para as equipas e/ou bosses
+    indicados, ou para todos. Deve ser chamada quando tarefas ou progresso são apagados.
+    """
+    clear = delete(TeamBossProgressCount)
+    counts = select(
+        TeamBossProgress.team_id,
+        BossFightStage.boss_fight_id,
+        func.count(TeamBossProgress.id)
+    ).join(BossFightStep, BossFightStep.id == TeamBossProgress.step_id)\
+        .join(BossFightStage, BossFightStage.id == BossFightStep.stage_id)\
+        .group_by(TeamBossProgress.team_id, BossFightStage.boss_fight_id)
+    if team_ids is not None:
+        team_ids = list(team_ids)
+        if not team_ids:
+            return
+        clear = clear.where(TeamBossProgressCount.team_id.in_(team_ids))
+        counts = counts.where(TeamBossProgress.team_id.in_(team_ids))
+    if boss_ids is not None:
+        boss_ids = list(boss_ids)
+        if not boss_ids:
+            return
+        clear = clear.where(TeamBossProgressCount.boss_fight_id.in_(boss_ids))
+        counts = counts.where(BossFightStage.boss_fight_id.in_(boss_ids))
+    db.session.execute(clear)
+    db.session.execute(insert(TeamBossProgressCount).from_select(
+        ['team_id', 'boss_fight_id', 'completed_steps'], counts))
+
+def increment_boss_progress(team_id, boss_id):
+    """Soma uma tarefa concluída ao contador da equipa no boss e devolve o novo total."""
+    stmt = dialect_insert(TeamBossProgressCount).values(team_id=team_id, boss_fight_id=boss_id, completed_steps=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['team_id', 'boss_fight_id'],
+        set_={'completed_steps': TeamBossProgressCount.__table__.c.completed_steps + 1}
+    ).returning(TeamBossProgressCount.__table__.c.completed_steps)
+    return db.session.execute(stmt).scalar()
+
+def check_boss_fight_completion(team_id, boss_id, steps_completed_by_team=None):
+    """
+    Compara o contador de tarefas concluídas da equipa com o total da árvore em cache e,
+    se o boss foi derrotado, regista a vitória e paga a recompensa (sem commit).
+    Devolve True se este pedido derrotou o boss.
+    """
+    boss = get_boss_tree(boss_id)
+    if boss is None or boss.total_steps == 0:
+        return False
+    if steps_completed_by_team is None:
+        steps_completed_by_team = db.session.query(TeamBossProgressCount.completed_steps)\
+            .filter_by(team_id=team_id, boss_fight_id=boss_id).scalar() or 0
+    if steps_completed_by_team < boss.total_steps:
+        return False
+    # A restrição única garante que só um pedido paga a recompensa
+    if not insert_if_absent(TeamBossCompletion, ['team_id', 'boss_fight_id'], team_id=team_id, boss_fight_id=boss_id, completed_at=datetime.utcnow()):
+        return False
+    credit_points(select(User.id).where(User.team_id == team_id), boss.reward_points, f'boss_fight:{boss_id}')
+    return True
+
+# --- PROGRESSO DAS TRILHAS ---
+PATH_INDEX_CACHE_TIMEOUT = 3600
+
+def get_path_index():
+    """
+    Devolve o índice invertido das trilhas (em cache):
+    challenge_paths = {challenge_id: [path_id, ...]} e path_totals = {path_id: total de passos}.
+    """
+    index = cache.get('paths:index')
+    if index is None:
+        index = {'challenge_paths': {}, 'path_totals': {}}
+        for path_id, challenge_id in db.session.query(PathChallenge.path_id, PathChallenge.challenge_id):
+            index['challenge_paths'].setdefault(challenge_id, []).append(path_id)
+            index['path_totals'][path_id] = index['path_totals'].get(path_id, 0) + 1
+        cache.set('paths:index', index, timeout=PATH_INDEX_CACHE_TIMEOUT)
+    return index
+
+def invalidate_path_index():
+    cache.delete('paths:index')
+
+def rebuild_path_progress_counts(path_ids=None):
+    """
+    Recalcula (em SQL) a tabela user_path_progress_counts para as trilhas indicadas,
+    ou para todas. Deve ser chamada sempre que os passos de uma trilha mudam; o chamador
+    faz o commit e só depois invalida o índice (invalidate_path_index).
+    """
+    clear = delete(UserPathProgressCount)
+    totals = select(PathChallenge.path_id, func.count().label('total_steps')).group_by(PathChallenge.path_id)
+    if path_ids is not None:
+        path_ids = list(path_ids)
+        if not path_ids:
+            return
+        clear = clear.where(UserPathProgressCount.path_id.in_(path_ids))
+        totals = totals.where(PathChallenge.path_id.in_(path_ids))
+    totals = totals.subquery()
+    counts = select(
+        UserChallenge.user_id,
+        PathChallenge.path_id,
+        func.count(func.distinct(PathChallenge.challenge_id)),
+        totals.c.total_steps
+    ).join(PathChallenge, PathChallenge.challenge_id == UserChallenge.challenge_id)\
+        .join(totals, totals.c.path_id == PathChallenge.path_id)\
+        .group_by(UserChallenge.user_id, PathChallenge.path_id, totals.c.total_steps)
+    db.session.execute(clear)
+    db.session.execute(insert(UserPathProgressCount).from_select(
+        ['user_id', 'path_id', 'completed_steps', 'total_steps'], counts))
+
+def increment_path_progress(user_id, path_ids):
+    """
+    Soma um passo concluído ao progresso do utilizador nas trilhas indicadas e
+    devolve {path_id: (completed_steps, total_steps)}.
+    """
+    path_totals = get_path_index()['path_totals']
+    # Upsert atómico: conclusões simultâneas do mesmo utilizador não colidem na chave primária
+    stmt = dialect_insert(UserPathProgressCount).values([
+        {'user_id': user_id, 'path_id': path_id, 'completed_steps': 1, 'total_steps': path_totals.get(path_id, 0)}
+        for path_id in path_ids
+    ])
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'path_id'],
+        set_={'completed_steps': UserPathProgressCount.__table__.c.completed_steps + 1}
+    ))
+    rows = db.session.query(UserPathProgressCount).filter(
+        UserPathProgressCount.user_id == user_id, UserPathProgressCount.path_id.in_(path_ids))
+    return {row.path_id: (row.completed_steps, row.total_steps) for row in rows}
 
 def check_and_complete_paths(user, completed_challenge_id):
-    paths_containing_challenge = PathChallenge.query.filter_by(challenge_id=completed_challenge_id).all()
-    if not paths_containing_challenge:
-        return
-    user_completed_challenges = {uc.challenge_id for uc in user.completed_challenges}
-    for pc in paths_containing_challenge:
-        path = pc.path
-        if UserPathProgress.query.filter_by(user_id=user.id, path_id=path.id).first():
-            continue
-        all_challenges_in_path = {c.challenge_id for c in path.challenges}
-        if all_challenges_in_path.issubset(user_completed_challenges):
+    """
+    Atualiza o progresso das trilhas que contêm o desafio e premeia as que ficaram
+    concluídas. Não faz commit; devolve quantas trilhas foram concluídas agora.
+    """
+    path_ids = get_path_index()['challenge_paths'].get(completed_challenge_id)
+    if not path_ids:
+        return 0
+    progress = increment_path_progress(user.id, path_ids)
+    finished_ids = {path_id for path_id, (completed, total) in progress.items() if total and completed >= total}
+    if not finished_ids:
+        return 0
+    newly_completed = 0
+    for path in db.session.query(LearningPath.id, LearningPath.name, LearningPath.reward_points).filter(LearningPath.id.in_(finished_ids)):
+        if insert_if_absent(UserPathProgress, ['user_id', 'path_id'], user_id=user.id, path_id=path.id):
             user.points += path.reward_points
-            progress = UserPathProgress(user_id=user.id, path_id=path.id)
-            db.session.add(progress)
-            db.session.commit()
-            check_and_award_achievements(user)
+            newly_completed += 1
             flash(f'Trilha "{path.name}" concluída! Você ganhou {path.reward_points} pontos de bônus!', 'success')
+    return newly_completed
+
+BATTLE_CHALLENGE_COUNT = 5
+
+def select_battle_challenges(team_ids, count=BATTLE_CHALLENGE_COUNT):
+    """
+    Sorteia em SQL (ORDER BY random() LIMIT) os desafios de uma batalha entre as equipas indicadas.
+    Os desafios ainda não resolvidos por nenhum membro das equipas vêm primeiro; depois,
+    os resolvidos por menos membros. Devolve a lista de ids (pode ter menos de `count`).
+    """
+    solvers = select(UserChallenge.challenge_id, func.count().label('solvers'))\
+        .join(User, User.id == UserChallenge.user_id)\
+        .where(User.team_id.in_(team_ids))\
+        .group_by(UserChallenge.challenge_id).subquery()
+    rows = db.session.query(Challenge.id)\
+        .outerjoin(solvers, solvers.c.challenge_id == Challenge.id)\
+        .filter(Challenge.is_team_challenge == False)\
+        .order_by(func.coalesce(solvers.c.solvers, 0), func.random())\
+        .limit(count)
+    return [row.id for row in rows]
 
 def finalize_ended_battles():
     """
-    Verifica todas as batalhas ativas, finaliza as que já terminaram,
-    calcula o vencedor e distribui os prémios.
+    Finaliza todas as batalhas ativas cujo prazo terminou: reclama-as com um UPDATE
+    condicional (só as que ainda estão 'active'), pontua as reclamadas com uma única
+    agregação sobre TeamBattleChallenge, marca-as como 'completed' (ou 'expired' se
+    nenhuma equipa pontuou) e paga os vencedores com UPDATEs em massa.
+    Devolve quantas batalhas foram processadas.
     """
-    ended_battles = TeamBattle.query.filter(
-        TeamBattle.status == 'active',
-        TeamBattle.end_time <= datetime.utcnow()
+    # Uma batalha já reclamada por outra execução deixou de estar 'active' e fica de fora
+    due_battles = db.session.execute(
+        update(TeamBattle)
+        .where(TeamBattle.status == 'active', TeamBattle.end_time <= datetime.utcnow())
+        .values(status='completed')
+        .returning(TeamBattle.id, TeamBattle.challenging_team_id, TeamBattle.challenged_team_id, TeamBattle.reward_points)
+        .execution_options(synchronize_session=False)
     ).all()
+    if not due_battles:
+        return 0
+    due_ids = [battle.id for battle in due_battles]
+
+    # Contar quantos desafios cada equipa completou, em todas as batalhas de uma vez
+    scores = {
+        (battle_id, team_id): score
+        for battle_id, team_id, score in db.session.query(
+            TeamBattleChallenge.battle_id, TeamBattleChallenge.completed_by_team_id, func.count(TeamBattleChallenge.id)
+        ).filter(
+            TeamBattleChallenge.battle_id.in_(due_ids),
+            TeamBattleChallenge.completed_by_team_id.isnot(None)
+        ).group_by(TeamBattleChallenge.battle_id, TeamBattleChallenge.completed_by_team_id)
+    }
 
-    battles_finalized_count = 0
-    for battle in ended_battles:
-        # Contar quantos desafios cada equipa completou
-        challenger_score = TeamBattleChallenge.query.filter(
-            TeamBattleChallenge.battle_id == battle.id,
-            TeamBattleChallenge.completed_by_team_id == battle.challenging_team_id
-        ).count()
-        
-        challenged_score = TeamBattleChallenge.query.filter(
-            TeamBattleChallenge.battle_id == battle.id,
-            TeamBattleChallenge.completed_by_team_id == battle.challenged_team_id
-        ).count()
-
-        # Determinar o vencedor
-        winner = None
-        if challenger_score > challenged_score:
-            winner = battle.challenging_team
-        elif challenged_score > challenger_score:
-            winner = battle.challenged_team
-        # Em caso de empate, ninguém vence
-
-        if winner:
-            battle.winner_team_id = winner.id
-            # Distribuir os pontos para cada membro da equipa vencedora
-            for member in winner.members:
-                member.points += battle.reward_points
-                update_user_level(member) # Atualiza o nível do membro, se aplicável
-            flash(f'A equipa "{winner.name}" venceu a batalha contra "{battle.challenged_team.name if winner.id == battle.challenging_team_id else battle.challenging_team.name}"!', 'success')
-        
-        battle.status = 'completed'
-        battles_finalized_count += 1
-    
-    if battles_finalized_count > 0:
+    statuses, winners, team_rewards = {}, {}, {}
+    for battle in due_battles:
+        challenger_score = scores.get((battle.id, battle.challenging_team_id), 0)
+        challenged_score = scores.get((battle.id, battle.challenged_team_id), 0)
+        # Sem pontuação de nenhuma equipa a batalha expira; em caso de empate, ninguém vence
+        statuses[battle.id] = 'expired' if challenger_score == challenged_score == 0 else 'completed'
+        if challenger_score != challenged_score:
+            winner_id = battle.challenging_team_id if challenger_score > challenged_score else battle.challenged_team_id
+            winners[battle.id] = winner_id
+            team_rewards[winner_id] = team_rewards.get(winner_id, 0) + (battle.reward_points or 0)
+
+    db.session.execute(
+        update(TeamBattle)
+        .where(TeamBattle.id.in_(due_ids))
+        .values(
+            status=case(statuses, value=TeamBattle.id),
+            winner_team_id=case(winners, value=TeamBattle.id, else_=None) if winners else None
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    # Distribuir os pontos para todos os membros das equipas vencedoras num só UPDATE
+    credit_teams(team_rewards, 'team_battle')
+
+    db.session.commit()
+    return len(due_battles)
+
+# --- PIPELINE DE SUBMISSÃO DE DESAFIOS ---
+def load_submission_context(user, challenge_id):
+    """
+    Carrega numa passagem tudo o que a conclusão de um desafio precisa: dados globais
+    em cache (desafio do dia, evento ativo, índice das trilhas) e, em consultas agrupadas,
+    os dados do utilizador (contadores, conquistas e desafios de batalha pendentes).
+    """
+    stats = db.session.query(
+        select(func.count(UserChallenge.id)).where(UserChallenge.user_id == user.id).scalar_subquery(),
+        select(func.count(UserPathProgress.id)).where(UserPathProgress.user_id == user.id).scalar_subquery()
+    ).one()
+
+    context = {
+        'daily': get_daily_challenge_info(),
+        'event': get_active_event_info(),
+        'path_ids': get_path_index()['challenge_paths'].get(challenge_id, []),
+        'challenges_completed': stats[0],
+        'paths_completed': stats[1],
+        'earned_achievement_ids': None,
+        'battle_challenges': [],
+    }
+    if get_achievements_catalog():
+        context['earned_achievement_ids'] = {row.achievement_id for row in db.session.query(UserAchievement.achievement_id).filter_by(user_id=user.id)}
+    if user.team_id:
+        ChallengingTeam, ChallengedTeam = aliased(Team), aliased(Team)
+        context['battle_challenges'] = db.session.query(
+            TeamBattleChallenge.id,
+            case((TeamBattle.challenging_team_id == user.team_id, ChallengedTeam.name), else_=ChallengingTeam.name).label('opponent_name')
+        ).join(TeamBattle, TeamBattle.id == TeamBattleChallenge.battle_id)\
+            .join(ChallengingTeam, ChallengingTeam.id == TeamBattle.challenging_team_id)\
+            .join(ChallengedTeam, ChallengedTeam.id == TeamBattle.challenged_team_id)\
+            .filter(
+                TeamBattleChallenge.challenge_id == challenge_id,
+                TeamBattleChallenge.completed_by_team_id.is_(None),
+                TeamBattle.status == 'active',
+                (TeamBattle.challenging_team_id == user.team_id) | (TeamBattle.challenged_team_id == user.team_id)
+            ).all()
+    return context
+
+def complete_challenge(user, challenge):
+    """
+    Regista a conclusão de um desafio e aplica todos os efeitos (bónus do dia, batalhas,
+    trilhas, nível, conquistas e evento global) numa única transação.
+    Devolve False se o utilizador já tinha completado o desafio.
+    """
+    # A conclusão é uma única instrução: se nenhuma linha foi inserida, já tinha sido premiada
+    if not insert_if_absent(UserChallenge, ['user_id', 'challenge_id'], user_id=user.id, challenge_id=challenge.id, completed_at=datetime.utcnow()):
+        return False
+    context = load_submission_context(user, challenge.id)
+
+    user.points += challenge.points_reward
+    flash_message = f'Parabéns! Completou o desafio "{challenge.title}" e ganhou {challenge.points_reward} pontos!'
+    if context['daily']['challenge_id'] == challenge.id:
+        user.points += context['daily']['bonus_points']
+        flash_message += f' Você ganhou {context["daily"]["bonus_points"]} pontos de bônus por completar o desafio do dia!'
+
+    # Batalha de equipas: marca o desafio só se nenhuma equipa o completou entretanto
+    for battle_challenge in context['battle_challenges']:
+        scored = db.session.execute(
+            update(TeamBattleChallenge)
+            .where(TeamBattleChallenge.id == battle_challenge.id, TeamBattleChallenge.completed_by_team_id.is_(None))
+            .values(completed_by_team_id=user.team_id, completed_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if scored:
+            flash(f'A sua equipa marcou pontos na batalha contra "{battle_challenge.opponent_name}"!', 'info')
+
+    paths_completed_now = check_and_complete_paths(user, challenge.id) if context['path_ids'] else 0
+    update_user_level(user)
+    check_and_award_achievements(
+        user,
+        challenges_completed_count=context['challenges_completed'],
+        paths_completed_count=context['paths_completed'] + paths_completed_now,
+        earned_ids=context['earned_achievement_ids']
+    )
+
+    # Evento Global (World Boss): escritas atómicas, aplicadas por último
+    # para que a linha do evento fique bloqueada o menor tempo possível até ao commit.
+    event = context['event']
+    defeated = None
+    if event:
+        damage = challenge.points_reward
+        defeated = apply_event_damage(event['id'], user.id, damage)
+        if defeated is not None:
+            flash(f'Você causou {damage} de dano ao Boss Global!', 'success')
+        if defeated:
+            flash(f'O Boss Global "{event["name"]}" foi derrotado!', 'success')
+
+    user_id = user.id
+    db.session.commit()
+    invalidate_user_challenges_cache(user_id)
+    if defeated:
+        invalidate_active_event_cache()
+        finalize_global_events([event['id']])
+    flash(flash_message, 'success')
+    return True
+
+# --- TAREFAS AGENDADAS ---
+SCHEDULER_INTERVAL_SECONDS = int(os.getenv('SCHEDULER_INTERVAL_SECONDS', 60))
+JOB_LOCK_TTL_SECONDS = 300
+JOB_LOCK_OWNER = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+def acquire_job_lock(name, ttl=JOB_LOCK_TTL_SECONDS):
+    """Obtém o bloqueio (na base de dados) de uma tarefa, partilhado por todos os processos."""
+    now = datetime.utcnow()
+    db.session.execute(dialect_insert(JobLock).values(name=name).on_conflict_do_nothing(index_elements=['name']))
+    acquired = db.session.execute(
+        update(JobLock)
+        .where(JobLock.name == name, (JobLock.locked_until.is_(None)) | (JobLock.locked_until < now))
+        .values(locked_until=now + timedelta(seconds=ttl), owner=JOB_LOCK_OWNER)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+    db.session.commit()
+    return acquired
+
+def release_job_lock(name):
+    db.session.execute(
+        update(JobLock)
+        .where(JobLock.name == name, JobLock.owner == JOB_LOCK_OWNER)
+        .values(locked_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+def run_locked_job(name, job):
+    """Executa a tarefa se nenhum outro processo a estiver a executar. Devolve None se estiver ocupada."""
+    if not acquire_job_lock(name):
+        return None
+    try:
+        return job()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        release_job_lock(name)
+
+SCHEDULED_JOBS = [
+    ('finalize_battles', finalize_ended_battles),
+    ('finalize_events', finalize_global_events),
+    ('plan_daily_challenges', plan_daily_challenges),
+    ('backfill_achievements', process_achievement_backfills),
+    ('collect_orphan_attachments', collect_orphan_attachments),
+    ('import_jobs', process_import_jobs),
+]
+
+def run_scheduled_jobs():
+    """Executa uma ronda de todas as tarefas agendadas e devolve {tarefa: itens processados}."""
+    results = {}
+    for name, job in SCHEDULED_JOBS:
+        try:
+            results[name] = run_locked_job(name, job)
+        except Exception:
+            app.logger.exception(f'Erro na tarefa agendada {name}')
+            results[name] = None
+    app.logger.info(f'Tarefas agendadas executadas: {results}')
+    return results
+
+def start_background_scheduler(interval=SCHEDULER_INTERVAL_SECONDS):
+    """Inicia uma thread que executa as tarefas agendadas a cada `interval` segundos."""
+    def loop():
+        while True:
+            with app.app_context():
+                run_scheduled_jobs()
+                db.session.remove()
+            time.sleep(interval)
+    threading.Thread(target=loop, name='scheduler', daemon=True).start()
+
+# --- OPERAÇÕES EM MASSA DE ADMINISTRAÇÃO ---
+# Ações disponíveis por entidade e a página de administração para onde o formulário volta
+BULK_ACTIONS = {
+    'faqs': ('delete', 'set_category'),
+    'challenges': ('delete', 'set_level'),
+    'users': ('delete',),
+    'teams': ('delete',),
+}
+BULK_REDIRECTS = {'faqs': 'admin_faq', 'challenges': 'admin_challenges', 'users': 'admin_users', 'teams': 'admin_teams'}
+
+def bulk_execute(counts, stmt, label=None):
+    """Executa um DELETE/UPDATE em massa e soma as linhas afetadas em counts[label ou tabela]."""
+    result = db.session.execute(stmt.execution_options(synchronize_session=False))
+    if result.rowcount:
+        label = label or stmt.table.name
+        counts[label] = counts.get(label, 0) + result.rowcount
+    return result.rowcount
+
+def bulk_delete_faqs(ids, counts):
+    """Apaga as FAQ e as referências aos anexos. Devolve os sha256 a recolher depois do commit."""
+    released = release_faq_attachments(ids)
+    bulk_execute(counts, delete(FAQAttachment).where(FAQAttachment.faq_id.in_(ids)))
+    bulk_execute(counts, delete(FAQ).where(FAQ.id.in_(ids)))
+    return released
+
+def bulk_set_faq_category(ids, category_id, counts):
+    if db.session.get(Category, category_id) is None:
+        raise ValueError('Categoria inexistente.')
+    bulk_execute(counts, update(FAQ).where(FAQ.id.in_(ids)).values(category_id=category_id), 'faq.category_id')
+
+def bulk_delete_challenges(ids, counts):
+    affected_path_ids = [row.path_id for row in db.session.query(PathChallenge.path_id)
+                         .filter(PathChallenge.challenge_id.in_(ids)).distinct()]
+    for model in (UserChallenge, PathChallenge, DailyChallenge, TeamBattleChallenge):
+        bulk_execute(counts, delete(model).where(model.challenge_id.in_(ids)))
+    bulk_execute(counts, delete(Challenge).where(Challenge.id.in_(ids)))
+    rebuild_path_progress_counts(affected_path_ids)
+
+def bulk_set_challenge_level(ids, level_name, counts):
+    if not db.session.query(Level.id).filter_by(name=level_name).first():
+        raise ValueError('Nível inexistente.')
+    bulk_execute(counts, update(Challenge).where(Challenge.id.in_(ids)).values(level_required=level_name),
+                 'challenge.level_required')
+
+def bulk_delete_teams(ids, counts):
+    """Dissolve as equipas: desvincula os membros e apaga o progresso nos Boss Fights e as batalhas."""
+    battles = or_(TeamBattle.challenging_team_id.in_(ids), TeamBattle.challenged_team_id.in_(ids))
+    bulk_execute(counts, delete(TeamBattleChallenge).where(TeamBattleChallenge.battle_id.in_(select(TeamBattle.id).where(battles))))
+    bulk_execute(counts, delete(TeamBattle).where(battles))
+    bulk_execute(counts, update(User).where(User.team_id.in_(ids)).values(team_id=None), 'user.team_id')
+    for model in (TeamBossProgress, TeamBossCompletion, TeamBossProgressCount):
+        bulk_execute(counts, delete(model).where(model.team_id.in_(ids)))
+    bulk_execute(counts, delete(Team).where(Team.id.in_(ids)))
+
+def bulk_delete_users(ids, counts):
+    """
+    Apaga os utilizadores e todos os seus dados. A posse das equipas passa para o membro restante
+    mais antigo; as equipas sem outros membros são dissolvidas. Devolve os ids dos eventos globais
+    em que os utilizadores participaram, cujas classificações deixam de ser válidas.
+    """
+    successor = select(User.id).where(User.team_id == Team.id, User.id.notin_(ids))\
+        .order_by(User.registered_at, User.id).limit(1).scalar_subquery()
+    owned = db.session.execute(select(Team.id, successor.label('new_owner_id')).where(Team.owner_id.in_(ids))).all()
+    transfers = [{'id': team.id, 'owner_id': team.new_owner_id} for team in owned if team.new_owner_id]
+    if transfers:
+        db.session.execute(update(Team), transfers)
+        counts['team.owner_id'] = len(transfers)
+    dissolved = [team.id for team in owned if not team.new_owner_id]
+    if dissolved:
+        bulk_delete_teams(dissolved, counts)
+
+    affected_team_ids = [row.team_id for row in db.session.query(TeamBossProgress.team_id)
+                         .filter(TeamBossProgress.completed_by_user_id.in_(ids)).distinct()]
+    bulk_execute(counts, delete(TeamBossProgress).where(TeamBossProgress.completed_by_user_id.in_(ids)))
+    rebuild_boss_progress_counts(team_ids=affected_team_ids)
+    affected_event_ids = [event_id for (event_id,) in db.session.query(GlobalEventContribution.event_id)
+                          .filter(GlobalEventContribution.user_id.in_(ids))
+                          .union(db.session.query(GlobalEventRanking.event_id)
+                                 .filter(GlobalEventRanking.user_id.in_(ids)))]
+    for model in (UserChallenge, UserPathProgress, UserPathProgressCount, UserAchievement, UserHuntProgress,
+                  ChatMessage, GlobalEventContribution, GlobalEventRanking, PointsLedger, UserNotification, Ticket):
+        bulk_execute(counts, delete(model).where(model.user_id.in_(ids)))
+    # Desvincula o código de convite em vez de apagar
+    bulk_execute(counts, update(InvitationCode).where(InvitationCode.used_by_user_id.in_(ids))
+                 .values(used_by_user_id=None, used=False), 'invitation_code.used_by_user_id')
+    bulk_execute(counts, update(ImportJob).where(ImportJob.created_by.in_(ids)).values(created_by=None),
+                 'import_job.created_by')
+    bulk_execute(counts, delete(User).where(User.id.in_(ids)))
+    return affected_event_ids
+
+def run_bulk_operation(entity, action, ids, value=None, acting_user_id=None):
+    """
+    Aplica `action` às entidades `ids` numa única transação, com um DELETE/UPDATE por tabela
+    afetada. Devolve {tabela ou tabela.coluna: linhas afetadas}. ValueError se o pedido for inválido.
+    """
+    if action not in BULK_ACTIONS.get(entity, ()):
+        raise ValueError('Operação em massa desconhecida.')
+    try:
+        ids = sorted({int(entity_id) for entity_id in ids})
+    except (TypeError, ValueError):
+        raise ValueError('Identificadores inválidos.')
+    if not ids:
+        raise ValueError('Nenhum item selecionado.')
+    if entity == 'users' and acting_user_id in ids:
+        raise ValueError('Não pode apagar a sua própria conta.')
+    counts, released, affected_event_ids = {}, [], []
+    try:
+        if entity == 'faqs' and action == 'delete':
+            released = bulk_delete_faqs(ids, counts)
+        elif entity == 'faqs':
+            try:
+                category_id = int(value)
+            except (TypeError, ValueError):
+                raise ValueError('Categoria inexistente.')
+            bulk_set_faq_category(ids, category_id, counts)
+        elif entity == 'challenges' and action == 'delete':
+            bulk_delete_challenges(ids, counts)
+        elif entity == 'challenges':
+            bulk_set_challenge_level(ids, value, counts)
+        elif entity == 'users':
+            affected_event_ids = bulk_delete_users(ids, counts)
+        else:
+            bulk_delete_teams(ids, counts)
         db.session.commit()
-    
-    return battles_finalized_count
+    except Exception:
+        db.session.rollback()
+        raise
+    collect_orphan_attachments(released)
+    if entity == 'challenges' or counts.get('team_battle_challenge'):
+        invalidate_challenges_cache()
+        invalidate_daily_challenge_cache()
+    if counts.get('path_challenge'):
+        invalidate_path_index()
+    if entity in ('users', 'teams'):
+        invalidate_dashboard_cache()
+    for event_id in affected_event_ids:
+        cache.delete(f'events:leaderboard:{event_id}')
+    return counts
+
+def bulk_report(counts):
+    return ', '.join(f'{label}: {rows}' for label, rows in sorted(counts.items())) or 'nenhuma linha alterada'
+
+# --- SNAPSHOTS DA PLATAFORMA ---
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_CHUNK_ROWS = int(os.getenv('SNAPSHOT_CHUNK_ROWS', 50000))
+# Estado de execução local, sem significado noutro ambiente
+SNAPSHOT_EXCLUDED_TABLES = {'job_lock', 'import_job'}
+
+def snapshot_plan(metadata=None):
+    """
+    Tabelas pela ordem de inserção e as colunas de chave estrangeira que fecham ciclos
+    (ex.: user.team_id <-> team.owner_id): estas são inseridas a NULL e preenchidas no fim.
+    """
+    metadata = metadata or db.metadata
+    tables = [table for table in metadata.tables.values() if table.name not in SNAPSHOT_EXCLUDED_TABLES]
+    ordered, deferred = [], {}
+    for table, constraints in sort_tables_and_constraints(tables):
+        if table is not None:
+            ordered.append(table)
+            continue
+        for constraint in constraints:
+            for column in constraint.columns:
+                if column.nullable:
+                    deferred.setdefault(constraint.table.name, []).append(column.name)
+    return ordered, deferred
+
+def snapshot_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f'Tipo não suportado no snapshot: {type(value).__name__}')
+
+def snapshot_decoders(table, columns):
+    """Uma função por coluna que converte o valor do JSON de volta para o tipo da coluna."""
+    def decoder(column):
+        if isinstance(column.type, db.DateTime):
+            return lambda value: None if value is None else datetime.fromisoformat(value)
+        if isinstance(column.type, db.Date):
+            return lambda value: None if value is None else date.fromisoformat(value)
+        if isinstance(column.type, db.LargeBinary):
+            return lambda value: None if value is None else base64.b64decode(value)
+        return None
+    return [decoder(table.c[name]) for name in columns]
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(ATTACHMENT_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def export_snapshot(directory, engine=None, chunk_rows=SNAPSHOT_CHUNK_ROWS, progress=None):
+    """
+    Exporta todas as tabelas (exceto SNAPSHOT_EXCLUDED_TABLES) para `directory`: cada tabela em
+    ficheiros NDJSON comprimidos com gzip de `chunk_rows` linhas, lidos em streaming numa única
+    transação de leitura (snapshot consistente), mais os ficheiros do armazenamento de anexos.
+    No SQLite sem WAL a transação de leitura faz esperar as escritas até ao fim da exportação.
+    O manifest.json, com linhas e SHA-256 de cada bloco, é escrito no fim.
+    Devolve o manifesto.
+    """
+    engine = engine or db.engine
+    tables, _ = snapshot_plan()
+    os.makedirs(directory, exist_ok=False)
+    manifest = {'version': SNAPSHOT_FORMAT_VERSION, 'created_at': datetime.utcnow().isoformat(),
+                'dialect': engine.dialect.name, 'tables': [], 'attachments': []}
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn = conn.execution_options(isolation_level='REPEATABLE READ')
+        with conn.begin():
+            if engine.dialect.name == 'sqlite':
+                # O pysqlite não abre transação antes de SELECTs: sem BEGIN explícito cada tabela
+                # seria lida num estado diferente da base de dados
+                conn.exec_driver_sql('BEGIN')
+            for table in tables:
+                columns = [column.name for column in table.columns]
+                entry = {'name': table.name, 'columns': columns, 'rows': 0, 'chunks': []}
+                table_dir = os.path.join(directory, 'tables', table.name)
+                os.makedirs(table_dir)
+                result = conn.execution_options(yield_per=chunk_rows).execute(
+                    select(table).order_by(*table.primary_key.columns))
+                for number, rows in enumerate(result.partitions(chunk_rows)):
+                    file_name = f'{number:05d}.ndjson.gz'
+                    path = os.path.join(table_dir, file_name)
+                    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as f:
+                        for row in rows:
+                            f.write(json.dumps(list(row), ensure_ascii=False, default=snapshot_default) + '\n')
+                    entry['chunks'].append({'file': f'tables/{table.name}/{file_name}', 'rows': len(rows),
+                                            'sha256': file_sha256(path)})
+                    entry['rows'] += len(rows)
+                manifest['tables'].append(entry)
+                if progress:
+                    progress(table.name, entry['rows'])
+            # Os anexos referenciados pelas linhas exportadas (o armazenamento só acrescenta ficheiros)
+            for sha256, compression in conn.execute(select(AttachmentBlob.sha256, AttachmentBlob.compression)):
+                source = attachment_path(sha256, compression)
+                relative = os.path.relpath(source, app.config['ATTACHMENT_STORE_DIR'])
+                target = os.path.join(directory, 'attachments', relative)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(source, target)
+                manifest['attachments'].append(relative)
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+def restore_snapshot(directory, engine=None, replace=False, progress=None):
+    """
+    Repõe um snapshot de export_snapshot numa única transação: verifica os SHA-256 dos
+    blocos, apaga os dados atuais (só com `replace`), insere cada bloco com um INSERT em massa
+    com as verificações de chaves estrangeiras adiadas para o commit, e repõe no fim as colunas
+    que fecham ciclos e as sequências (PostgreSQL). Devolve {tabela: linhas}.
+    """
+    engine = engine or db.engine
+    with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f'Versão de snapshot não suportada: {manifest.get("version")}')
+    tables, deferred = snapshot_plan()
+    by_name = {table.name: table for table in tables}
+    unknown = [entry['name'] for entry in manifest['tables'] if entry['name'] not in by_name]
+    if unknown:
+        raise ValueError(f'Tabelas desconhecidas no snapshot: {", ".join(unknown)}')
+    entries = {entry['name']: entry for entry in manifest['tables']}
+    counts = {}
+    with engine.begin() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn.execute(text('SET CONSTRAINTS ALL DEFERRED'))
+        elif engine.dialect.name == 'sqlite':
+            conn.execute(text('PRAGMA defer_foreign_keys = ON'))
+        if not replace and any(conn.execute(select(table).limit(1)).first() for table in tables):
+            raise ValueError('A base de dados de destino já tem dados; use a opção de substituir.')
+        for name, columns in deferred.items():
+            conn.execute(by_name[name].update().values({column: None for column in columns}))
+        for table in [db.metadata.tables['import_job']] + list(reversed(tables)):
+            conn.execute(table.delete())
+        pending_updates = []
+        for table in tables:
+            entry = entries.get(table.name)
+            if entry is None:
+                continue
+            columns = [name for name in entry['columns'] if name in table.c]
+            positions = [entry['columns'].index(name) for name in columns]
+            decoders = snapshot_decoders(table, columns)
+            postponed = [name for name in deferred.get(table.name, []) if name in columns]
+            key_columns = [column.name for column in table.primary_key.columns]
+            for chunk in entry['chunks']:
+                path = os.path.join(directory, chunk['file'])
+                if file_sha256(path) != chunk['sha256']:
+                    raise ValueError(f'Bloco corrompido: {chunk["file"]}')
+                rows = []
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    for line in f:
+                        values = json.loads(line)
+                        row = {}
+                        for name, position, decode in zip(columns, positions, decoders):
+                            value = values[position]
+                            row[name] = decode(value) if decode else value
+                        for name in postponed:
+                            if row[name] is not None:
+                                pending_updates.append((table, name, {f'k_{key}': row[key] for key in key_columns}, row[name]))
+                                row[name] = None
+                        rows.append(row)
+                if rows:
+                    conn.execute(table.insert(), rows)
+            counts[table.name] = entry['rows']
+            if progress:
+                progress(table.name, entry['rows'])
+        # Colunas que fecham ciclos de chaves estrangeiras, agora que todas as linhas existem
+        grouped = {}
+        for table, name, keys, value in pending_updates:
+            grouped.setdefault((table, name), []).append(dict(keys, v=value))
+        for (table, name), params in grouped.items():
+            stmt = table.update().where(*[column == db.bindparam(f'k_{column.name}') for column in table.primary_key.columns])\
+                .values({name: db.bindparam('v')})
+            conn.execute(stmt, params)
+        if engine.dialect.name == 'postgresql':
+            for table in tables:
+                key = list(table.primary_key.columns)
+                if len(key) == 1 and isinstance(key[0].type, db.Integer) and key[0].autoincrement:
+                    # O nome da tabela é interpretado como identificador SQL: 'user' tem de ir citado
+                    sequence = func.pg_get_serial_sequence(conn.dialect.identifier_preparer.format_table(table), key[0].name)
+                    next_id = (conn.execute(select(func.max(key[0]))).scalar() or 0) + 1
+                    conn.execute(select(func.setval(sequence, next_id, False)))
+    store_dir = app.config['ATTACHMENT_STORE_DIR']
+    for relative in manifest.get('attachments', []):
+        target = os.path.join(store_dir, relative)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(os.path.join(directory, 'attachments', relative), target)
+    cache.clear()
+    return counts
 
 # --- CONTEXT PROCESSORS ---
 @app.context_processor
 def inject_user_gamification_data():
-    if current_user.is_authenticated and current_user.level:
-        return dict(user_level_insignia=current_user.level.insignia)
+    if current_user.is_authenticated:
+        return dict(user_level_insignia=get_level_progress(current_user)['insignia'])
     return dict(user_level_insignia='')
 
 @app.context_processor
 def inject_gamification_progress():
     if not current_user.is_authenticated:
         return {}
-    progress_data = {'percentage': 0, 'next_level_points': None}
-    if current_user.level:
-        current_level = current_user.level
-        next_level = Level.query.filter(Level.min_points > current_level.min_points).order_by(Level.min_points.asc()).first()
-        if next_level:
-            points_for_level = next_level.min_points - current_level.min_points
-            points_achieved = current_user.points - current_level.min_points
-            progress_data['percentage'] = max(0, min(100, (points_achieved / points_for_level) * 100 if points_for_level > 0 else 100))
-            progress_data['next_level_points'] = next_level.min_points
-        else:
-            progress_data['percentage'] = 100
-    return dict(progress=progress_data)
+    return dict(progress=get_level_progress(current_user))
 
 # --- ROTAS ---
 @app.route('/')
 @login_required
 def index():
-    daily_challenge = get_or_create_daily_challenge()
-    active_hunt = ScavengerHunt.query.filter_by(is_active=True).first()
-    hunt_progress = None
-    if active_hunt:
-        hunt_progress = UserHuntProgress.query.filter_by(user_id=current_user.id, hunt_id=active_hunt.id).first()
-
-    
-    active_event = GlobalEvent.query.filter(
-        GlobalEvent.is_active == True,
-        GlobalEvent.end_date >= datetime.utcnow(),
-        GlobalEvent.current_hp > 0
-    ).first()
-
-    event_progress = 0
-    if active_event:
-        event_progress = ((active_event.total_hp - active_event.current_hp) / active_event.total_hp) * 100
+    deliver_notifications(current_user.id)
+    daily_challenge = get_daily_challenge_info(create=True)
+    if daily_challenge['challenge_id'] is None:
+        daily_challenge = None
+    dashboard = get_dashboard_globals()
+    active_hunt = dashboard['active_hunt']
+    user_snapshot = get_dashboard_user_snapshot(current_user.id, active_hunt['id'] if active_hunt else None)
 
     return render_template('dashboard.html', 
                             daily_challenge=daily_challenge,
                             active_hunt=active_hunt, 
-                            hunt_progress=hunt_progress,
-                            active_event=active_event,      
-                            event_progress=event_progress)
+                            hunt_progress=user_snapshot['hunt_progress'],
+                            active_event=dashboard['active_event'],      
+                            event_progress=dashboard['event_progress'],
+                            event_leaderboard=dashboard['event_leaderboard'])
 
 @app.route('/hunt/start/<int:hunt_id>', methods=['POST'])
 @login_required
@@ -694,6 +3203,7 @@ def start_hunt(hunt_id):
         new_progress = UserHuntProgress(user_id=current_user.id, hunt_id=hunt.id, current_step=1)
         db.session.add(new_progress)
         db.session.commit()
+        invalidate_dashboard_user_cache(current_user.id)
         flash('Você começou a caça ao tesouro! Boa sorte!', 'success')
     return redirect(url_for('index'))
 
@@ -759,38 +3269,13 @@ def admin_delete_user(user_id):
         return redirect(url_for('admin_users'))
 
     user_to_delete = User.query.get_or_404(user_id)
-
-    # 1. Lidar com a posse da equipa
-    owned_team = Team.query.filter_by(owner_id=user_to_delete.id).first()
-    if owned_team:
-        other_members = owned_team.members.filter(User.id != user_to_delete.id).order_by(User.registered_at).all()
-        if other_members:
-            # Transfere a posse para o membro mais antigo
-            new_owner = other_members[0]
-            owned_team.owner_id = new_owner.id
-            flash(f"A posse da equipa '{owned_team.name}' foi transferida para {new_owner.name}.", 'info')
-        else:
-            # Apaga a equipa se for o único membro
-            TeamBossCompletion.query.filter_by(team_id=owned_team.id).delete()
-            TeamBossProgress.query.filter_by(team_id=owned_team.id).delete()
-            db.session.delete(owned_team)
-            flash(f"A equipa '{owned_team.name}' foi dissolvida pois o dono foi apagado.", 'info')
-
-    # 2. Apagar todas as dependências
-    UserChallenge.query.filter_by(user_id=user_to_delete.id).delete()
-    UserPathProgress.query.filter_by(user_id=user_to_delete.id).delete()
-    UserAchievement.query.filter_by(user_id=user_to_delete.id).delete()
-    TeamBossProgress.query.filter_by(completed_by_user_id=user_to_delete.id).delete()
-    ChatMessage.query.filter_by(user_id=user_to_delete.id).delete()
-    
-    # Desvincula o código de convite em vez de apagar
-    InvitationCode.query.filter_by(used_by_user_id=user_to_delete.id).update({'used_by_user_id': None, 'used': False})
-    
-    # 3. Apagar o utilizador
-    db.session.delete(user_to_delete)
-    db.session.commit()
-
-    flash(f'Utilizador {user_to_delete.name} e todos os seus dados foram apagados com sucesso.', 'success')
+    name = user_to_delete.name
+    counts = run_bulk_operation('users', 'delete', [user_to_delete.id], acting_user_id=current_user.id)
+    if counts.get('team.owner_id'):
+        flash('A posse da equipa do utilizador foi transferida para o membro mais antigo.', 'info')
+    if counts.get('team'):
+        flash('A equipa do utilizador foi dissolvida pois não tinha outros membros.', 'info')
+    flash(f'Utilizador {name} e todos os seus dados foram apagados com sucesso.', 'success')
     return redirect(url_for('admin_users'))
 
 @app.route('/chat-page')
@@ -818,6 +3303,7 @@ def chat():
                 if next_step_info:
                     progress.current_step += 1
                     db.session.commit()
+                    invalidate_dashboard_user_cache(current_user.id)
                     resposta_caca = f"🎉 **Pista Encontrada!**<br><br>{current_step_info.hidden_clue}<br><br><strong>Próxima Pista:</strong> {next_step_info.clue_text}"
                     return jsonify({'text': resposta_caca, 'html': True, 'state': 'normal', 'options': []})
                 else:
@@ -827,6 +3313,7 @@ def chat():
                     update_user_level(current_user)
                     check_and_award_achievements(current_user)
                     db.session.commit()
+                    invalidate_dashboard_user_cache(current_user.id)
                     resposta_final = f"🏆 **Parabéns!** Você completou a caça ao tesouro '{active_hunt.name}' e ganhou {active_hunt.reward_points} pontos! A última pista era: {current_step_info.hidden_clue}"
                     return jsonify({'text': resposta_final, 'html': True, 'state': 'normal', 'options': []})
                 
@@ -856,8 +3343,7 @@ def chat():
             if keywords:
                 relevant_challenge = Challenge.query.filter(Challenge.title.ilike(f'%{next(iter(keywords))}%')).first()
                 if relevant_challenge:
-                    is_completed = UserChallenge.query.filter_by(user_id=current_user.id, challenge_id=relevant_challenge.id).first()
-                    if not is_completed:
+                    if relevant_challenge.id not in get_completed_challenge_ids(current_user):
                         resposta['suggestion'] = {
                             'text': f"Parece que você está interessado neste tópico! Que tal tentar o desafio '{relevant_challenge.title}' e ganhar {relevant_challenge.points_reward} pontos?",
                             'challenge_id': relevant_challenge.id
@@ -951,8 +3437,7 @@ def edit_faq(faq_id):
         faq.video_url = request.form.get('edit_video_url') or None
         file = request.files.get('edit_file')
         if file and file.filename:
-            faq.file_name = file.filename
-            faq.file_data = file.read()
+            set_faq_attachment(faq, file.filename, file.stream)
         db.session.commit()
         flash('FAQ atualizada com sucesso!', 'success')
         return redirect(url_for('faqs'))
@@ -965,8 +3450,10 @@ def delete_faq(faq_id):
         flash('Acesso negado. Apenas administradores podem gerenciar FAQs.', 'error')
         return redirect(url_for('faqs'))
     faq = FAQ.query.get_or_404(faq_id)
+    released = release_faq_attachments([faq.id])
     db.session.delete(faq)
     db.session.commit()
+    collect_orphan_attachments(released)
     flash('FAQ excluída com sucesso!', 'success')
     return redirect(url_for('faqs'))
 
@@ -978,11 +3465,12 @@ def delete_multiple_faqs():
         return redirect(url_for('faqs'))
     faq_ids = request.form.getlist('faq_ids')
     if faq_ids:
-        FAQs_to_delete = FAQ.query.filter(FAQ.id.in_(faq_ids)).all()
-        for faq in FAQs_to_delete:
-            db.session.delete(faq)
-        db.session.commit()
-        flash(f'{len(faq_ids)} FAQs excluídas com sucesso!', 'success')
+        try:
+            counts = run_bulk_operation('faqs', 'delete', faq_ids)
+        except ValueError as e:
+            flash(str(e), 'error')
+        else:
+            flash(f'{counts.get("faq", 0)} FAQs excluídas com sucesso!', 'success')
     else:
         flash('Nenhuma FAQ selecionada para exclusão.', 'error')
     return redirect(url_for('faqs'))
@@ -990,9 +3478,15 @@ def delete_multiple_faqs():
 @app.route('/download/<int:faq_id>')
 @login_required
 def download(faq_id):
-    faq = FAQ.query.get_or_404(faq_id)
-    if faq.file_data:
-        return send_file(io.BytesIO(faq.file_data), download_name=faq.file_name, as_attachment=True)
+    faq = db.session.query(FAQ.id, FAQ.file_name, AttachmentBlob.sha256, AttachmentBlob.size,
+                           AttachmentBlob.compression, FAQAttachment.created_at)\
+        .outerjoin(FAQAttachment, FAQAttachment.faq_id == FAQ.id)\
+        .outerjoin(AttachmentBlob, AttachmentBlob.sha256 == FAQAttachment.sha256)\
+        .filter(FAQ.id == faq_id).first()
+    if faq is None:
+        abort(404)
+    if faq.sha256:
+        return send_faq_attachment(faq.file_name or f'anexo_{faq.id}', faq.sha256, faq.size, faq.compression, faq.created_at)
     flash('Nenhum arquivo encontrado.', 'error')
     return redirect(url_for('faqs'))
 
@@ -1099,20 +3593,15 @@ def admin_faq():
             image_url = request.form.get('image_url')
             video_url = request.form.get('video_url')
             file = request.files.get('file')
-            file_name = None
-            file_data = None
-            if file:
-                file_name = secure_filename(file.filename)
-                file_data = file.read()
             faq = FAQ(
                 category_id=category_id,
                 question=question,
                 answer=answer,
                 image_url=image_url,
-                video_url=video_url,
-                file_name=file_name,
-                file_data=file_data
+                video_url=video_url
             )
+            if file:
+                set_faq_attachment(faq, secure_filename(file.filename), file.stream)
             db.session.add(faq)
             db.session.commit()
             flash('FAQ criada com sucesso!', 'success')
@@ -1120,56 +3609,29 @@ def admin_faq():
             category_id = request.form['category_import']
             file = request.files['faq_file']
             if file:
-                if file.filename.endswith('.json'):
-                    try:
-                        data = json.load(file)
-                        for faq_data in data:
-                            faq = FAQ(
-                                category_id=category_id,
-                                question=faq_data['question'],
-                                answer=faq_data['answer'],
-                                image_url=faq_data.get('image_url'),
-                                video_url=faq_data.get('video_url')
-                            )
-                            db.session.add(faq)
-                        db.session.commit()
-                        flash('FAQs importadas com sucesso!', 'success')
-                    except Exception as e:
-                        flash(f'Erro ao importar FAQs: {str(e)}', 'error')
-                elif file.filename.endswith('.csv'):
-                    try:
-                        csv_data = csv.DictReader(file.stream.read().decode('utf-8').splitlines())
-                        for row in csv_data:
-                            faq = FAQ(
-                                category_id=category_id,
-                                question=row['question'],
-                                answer=row['answer'],
-                                image_url=row.get('image_url'),
-                                video_url=row.get('video_url')
-                            )
-                            db.session.add(faq)
-                        db.session.commit()
-                        flash('FAQs importadas com sucesso!', 'success')
-                    except Exception as e:
-                        flash(f'Erro ao importar FAQs: {str(e)}', 'error')
-                elif file.filename.endswith('.pdf'):
+                file_format = file.filename.rsplit('.', 1)[-1].lower()
+                if file_format in ('json', 'csv'):
+                    last_stats = {}
+
+                    def report_progress(stats):
+                        last_stats.update(stats)
+                        app.logger.info(f'Importação de FAQs ({file.filename}): {stats["read"]} lidas, '
+                                        f'{stats["imported"]} importadas')
+
                     try:
-                        pdf = PdfReader(file)
-                        text = ''
-                        for page in pdf.pages:
-                            text += page.extract_text()
-                        doc = nlp(text)
-                        for sent in doc.sents:
-                            faq = FAQ(
-                                category_id=category_id,
-                                question=sent.text[:200],
-                                answer=sent.text
-                            )
-                            db.session.add(faq)
-                        db.session.commit()
-                        flash('FAQs extraídas do PDF com sucesso!', 'success')
+                        stats = import_faqs_from_file(file.stream, file_format, category_id, progress=report_progress)
+                        flash(f'{stats["imported"]} FAQs importadas com sucesso! '
+                              f'({stats["duplicates"]} duplicadas e {stats["invalid"]} inválidas ignoradas)', 'success')
+                        for error in stats['errors']:
+                            flash(error, 'warning')
                     except Exception as e:
-                        flash(f'Erro ao importar FAQs do PDF: {str(e)}', 'error')
+                        db.session.rollback()
+                        flash(f'Erro ao importar FAQs: {str(e)} '
+                              f'({last_stats.get("imported", 0)} FAQs já tinham sido importadas)', 'error')
+                elif file_format == 'pdf':
+                    job = create_pdf_import_job(file.stream, secure_filename(file.filename), category_id, current_user.id)
+                    start_import_job(job.id)
+                    flash('Importação do PDF iniciada. O progresso é mostrado abaixo.', 'success')
                 else:
                     flash('Formato de arquivo não suportado.', 'error')
             else:
@@ -1177,7 +3639,16 @@ def admin_faq():
         return redirect(url_for('admin_faq'))
     faqs = FAQ.query.order_by(FAQ.id.desc()).all()
     categories = Category.query.all()
-    return render_template('admin_faq.html', faqs=faqs, categories=categories, form=form)
+    import_jobs = ImportJob.query.order_by(ImportJob.id.desc()).limit(10).all()
+    return render_template('admin_faq.html', faqs=faqs, categories=categories, form=form, import_jobs=import_jobs)
+
+@app.route('/admin/import-jobs')
+@login_required
+def admin_import_jobs():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Acesso negado.'}), 403
+    jobs = ImportJob.query.order_by(ImportJob.id.desc()).limit(10).all()
+    return jsonify([import_job_as_dict(job) for job in jobs])
 
 @app.route('/admin/export/faqs')
 @login_required
@@ -1185,18 +3656,15 @@ def export_faqs():
     if not current_user.is_admin:
         flash('Acesso negado.', 'error')
         return redirect(url_for('index'))
-    faqs = FAQ.query.all()
-    faqs_list = []
-    for faq in faqs:
-        faqs_list.append({
-            'category': faq.category.name,
-            'question': faq.question,
-            'answer': faq.answer,
-            'image_url': faq.image_url,
-            'video_url': faq.video_url
-        })
-    response = jsonify(faqs_list)
-    response.headers['Content-Disposition'] = 'attachment; filename=faqs_backup.json'
+    file_format = request.args.get('format', 'json')
+    if file_format not in FAQ_EXPORT_FORMATS:
+        abort(400)
+    compress = request.args.get('gzip') == '1'
+    mimetype, extension = FAQ_EXPORT_FORMATS[file_format]
+    file_name = f'faqs_backup.{extension}' + ('.gz' if compress else '')
+    response = Response(stream_with_context(export_faqs_stream(file_format, compress)),
+                        mimetype='application/gzip' if compress else mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={file_name}'
     return response
 
 @app.route('/challenges')
@@ -1206,13 +3674,7 @@ def list_challenges():
         flash('Não foi possível determinar o seu nível. Contate o suporte.', 'error')
         return redirect(url_for('index'))
     form = BaseForm()
-    completed_challenges_ids = [uc.challenge_id for uc in current_user.completed_challenges]
-    user_min_points = current_user.level.min_points
-    RequiredLevel = aliased(Level)
-    all_challenges_query = db.session.query(Challenge).filter(Challenge.id.notin_(completed_challenges_ids))
-    all_challenges_query = all_challenges_query.join(RequiredLevel, Challenge.level_required == RequiredLevel.name)
-    unlocked_challenges = all_challenges_query.filter(RequiredLevel.min_points <= user_min_points).all()
-    locked_challenges = all_challenges_query.filter(RequiredLevel.min_points > user_min_points).all()
+    unlocked_challenges, locked_challenges = get_available_challenges(current_user)
     return render_template('challenges.html', unlocked_challenges=unlocked_challenges, locked_challenges=locked_challenges, form=form)
 
 @app.route('/challenges/hint/<int:challenge_id>', methods=['POST'])
@@ -1248,64 +3710,7 @@ def submit_challenge(challenge_id):
         is_correct = submitted_answer.lower() == challenge.expected_answer.lower()
 
     if is_correct:
-        existing_completion = UserChallenge.query.filter_by(user_id=current_user.id, challenge_id=challenge_id).first()
-        if not existing_completion:
-            current_user.points += challenge.points_reward
-            flash_message = f'Parabéns! Completou o desafio "{challenge.title}" e ganhou {challenge.points_reward} pontos!'
-            
-            today_challenge_entry = DailyChallenge.query.filter_by(day=date.today()).first()
-            if today_challenge_entry and today_challenge_entry.challenge_id == challenge.id:
-                current_user.points += today_challenge_entry.bonus_points
-                flash_message += f' Você ganhou {today_challenge_entry.bonus_points} pontos de bônus por completar o desafio do dia!'
-            
-            completion = UserChallenge(user_id=current_user.id, challenge_id=challenge_id)
-            db.session.add(completion)
-
-            # Lógica do Evento Global (World Boss) - já implementada
-            active_event = GlobalEvent.query.filter(
-                GlobalEvent.is_active == True,
-                GlobalEvent.start_date <= datetime.utcnow(),
-                GlobalEvent.end_date >= datetime.utcnow(),
-                GlobalEvent.current_hp > 0
-            ).first()
-
-            if active_event:
-                damage = challenge.points_reward
-                active_event.current_hp = max(0, active_event.current_hp - damage)
-                contribution = GlobalEventContribution.query.filter_by(event_id=active_event.id, user_id=current_user.id).first()
-                if contribution:
-                    contribution.contribution_points += damage
-                else:
-                    contribution = GlobalEventContribution(event_id=active_event.id, user_id=current_user.id, contribution_points=damage)
-                    db.session.add(contribution)
-                flash(f'Você causou {damage} de dano ao Boss Global!', 'success')
-                if active_event.current_hp == 0:
-                    flash(f'O Boss Global "{active_event.name}" foi derrotado!', 'success')
-
-            # ### NOVO: LÓGICA DA BATALHA DE EQUIPAS ###
-            if current_user.team:
-                active_battles = TeamBattle.query.filter(
-                    (TeamBattle.challenging_team_id == current_user.team_id) | (TeamBattle.challenged_team_id == current_user.team_id),
-                    TeamBattle.status == 'active'
-                ).all()
-
-                for battle in active_battles:
-                    battle_challenge = TeamBattleChallenge.query.filter_by(battle_id=battle.id, challenge_id=challenge_id).first()
-                    # Se o desafio faz parte desta batalha e ainda não foi completado por nenhuma equipa na batalha
-                    if battle_challenge and not battle_challenge.completed_by_team_id:
-                        battle_challenge.completed_by_team_id = current_user.team_id
-                        battle_challenge.completed_at = datetime.utcnow()
-                        flash(f'A sua equipa marcou pontos na batalha contra "{battle.challenged_team.name if battle.challenging_team_id == current_user.team_id else battle.challenging_team.name}"!', 'info')
-
-            # ### FIM DA LÓGICA DA BATALHA ###
-
-            check_and_complete_paths(current_user, challenge_id)
-            update_user_level(current_user)
-            db.session.commit()
-            check_and_award_achievements(current_user)
-            db.session.commit()
-            flash(flash_message, 'success')
-        else:
+        if not complete_challenge(current_user, challenge):
             flash('Você já completou este desafio.', 'info')
     else:
         flash('Resposta incorreta. Tente novamente!', 'error')
@@ -1396,13 +3801,51 @@ def admin_delete_team(team_id):
         flash('Erro de validação CSRF.', 'error')
         return redirect(url_for('admin_teams'))
     team = Team.query.get_or_404(team_id)
-    for member in team.members:
-        member.team_id = None
-    db.session.delete(team)
-    db.session.commit()
+    run_bulk_operation('teams', 'delete', [team.id])
     flash('Time dissolvido com sucesso!', 'success')
     return redirect(url_for('admin_teams'))
 
+@app.route('/admin/bulk/<entity>', methods=['POST'])
+@login_required
+def admin_bulk_operation(entity):
+    """
+    Operações em massa sobre os ids selecionados. Aceita um formulário (ids, action, value),
+    que volta à página de administração da entidade, ou JSON com os mesmos campos e o
+    csrf_token, que devolve as linhas afetadas por tabela.
+    """
+    wants_json = request.is_json
+    if not current_user.is_admin:
+        if wants_json:
+            return jsonify({'error': 'Acesso negado.'}), 403
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('index'))
+    if entity not in BULK_ACTIONS:
+        abort(404)
+    data = request.get_json(silent=True) if wants_json else None
+    if wants_json and not (isinstance(data, dict) and isinstance(data.get('ids', []), list)):
+        return jsonify({'error': 'O corpo JSON deve ser um objeto com uma lista de ids.'}), 400
+    form = BaseForm()
+    if not form.validate_on_submit():
+        if wants_json:
+            return jsonify({'error': 'Erro de validação CSRF.'}), 400
+        flash('Erro de validação CSRF.', 'error')
+        return redirect(url_for(BULK_REDIRECTS[entity]))
+    if wants_json:
+        action, ids, value = data.get('action'), data.get('ids') or [], data.get('value')
+    else:
+        action, ids, value = request.form.get('action'), request.form.getlist('ids'), request.form.get('value')
+    try:
+        counts = run_bulk_operation(entity, action, ids, value, acting_user_id=current_user.id)
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for(BULK_REDIRECTS[entity]))
+    if wants_json:
+        return jsonify({'entity': entity, 'action': action, 'selected': len(set(map(str, ids))), 'counts': counts})
+    flash(f'Operação aplicada a {len(set(ids))} item(ns) selecionado(s) ({bulk_report(counts)}).', 'success')
+    return redirect(url_for(BULK_REDIRECTS[entity]))
+
 @app.route('/admin/dashboard')
 @login_required
 def admin_dashboard():
@@ -1438,9 +3881,16 @@ def admin_delete_level(level_id):
         flash('Erro de validação CSRF.', 'error')
         return redirect(url_for('admin_levels'))
     level = Level.query.get_or_404(level_id)
+    if Level.query.count() == 1 and User.query.filter_by(level_id=level.id).first():
+        flash('Não é possível excluir o único nível enquanto houver utilizadores nele.', 'error')
+        return redirect(url_for('admin_levels'))
+    # Reatribui os utilizadores deste nível (e os restantes da escada) antes de o apagar
+    moved = bulk_update_levels(exclude_level_ids=[level.id])
     db.session.delete(level)
     db.session.commit()
+    invalidate_levels_cache()
     flash('Nível excluído com sucesso!', 'success')
+    flash_levels_recomputed(moved)
     return redirect(url_for('admin_levels'))
 
 @app.route('/admin/levels', methods=['GET', 'POST'])
@@ -1466,7 +3916,9 @@ def admin_levels():
             level = Level(name=name, min_points=min_points, insignia=insignia_url)
             db.session.add(level)
             db.session.commit()
+            invalidate_levels_cache()
             flash('Nível criado com sucesso!', 'success')
+            flash_levels_recomputed(run_locked_job('recompute_levels', recompute_all_levels))
         elif action == 'import_levels':
             file = request.files['level_file']
             if file and file.filename.endswith('.json'):
@@ -1480,7 +3932,9 @@ def admin_levels():
                         )
                         db.session.add(level)
                     db.session.commit()
+                    invalidate_levels_cache()
                     flash('Níveis importados com sucesso!', 'success')
+                    flash_levels_recomputed(run_locked_job('recompute_levels', recompute_all_levels))
                 except Exception as e:
                     flash(f'Erro ao importar níveis: {str(e)}', 'error')
             else:
@@ -1516,6 +3970,7 @@ def admin_challenges():
             )
             db.session.add(challenge)
             db.session.commit()
+            invalidate_challenges_cache()
             flash('Desafio criado com sucesso!', 'success')
         elif action == 'import_challenges':
             file = request.files.get('challenge_file')
@@ -1537,6 +3992,7 @@ def admin_challenges():
                         )
                         db.session.add(challenge)
                     db.session.commit()
+                    invalidate_challenges_cache()
                     flash('Desafios importados com sucesso!', 'success')
                 except Exception as e:
                     flash(f'Erro ao importar desafios: {str(e)}', 'error')
@@ -1581,7 +4037,10 @@ def admin_paths():
                 if not existing:
                     path_challenge = PathChallenge(path_id=path_id, challenge_id=challenge_id, step=step)
                     db.session.add(path_challenge)
+                    db.session.flush()
+                    rebuild_path_progress_counts([path.id])
                     db.session.commit()
+                    invalidate_path_index()
                     flash('Desafio adicionado à trilha com sucesso!', 'success')
                 else:
                     flash('Este desafio já faz parte desta trilha.', 'warning')
@@ -1611,7 +4070,10 @@ def admin_paths():
                             db.session.add(path_challenge)
                         else:
                             flash(f"Aviso: Desafio '{challenge_data['title']}' não encontrado e foi ignorado.", 'warning')
+                    db.session.flush()
+                    rebuild_path_progress_counts([new_path.id])
                     db.session.commit()
+                    invalidate_path_index()
                     flash('Trilha de aprendizagem importada com sucesso!', 'success')
                 except Exception as e:
                     db.session.rollback()
@@ -1632,7 +4094,7 @@ def view_path(path_id):
         flash('Esta trilha de aprendizagem não está ativa no momento.', 'warning')
         return redirect(url_for('list_paths'))
     
-    user_completed_challenges = {uc.challenge_id for uc in current_user.completed_challenges}
+    user_completed_challenges = get_completed_challenge_ids(current_user)
     
     return render_template('view_path.html', path=path, user_completed_challenges=user_completed_challenges)
 
@@ -1660,8 +4122,10 @@ def admin_delete_path(path_id):
         flash('Acesso negado.', 'error')
         return redirect(url_for('index'))
     path_to_delete = LearningPath.query.get_or_404(path_id)
+    UserPathProgressCount.query.filter_by(path_id=path_to_delete.id).delete()
     db.session.delete(path_to_delete)
     db.session.commit()
+    invalidate_path_index()
     flash('Trilha de aprendizagem excluída com sucesso!', 'success')
     return redirect(url_for('admin_paths'))
 
@@ -1677,28 +4141,36 @@ def admin_remove_challenge_from_path(path_id, challenge_id):
         return redirect(url_for('admin_paths'))
     path_challenge = PathChallenge.query.filter_by(path_id=path_id, challenge_id=challenge_id).first_or_404()
     db.session.delete(path_challenge)
+    db.session.flush()
+    rebuild_path_progress_counts([path_id])
     db.session.commit()
+    invalidate_path_index()
     flash('Desafio removido da trilha com sucesso!', 'success')
     return redirect(url_for('admin_paths'))
 
 @app.route('/paths')
 @login_required
 def list_paths():
-    all_paths = LearningPath.query.filter_by(is_active=True).all()
-    completed_challenges_ids = {uc.challenge_id for uc in current_user.completed_challenges}
-    completed_paths_ids = {up.path_id for up in UserPathProgress.query.filter_by(user_id=current_user.id).all()}
+    path_totals = get_path_index()['path_totals']
+    query = db.session.query(LearningPath, UserPathProgressCount.completed_steps, UserPathProgress.id)\
+        .outerjoin(UserPathProgressCount, (UserPathProgressCount.path_id == LearningPath.id) & (UserPathProgressCount.user_id == current_user.id))\
+        .outerjoin(UserPathProgress, (UserPathProgress.path_id == LearningPath.id) & (UserPathProgress.user_id == current_user.id))\
+        .filter(LearningPath.is_active == True)
+    rows = query.all()
+    # Um contador acima do total indica que a tabela de contadores divergiu: regista e limita a percentagem;
+    # a correção fica para o comando rebuild-path-progress
+    drifted = {path.id for path, completed_steps, _ in rows if (completed_steps or 0) > path_totals.get(path.id, 0) > 0}
+    if drifted:
+        app.logger.warning(f'Progresso acima do total nas trilhas {sorted(drifted)} (utilizador {current_user.id}); '
+                           f'execute "flask rebuild-path-progress".')
     paths_with_progress = []
-    for path in all_paths:
-        total_steps = len(path.challenges)
-        completed_steps = 0
-        for pc in path.challenges:
-            if pc.challenge_id in completed_challenges_ids:
-                completed_steps += 1
-        progress_percentage = (completed_steps / total_steps) * 100 if total_steps > 0 else 0
+    for path, completed_steps, completed_id in rows:
+        total_steps = path_totals.get(path.id, 0)
+        progress_percentage = (min(completed_steps or 0, total_steps) / total_steps) * 100 if total_steps > 0 else 0
         paths_with_progress.append({
             'path': path,
             'progress': progress_percentage,
-            'is_completed': path.id in completed_paths_ids
+            'is_completed': completed_id is not None
         })
     return render_template('paths.html', paths_data=paths_with_progress)
 
@@ -1758,12 +4230,15 @@ def admin_achievements():
             )
             db.session.add(achievement)
             db.session.commit()
+            invalidate_achievements_cache()
             flash('Conquista criada com sucesso!', 'success')
+            request_achievement_backfill([achievement.id])
         elif action == 'import_achievements':
             file = request.files['achievement_file']
             if file and file.filename.endswith('.json'):
                 try:
                     data = json.load(file)
+                    imported = []
                     for ach_data in data:
                         achievement = Achievement(
                             name=ach_data['name'],
@@ -1773,8 +4248,11 @@ def admin_achievements():
                             icon=ach_data.get('icon')
                         )
                         db.session.add(achievement)
+                        imported.append(achievement)
                     db.session.commit()
+                    invalidate_achievements_cache()
                     flash('Conquistas importadas com sucesso!', 'success')
+                    request_achievement_backfill([achievement.id for achievement in imported])
                 except Exception as e:
                     flash(f'Erro ao importar conquistas: {str(e)}', 'error')
             else:
@@ -1808,7 +4286,9 @@ def admin_edit_achievement(achievement_id):
     achievement.trigger_type = request.form['trigger_type']
     achievement.trigger_value = request.form['trigger_value']
     db.session.commit()
+    invalidate_achievements_cache()
     flash('Conquista atualizada com sucesso!', 'success')
+    request_achievement_backfill([achievement.id])
     return redirect(url_for('admin_achievements'))
 
 @app.route('/admin/delete_achievement/<int:achievement_id>', methods=['POST'])
@@ -1824,6 +4304,7 @@ def admin_delete_achievement(achievement_id):
     achievement = Achievement.query.get_or_404(achievement_id)
     db.session.delete(achievement)
     db.session.commit()
+    invalidate_achievements_cache()
     flash('Conquista excluída com sucesso!', 'success')
     return redirect(url_for('admin_achievements'))
 
@@ -1861,9 +4342,10 @@ def admin_boss_fights():
             boss_id = request.form['boss_id']
             name = request.form['name']
             order = request.form['order']
-            stage = BossFightStage(boss_id=boss_id, name=name, order=order)
+            stage = BossFightStage(boss_fight_id=boss_id, name=name, order=order)
             db.session.add(stage)
             db.session.commit()
+            invalidate_boss_tree(boss_id)
             flash('Etapa adicionada com sucesso!', 'success')
         elif action == 'create_step':
             stage_id = request.form['stage_id']
@@ -1876,6 +4358,7 @@ def admin_boss_fights():
             )
             db.session.add(step)
             db.session.commit()
+            invalidate_boss_tree(step.stage.boss_fight_id)
             flash('Tarefa adicionada com sucesso!', 'success')
         elif action == 'import_boss':
             file = request.files.get('boss_file')
@@ -1933,6 +4416,7 @@ def admin_edit_boss_fight(boss_id):
     boss.reward_points = request.form['reward_points']
     boss.is_active = 'is_active' in request.form
     db.session.commit()
+    invalidate_boss_tree(boss.id)
     flash('Boss Fight atualizado com sucesso!', 'success')
     return redirect(url_for('admin_boss_fights'))
 @app.route('/admin/delete_boss_fight/<int:boss_id>', methods=['POST'])
@@ -1946,8 +4430,10 @@ def admin_delete_boss_fight(boss_id):
         flash('Erro de validação CSRF.', 'error')
         return redirect(url_for('admin_boss_fights'))
     boss = BossFight.query.get_or_404(boss_id)
+    TeamBossProgressCount.query.filter_by(boss_fight_id=boss.id).delete()
     db.session.delete(boss)
     db.session.commit()
+    invalidate_boss_tree(boss_id)
     flash('Boss Fight excluído com sucesso!', 'success')
     return redirect(url_for('admin_boss_fights'))
 
@@ -1962,8 +4448,12 @@ def admin_delete_boss_stage(stage_id):
         flash('Erro de validação CSRF.', 'error')
         return redirect(url_for('admin_boss_fights'))
     stage = BossFightStage.query.get_or_404(stage_id)
+    boss_id = stage.boss_fight_id
     db.session.delete(stage)
+    db.session.flush()
+    rebuild_boss_progress_counts(boss_ids=[boss_id])
     db.session.commit()
+    invalidate_boss_tree(boss_id)
     flash('Etapa excluída com sucesso!', 'success')
     return redirect(url_for('admin_boss_fights'))
 
@@ -1978,8 +4468,12 @@ def admin_delete_boss_step(step_id):
         flash('Erro de validação CSRF.', 'error')
         return redirect(url_for('admin_boss_fights'))
     step = BossFightStep.query.get_or_404(step_id)
+    boss_id = step.stage.boss_fight_id
     db.session.delete(step)
+    db.session.flush()
+    rebuild_boss_progress_counts(boss_ids=[boss_id])
     db.session.commit()
+    invalidate_boss_tree(boss_id)
     flash('Tarefa excluída com sucesso!', 'success')
     return redirect(url_for('admin_boss_fights'))
 
@@ -1998,10 +4492,17 @@ def view_boss_fight(boss_id):
     if not current_user.team:
         flash('Você precisa estar em uma equipe para acessar Boss Fights.', 'warning')
         return redirect(url_for('list_boss_fights'))
-    boss = BossFight.query.get_or_404(boss_id)
-    team_progress = TeamBossProgress.query.filter_by(team_id=current_user.team_id).all()
-    completed_step_ids = {progress.step_id for progress in team_progress}
-    return render_template('view_boss_fight.html', boss=boss, completed_step_ids=completed_step_ids, team_progress=team_progress)
+    boss = get_boss_tree(boss_id)
+    if boss is None:
+        abort(404)
+    step_ids = [step.id for stage in boss.stages for step in stage.steps]
+    team_progress = {}
+    if step_ids:
+        rows = db.session.query(TeamBossProgress.step_id, TeamBossProgress.completed_at, User.name)\
+            .join(User, User.id == TeamBossProgress.completed_by_user_id)\
+            .filter(TeamBossProgress.team_id == current_user.team_id, TeamBossProgress.step_id.in_(step_ids))
+        team_progress = {row.step_id: row for row in rows}
+    return render_template('view_boss_fight.html', boss=boss, completed_step_ids=set(team_progress), team_progress=team_progress)
 
 @app.route('/bossfight/submit/<int:step_id>', methods=['POST'])
 @login_required
@@ -2009,25 +4510,28 @@ def submit_boss_step(step_id):
     if not current_user.team:
         flash('Você precisa estar em uma equipe para acessar Boss Fights.', 'warning')
         return redirect(url_for('list_boss_fights'))
-    step = BossFightStep.query.get_or_404(step_id)
-    boss = step.stage.boss_fight
+    step = db.session.query(BossFightStep.description, BossFightStep.expected_answer, BossFightStage.boss_fight_id)\
+        .join(BossFightStage, BossFightStage.id == BossFightStep.stage_id)\
+        .filter(BossFightStep.id == step_id).first()
+    if step is None:
+        abort(404)
+    team_id = current_user.team_id
     submitted_answer = request.form.get('answer', '').strip()
     if submitted_answer.lower() == step.expected_answer.lower():
-        if not TeamBossProgress.query.filter_by(team_id=current_user.team_id, step_id=step_id).first():
-            progress = TeamBossProgress(
-                team_id=current_user.team_id,
-                step_id=step_id,
-                completed_by_user_id=current_user.id
-            )
-            db.session.add(progress)
+        if insert_if_absent(TeamBossProgress, ['team_id', 'step_id'], team_id=team_id,
+                            step_id=step_id, completed_by_user_id=current_user.id, completed_at=datetime.utcnow()):
+            steps_completed = increment_boss_progress(team_id, step.boss_fight_id)
+            defeated = check_boss_fight_completion(team_id, step.boss_fight_id, steps_completed)
             db.session.commit()
             flash(f'Parabéns! Você completou a tarefa "{step.description}" para sua equipe!', 'success')
-            check_boss_fight_completion(current_user.team_id, boss.id)
+            if defeated:
+                boss = get_boss_tree(step.boss_fight_id)
+                flash(f'Parabéns Equipe "{current_user.team.name}"! Vocês derrotaram o Boss "{boss.name}" e cada membro ganhou {boss.reward_points} pontos!', 'success')
         else:
             flash('Esta tarefa já foi completada pela sua equipe.', 'info')
     else:
         flash('Resposta incorreta. Tente novamente!', 'error')
-    return redirect(url_for('view_boss_fight', boss_id=boss.id))
+    return redirect(url_for('view_boss_fight', boss_id=step.boss_fight_id))
 
 @app.route('/admin/edit_challenge/<int:challenge_id>', methods=['POST'])
 @login_required
@@ -2046,6 +4550,8 @@ def admin_edit_challenge(challenge_id):
     challenge.points_reward=request.form['points_reward']
     challenge.expected_answer=request.form['expected_answer']
     db.session.commit()
+    invalidate_challenges_cache()
+    invalidate_daily_challenge_cache()
     flash('Desafio atualizado com sucesso!', 'success')
     return redirect(url_for('admin_challenges'))
 
@@ -2062,15 +4568,9 @@ def admin_delete_challenge(challenge_id):
         return redirect(url_for('admin_challenges'))
 
     challenge = Challenge.query.get_or_404(challenge_id)
+    # Apaga o desafio e todas as dependências (progresso, trilhas, desafio diário, batalhas)
+    run_bulk_operation('challenges', 'delete', [challenge.id])
 
-    # Apagar todas as dependências antes de apagar o desafio
-    UserChallenge.query.filter_by(challenge_id=challenge.id).delete()
-    PathChallenge.query.filter_by(challenge_id=challenge.id).delete()
-    DailyChallenge.query.filter_by(challenge_id=challenge.id).delete()
-
-    db.session.delete(challenge)
-    db.session.commit()
-    
     flash('Desafio e todas as suas referências foram excluídos com sucesso!', 'success')
     return redirect(url_for('admin_challenges'))
 
@@ -2101,6 +4601,7 @@ def admin_hunts():
             new_hunt = ScavengerHunt(name=name, description=description, reward_points=reward_points, is_active=is_active)
             db.session.add(new_hunt)
             db.session.commit()
+            invalidate_dashboard_cache()
             flash('Evento de Caça ao Tesouro criado com sucesso!', 'success')
 
         elif action == 'create_step':
@@ -2121,6 +4622,7 @@ def admin_hunts():
             )
             db.session.add(new_step)
             db.session.commit()
+            invalidate_dashboard_cache()
             flash('Passo adicionado com sucesso!', 'success')
             
         return redirect(url_for('admin_hunts'))
@@ -2149,6 +4651,7 @@ def admin_edit_hunt(hunt_id):
         
         hunt.is_active = is_active
         db.session.commit()
+        invalidate_dashboard_cache()
         flash('Evento atualizado com sucesso!', 'success')
         return redirect(url_for('admin_hunts'))
 
@@ -2167,6 +4670,7 @@ def delete_hunt(hunt_id):
         UserHuntProgress.query.filter_by(hunt_id=hunt_to_delete.id).delete()
         db.session.delete(hunt_to_delete)
         db.session.commit()
+        invalidate_dashboard_cache()
         flash(f'O evento "{hunt_to_delete.name}" foi apagado.', 'success')
     return redirect(url_for('admin_hunts'))
 
@@ -2182,6 +4686,7 @@ def delete_hunt_step(step_id):
         step_to_delete = ScavengerHuntStep.query.get_or_404(step_id)
         db.session.delete(step_to_delete)
         db.session.commit()
+        invalidate_dashboard_cache()
         flash(f'O passo {step_to_delete.step_number} foi apagado com sucesso.', 'success')
     return redirect(url_for('admin_hunts'))
 
@@ -2213,6 +4718,7 @@ def admin_events():
         )
         db.session.add(new_event)
         db.session.commit()
+        invalidate_active_event_cache()
         flash('Evento Global criado com sucesso!', 'success')
         return redirect(url_for('admin_events'))
 
@@ -2232,19 +4738,34 @@ def admin_edit_event(event_id):
     if request.method == 'POST':
         if not form.validate_on_submit():
             return redirect(url_for('admin_edit_event', event_id=event.id))
-            
+        total_hp = int(request.form['total_hp'])
+        start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%dT%H:%M')
+        end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%dT%H:%M')
+        reward_points_on_win = int(request.form['reward_points_on_win'])
+        # O formulário só tem minutos: compara as datas guardadas com a mesma precisão
+        minutes = lambda value: value.replace(second=0, microsecond=0)
+        rearmed = (total_hp, start_date, end_date) != (event.total_hp, minutes(event.start_date), minutes(event.end_date))
+        if event.finalized_at is not None and (rearmed or reward_points_on_win != event.reward_points_on_win):
+            flash('Este evento já foi finalizado (ranking e recompensas atribuídos): só o nome, a descrição e o estado '
+                  'podem ser alterados. Crie um novo evento para mudar a vida, as datas ou a recompensa.', 'error')
+            return redirect(url_for('admin_edit_event', event_id=event.id))
+
         event.name = request.form['name']
         event.description = request.form['description']
-        event.total_hp = int(request.form['total_hp'])
-        event.start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%dT%H:%M')
-        event.end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%dT%H:%M')
-        event.reward_points_on_win = int(request.form['reward_points_on_win'])
+        event.total_hp = total_hp
+        event.start_date = start_date
+        event.end_date = end_date
+        event.reward_points_on_win = reward_points_on_win
         event.is_active = 'is_active' in request.form
-        
-        # Opcional: Resetar a vida se o total for alterado
-        # event.current_hp = event.total_hp
-        
+        if rearmed:
+            # Novo prazo ou nova vida: o golpe final volta a ser detetado
+            if event.defeated_at is not None or event.current_hp > event.total_hp:
+                event.current_hp = event.total_hp
+            event.defeated_at = None
+
         db.session.commit()
+        invalidate_active_event_cache()
+        cache.delete(f'events:leaderboard:{event.id}')
         flash('Evento Global atualizado com sucesso!', 'success')
         return redirect(url_for('admin_events'))
 
@@ -2264,6 +4785,7 @@ def admin_delete_event(event_id):
     event = GlobalEvent.query.get_or_404(event_id)
     db.session.delete(event) # As contribuições serão apagadas em cascata
     db.session.commit()
+    invalidate_active_event_cache()
     flash('Evento Global apagado com sucesso.', 'success')
     return redirect(url_for('admin_events'))
 
@@ -2300,14 +4822,11 @@ def challenge_team(team_id):
         flash('Já existe uma batalha ativa entre estas duas equipas.', 'warning')
         return redirect(url_for('teams_list'))
 
-    num_challenges = 5
-    available_challenges = Challenge.query.filter_by(is_team_challenge=False).all()
-    if len(available_challenges) < num_challenges:
+    selected_challenge_ids = select_battle_challenges([challenger_team.id, challenged_team.id])
+    if len(selected_challenge_ids) < BATTLE_CHALLENGE_COUNT:
         flash('Não há desafios suficientes na plataforma para iniciar uma batalha.', 'error')
         return redirect(url_for('teams_list'))
     
-    selected_challenges = random.sample(available_challenges, num_challenges)
-    
     end_time = datetime.utcnow() + timedelta(days=2)
     new_battle = TeamBattle(
         challenging_team_id=challenger_team.id,
@@ -2318,10 +4837,9 @@ def challenge_team(team_id):
     db.session.add(new_battle)
     db.session.flush()
 
-    for challenge in selected_challenges:
-        battle_challenge = TeamBattleChallenge(battle_id=new_battle.id, challenge_id=challenge.id)
-        db.session.add(battle_challenge)
-    
+    db.session.execute(insert(TeamBattleChallenge), [
+        {'battle_id': new_battle.id, 'challenge_id': challenge_id} for challenge_id in selected_challenge_ids
+    ])
     db.session.commit()
 
     flash(f'Desafio enviado para a equipa "{challenged_team.name}"! A batalha termina em 48 horas.', 'success')
@@ -2387,8 +4905,10 @@ def trigger_finalize_battles():
         flash('Erro de validação CSRF.', 'error')
         return redirect(url_for('admin_battles'))
     
-    count = finalize_ended_battles()
-    if count > 0:
+    count = run_locked_job('finalize_battles', finalize_ended_battles)
+    if count is None:
+        flash('A finalização de batalhas já está a ser executada. Tente novamente em instantes.', 'info')
+    elif count > 0:
         flash(f'{count} batalha(s) foram finalizadas e as recompensas distribuídas.', 'success')
     else:
         flash('Nenhuma batalha ativa precisava de ser finalizada.', 'info')
@@ -2413,98 +4933,34 @@ def admin_import_content():
         
         try:
             content = json.load(file.stream)
-            counts = {'faqs': 0, 'desafios': 0, 'trilhas': 0, 'boss_fights': 0, 'caca_tesouros': 0, 'eventos_globais': 0}
-
-            # --- Processar FAQs ---
-            if 'import_faqs' in request.form and 'faqs' in content:
-                existing_questions = {f.question for f in FAQ.query.all()}
-                for faq_data in content['faqs']:
-                    if faq_data['question'] not in existing_questions:
-                        category = Category.query.filter_by(name=faq_data['category']).first()
-                        if not category:
-                            category = Category(name=faq_data['category'])
-                            db.session.add(category)
-                            db.session.flush()
-                        
-                        new_faq = FAQ(category_id=category.id, **{k: v for k, v in faq_data.items() if k != 'category'})
-                        db.session.add(new_faq)
-                        counts['faqs'] += 1
-
-            # --- Processar Desafios ---
-            if 'import_desafios' in request.form and 'desafios' in content:
-                existing_titles = {c.title for c in Challenge.query.all()}
-                for challenge_data in content['desafios']:
-                    if challenge_data['title'] not in existing_titles:
-                        new_challenge = Challenge(**challenge_data)
-                        db.session.add(new_challenge)
-                        counts['desafios'] += 1
-
-            # --- Processar Trilhas ---
-            if 'import_trilhas' in request.form and 'trilhas' in content:
-                existing_names = {p.name for p in LearningPath.query.all()}
-                for path_data in content['trilhas']:
-                    if path_data['name'] not in existing_names:
-                        challenges_in_path_data = path_data.pop('challenges', [])
-                        new_path = LearningPath(**path_data)
-                        db.session.add(new_path)
-                        db.session.flush()
-                        for c_data in challenges_in_path_data:
-                            challenge = Challenge.query.filter_by(title=c_data['title']).first()
-                            if challenge:
-                                pc = PathChallenge(path_id=new_path.id, challenge_id=challenge.id, step=c_data['step'])
-                                db.session.add(pc)
-                        counts['trilhas'] += 1
-
-            # --- Processar Boss Fights ---
-            if 'import_boss_fights' in request.form and 'boss_fights' in content:
-                existing_names = {b.name for b in BossFight.query.all()}
-                for boss_data in content['boss_fights']:
-                    if boss_data['name'] not in existing_names:
-                        stages_data = boss_data.pop('stages', [])
-                        new_boss = BossFight(**boss_data)
-                        db.session.add(new_boss)
-                        db.session.flush()
-                        for s_data in stages_data:
-                            steps_data = s_data.pop('steps', [])
-                            new_stage = BossFightStage(boss_fight_id=new_boss.id, **s_data)
-                            db.session.add(new_stage)
-                            db.session.flush()
-                            for step_data in steps_data:
-                                new_step = BossFightStep(stage_id=new_stage.id, **step_data)
-                                db.session.add(new_step)
-                        counts['boss_fights'] += 1
-
-            # --- Processar Caça ao Tesouro ---
-            if 'import_caca_tesouros' in request.form and 'caca_tesouros' in content:
-                existing_names = {h.name for h in ScavengerHunt.query.all()}
-                for hunt_data in content['caca_tesouros']:
-                    if hunt_data['name'] not in existing_names:
-                        steps_data = hunt_data.pop('steps', [])
-                        new_hunt = ScavengerHunt(**hunt_data)
-                        db.session.add(new_hunt)
-                        db.session.flush()
-                        for step_data in steps_data:
-                            new_step = ScavengerHuntStep(hunt_id=new_hunt.id, **step_data)
-                            db.session.add(new_step)
-                        counts['caca_tesouros'] += 1
-            
-            # --- Processar Eventos Globais ---
-            if 'import_eventos_globais' in request.form and 'eventos_globais' in content:
-                existing_names = {e.name for e in GlobalEvent.query.all()}
-                for event_data in content['eventos_globais']:
-                    if event_data['name'] not in existing_names:
-                        event_data['start_date'] = datetime.fromisoformat(event_data['start_date'])
-                        event_data['end_date'] = datetime.fromisoformat(event_data['end_date'])
-                        event_data['current_hp'] = event_data['total_hp']
-                        
-                        new_event = GlobalEvent(**event_data)
-                        db.session.add(new_event)
-                        counts['eventos_globais'] += 1
-
+            sections = [section for section in CONTENT_SECTIONS if f'import_{section}' in request.form and section in content]
+            if 'sync' in request.form:
+                dry_run = 'dry_run' in request.form
+                report = sync_content_pack(content, sections, dry_run=dry_run)
+                if dry_run:
+                    db.session.rollback()
+                    return render_template('admin_import.html', form=form, sync_report=content_sync_report(report))
+                db.session.commit()
+                invalidate_imported_content(content_sync_changes(report), report['boss_ids'])
+                collect_orphan_attachments(report['released_attachments'])
+                totals = {change: sum(summary[change] for summary in report['sections'].values())
+                          for change in ('create', 'update', 'delete', 'unchanged')}
+                flash(f"Sincronização concluída! {totals['create']} criados, {totals['update']} atualizados, "
+                      f"{totals['delete']} apagados e {totals['unchanged']} sem alterações.", 'success')
+                for warning in report['warnings'][:10]:
+                    flash(warning, 'warning')
+                return redirect(url_for('admin_import_content'))
+            plan = plan_content_pack(content, sections)
+            if 'dry_run' in request.form:
+                return render_template('admin_import.html', form=form, report=content_plan_report(plan))
+            counts = apply_content_plan(plan)
             db.session.commit()
-            flash(f"Importação concluída! Adicionados: {counts['faqs']} FAQs, {counts['desafios']} Desafios, "
-                f"{counts['trilhas']} Trilhas, {counts['boss_fights']} Boss Fights, "
-                f"{counts['caca_tesouros']} Caças ao Tesouro, {counts['eventos_globais']} Eventos Globais.", 'success')
+            invalidate_imported_content(counts)
+            flash(f"Importação concluída! Adicionados: {counts.get('faqs', 0)} FAQs, {counts.get('desafios', 0)} Desafios, "
+                f"{counts.get('trilhas', 0)} Trilhas, {counts.get('boss_fights', 0)} Boss Fights, "
+                f"{counts.get('caca_tesouros', 0)} Caças ao Tesouro, {counts.get('eventos_globais', 0)} Eventos Globais.", 'success')
+            for warning in plan['warnings'][:10]:
+                flash(warning, 'warning')
 
         except Exception as e:
             db.session.rollback()
@@ -2543,9 +4999,189 @@ def create_admin(name, email, password):
     db.session.commit()
     print(f'Administrador {name} criado com sucesso!')
 
+@app.cli.command(name='rebuild-path-progress')
+@with_appcontext
+def rebuild_path_progress_command():
+    """Recalcula o progresso materializado de todas as trilhas."""
+    rebuild_path_progress_counts()
+    db.session.commit()
+    invalidate_path_index()
+    print(f'Progresso recalculado: {UserPathProgressCount.query.count()} registos.')
+
+@app.cli.command(name='finalize-events')
+@with_appcontext
+def finalize_events_command():
+    """Finaliza os eventos globais terminados e distribui as recompensas."""
+    count = finalize_global_events()
+    print(f'{count} evento(s) global(is) finalizado(s).')
+
+@app.cli.command(name='plan-daily-challenges')
+@with_appcontext
+@click.option('--days', default=DAILY_CHALLENGE_PLAN_DAYS, show_default=True, help='Quantos dias agendar a partir de hoje.')
+def plan_daily_challenges_command(days):
+    """Agenda os desafios do dia para os próximos dias."""
+    count = plan_daily_challenges(days=days)
+    print(f'{count} dia(s) agendado(s).')
+
+@app.cli.command(name='recompute-levels')
+@with_appcontext
+def recompute_levels_command():
+    """Reatribui o nível de todos os utilizadores de acordo com a escada de níveis atual."""
+    started = time.perf_counter()
+    moved = run_locked_job('recompute_levels', recompute_all_levels)
+    if moved is None:
+        print('O recálculo de níveis já está a ser executado por outro processo.')
+    else:
+        print(f'{moved} utilizador(es) mudaram de nível em {time.perf_counter() - started:.2f}s.')
+
+@app.cli.command(name='backfill-achievements')
+@with_appcontext
+@click.option('--achievement-id', 'achievement_ids', type=int, multiple=True, help='Limita às conquistas indicadas (pode repetir).')
+def backfill_achievements_command(achievement_ids):
+    """Atribui as conquistas a todos os utilizadores que já cumprem os requisitos."""
+    awarded = backfill_achievements(achievement_ids or None)
+    print(f'{awarded} conquista(s) atribuída(s).')
+
+@app.cli.command(name='gc-attachments')
+@with_appcontext
+def gc_attachments_command():
+    """Apaga do armazenamento de anexos os conteúdos que já não são referenciados por nenhuma FAQ."""
+    removed = run_locked_job('collect_orphan_attachments', collect_orphan_attachments)
+    if removed is None:
+        print('A limpeza de anexos já está a ser executada por outro processo.')
+    else:
+        print(f'{removed} ficheiro(s) apagado(s).')
+
+@app.cli.command(name='import-faqs')
+@with_appcontext
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--category-id', type=int, required=True, help='Categoria das FAQs importadas.')
+@click.option('--batch-size', default=FAQ_IMPORT_BATCH_SIZE, show_default=True, help='FAQs inseridas por lote.')
+def import_faqs_command(path, category_id, batch_size):
+    """Importa FAQs de um ficheiro JSON ou CSV em lotes, sem o carregar todo em memória."""
+    if db.session.get(Category, category_id) is None:
+        raise click.BadParameter(f'Categoria {category_id} não existe.', param_hint='--category-id')
+    file_format = path.rsplit('.', 1)[-1].lower()
+    if file_format not in ('json', 'csv'):
+        raise click.BadParameter('Use um ficheiro .json ou .csv.', param_hint='PATH')
+    started = time.perf_counter()
+
+    def report_progress(stats):
+        print(f'{stats["read"]} lidas, {stats["imported"]} importadas, {stats["duplicates"]} duplicadas, '
+              f'{stats["invalid"]} inválidas ({time.perf_counter() - started:.1f}s)')
+
+    with open(path, 'rb') as stream:
+        stats = import_faqs_from_file(stream, file_format, category_id, batch_size=batch_size, progress=report_progress)
+    for error in stats['errors']:
+        print(error)
+    print(f'{stats["imported"]} FAQ(s) importada(s) em {time.perf_counter() - started:.2f}s.')
+
+@app.cli.command(name='import-content')
+@with_appcontext
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--section', 'sections', type=click.Choice(list(CONTENT_SECTIONS)), multiple=True,
+              help='Secções a importar (pode repetir); por omissão, todas as do pacote.')
+@click.option('--dry-run', is_flag=True, help='Mostra o que seria importado sem escrever nada.')
+@click.option('--sync', is_flag=True, help='Sincroniza: cria, atualiza e apaga até a base de dados refletir o pacote.')
+def import_content_command(path, sections, dry_run, sync):
+    """Importa um pacote de conteúdo (formato de /admin/import)."""
+    with open(path, encoding='utf-8') as f:
+        content = json.load(f)
+    started = time.perf_counter()
+    sections = [section for section in (sections or CONTENT_SECTIONS) if section in content]
+    if sync:
+        report = sync_content_pack(content, sections, dry_run=dry_run)
+        for row in content_sync_report(report)['rows']:
+            print(f'{row["label"]}: {row["create"]} a criar, {row["update"]} a atualizar, {row["delete"]} a apagar, '
+                  f'{row["unchanged"]} sem alterações, {row["invalid"]} inválido(s)')
+        for warning in report['warnings']:
+            print(f'Aviso: {warning}')
+        if dry_run:
+            db.session.rollback()
+            print('Simulação: nada foi alterado.')
+            return
+        db.session.commit()
+        invalidate_imported_content(content_sync_changes(report), report['boss_ids'])
+        collect_orphan_attachments(report['released_attachments'])
+        print(f'Sincronização concluída em {time.perf_counter() - started:.2f}s.')
+        return
+    plan = plan_content_pack(content, sections)
+    report = content_plan_report(plan)
+    for row in report['rows']:
+        print(f'{row["label"]}: {row["create"]} novo(s), {row["existing"]} existente(s), {row["invalid"]} inválido(s)')
+    if report['new_categories']:
+        print(f'Novas categorias: {", ".join(report["new_categories"])}')
+    for warning in report['warnings']:
+        print(f'Aviso: {warning}')
+    if dry_run:
+        print('Simulação: nada foi alterado.')
+        return
+    counts = apply_content_plan(plan)
+    db.session.commit()
+    invalidate_imported_content(counts)
+    print(f'Importação concluída em {time.perf_counter() - started:.2f}s.')
+
+@app.cli.command(name='export-faqs')
+@with_appcontext
+@click.option('--format', 'file_format', type=click.Choice(list(FAQ_EXPORT_FORMATS)), default='ndjson', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Comprime a saída com gzip.')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), default='-', show_default=True,
+              help='Ficheiro de destino ("-" para a saída padrão).')
+def export_faqs_command(file_format, compress, output):
+    """Exporta todas as FAQs em streaming (JSON, NDJSON ou CSV), sem as carregar em memória."""
+    with click.open_file(output, 'wb') as target:
+        for chunk in export_faqs_stream(file_format, compress):
+            target.write(chunk)
+
+@app.cli.command(name='snapshot-export')
+@with_appcontext
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--chunk-rows', default=SNAPSHOT_CHUNK_ROWS, show_default=True, help='Linhas por ficheiro comprimido.')
+def snapshot_export_command(directory, chunk_rows):
+    """Exporta um snapshot consistente de todas as tabelas e anexos para DIRECTORY (que não pode existir)."""
+    if os.path.exists(directory):
+        raise click.BadParameter('O diretório já existe.', param_hint='DIRECTORY')
+    started = time.perf_counter()
+    manifest = export_snapshot(directory, chunk_rows=chunk_rows, progress=lambda name, rows: print(f'{name}: {rows} linha(s)'))
+    elapsed = time.perf_counter() - started
+    total = sum(entry['rows'] for entry in manifest['tables'])
+    print(f'{total} linha(s) e {len(manifest["attachments"])} anexo(s) exportados em {elapsed:.2f}s '
+          f'({total / elapsed:.0f} linhas/s).')
+
+@app.cli.command(name='snapshot-restore')
+@with_appcontext
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--replace', is_flag=True, help='Apaga os dados atuais antes de repor o snapshot.')
+def snapshot_restore_command(directory, replace):
+    """Repõe um snapshot criado com snapshot-export numa única transação."""
+    started = time.perf_counter()
+    try:
+        counts = restore_snapshot(directory, replace=replace, progress=lambda name, rows: print(f'{name}: {rows} linha(s)'))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f'{total} linha(s) repostas em {elapsed:.2f}s ({total / elapsed:.0f} linhas/s).')
+
+@app.cli.command(name='run-jobs')
+@with_appcontext
+@click.option('--loop', is_flag=True, help='Continua a executar a cada SCHEDULER_INTERVAL_SECONDS segundos.')
+def run_jobs_command(loop):
+    """Executa as tarefas agendadas (batalhas, eventos, desafios do dia, conquistas e anexos). Próprio para cron."""
+    while True:
+        for name, count in run_scheduled_jobs().items():
+            print(f'{name}: ' + ('ocupada por outro processo' if count is None else f'{count} processado(s)'))
+        if not loop:
+            break
+        time.sleep(SCHEDULER_INTERVAL_SECONDS)
+
 # --- INICIALIZAÇÃO DO BANCO DE DADOS ---
-with app.app_context():
-    initialize_database()
+if not IS_WORKER_PROCESS:
+    with app.app_context():
+        initialize_database()
+
+if os.getenv('ENABLE_SCHEDULER') == '1' and not IS_WORKER_PROCESS:
+    start_background_scheduler()
 
 # --- EXECUÇÃO DA APLICAÇÃO ---
 if __name__ == '__main__':
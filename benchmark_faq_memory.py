@@ -0,0 +1,85 @@
+"""
+Benchmark de memória das FAQ com anexos.
+
+Cria uma base de dados SQLite temporária com FAQs, parte delas com anexos grandes,
+e mede com tracemalloc o pico de memória alocada pelas operações que listam ou
+pesquisam FAQs (listagem, página /faqs, chat) e pelo download de um anexo.
+
+Funciona com o esquema antigo (anexo na coluna faq.file_data), com a tabela
+faq_attachment e com o armazenamento de anexos em disco, para comparar versões.
+
+Uso:
+    python benchmark_faq_memory.py --faqs 200 --attachments 10 --size-mb 5
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import tracemalloc
+
+
+def measure(label, func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<40} pico {peak / (1024 * 1024):8.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faqs', type=int, default=200)
+    parser.add_argument('--attachments', type=int, default=10)
+    parser.add_argument('--size-mb', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_faq_memory_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ['ATTACHMENT_STORE_DIR'] = os.path.join(workdir, 'attachments')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from werkzeug.security import generate_password_hash
+    import app as service_desk
+    from app import app, db, User, Level, FAQ, Category
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+
+    with app.app_context():
+        category = Category.query.first()
+        for i in range(args.faqs):
+            faq = FAQ(category_id=category.id, question=f'Como configurar a impressora {i}?',
+                      answer=f'Passos para configurar a impressora modelo {i}.')
+            if i < args.attachments:
+                if hasattr(service_desk, 'store_attachment'):
+                    service_desk.set_faq_attachment(faq, f'manual_{i}.pdf', io.BytesIO(payload))
+                elif hasattr(service_desk, 'set_faq_attachment'):
+                    service_desk.set_faq_attachment(faq, f'manual_{i}.pdf', payload)
+                else:
+                    faq.file_name = f'manual_{i}.pdf'
+                    faq.file_data = payload
+            db.session.add(faq)
+        level = Level.query.order_by(Level.min_points).first()
+        db.session.add(User(name='Bench', email='bench@bench.local', password=generate_password_hash('benchmark'),
+                            level_id=level.id, is_admin=True))
+        db.session.commit()
+        first_faq_id = FAQ.query.order_by(FAQ.id).first().id
+    del payload
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'bench@bench.local', 'password': 'benchmark'})
+
+    def list_faqs():
+        with app.app_context():
+            FAQ.query.all()
+
+    print(f'{args.faqs} FAQs, {args.attachments} anexos de {args.size_mb} MB')
+    measure('FAQ.query.all()', list_faqs)
+    measure('GET /faqs', lambda: client.get('/faqs'))
+    measure('POST /chat (pesquisa de FAQ)', lambda: client.post('/chat', json={'mensagem': 'configurar impressora'}))
+    measure('GET /download/<id>', lambda: client.get(f'/download/{first_faq_id}').close())
+
+
+if __name__ == '__main__':
+    main()
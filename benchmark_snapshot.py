@@ -0,0 +1,107 @@
+"""
+Benchmark dos snapshots da plataforma (export_snapshot / restore_snapshot).
+
+Cria uma base de dados SQLite temporária com utilizadores em equipas, desafios
+concluídos, histórico de chat, contribuições para um evento global e progresso
+num Boss Fight, exporta um snapshot e repõe-no numa segunda base de dados vazia,
+medindo as linhas por segundo de cada fase.
+
+Uso:
+    python benchmark_snapshot.py --users 20000 --challenges 200
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--challenges', type=int, default=200)
+    parser.add_argument('--completions-per-user', type=int, default=10)
+    parser.add_argument('--messages-per-user', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_snapshot_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'source.db')
+    os.environ['ATTACHMENT_STORE_DIR'] = os.path.join(workdir, 'attachments')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from sqlalchemy import create_engine, insert, func, select
+    from app import (app, db, export_snapshot, restore_snapshot, User, Level, Team, Challenge, UserChallenge,
+                     ChatMessage, GlobalEvent, GlobalEventContribution, BossFight, BossFightStage, BossFightStep,
+                     TeamBossProgress)
+
+    with app.app_context():
+        level_id = Level.query.order_by(Level.min_points).first().id
+        now = datetime.utcnow()
+        db.session.execute(insert(User), [
+            {'name': f'Aluno {i}', 'email': f'aluno{i}@bench.local', 'password': 'x', 'level_id': level_id,
+             'points': i % 1000, 'registered_at': now}
+            for i in range(args.users)])
+        user_ids = [row[0] for row in db.session.execute(select(User.id).order_by(User.id))]
+        team_ids = [row.id for row in db.session.execute(
+            insert(Team).returning(Team.id, sort_by_parameter_order=True),
+            [{'name': f'Equipa {i}', 'owner_id': user_ids[i]} for i in range(max(1, args.users // 20))])]
+        db.session.execute(db.update(User), [{'id': user_id, 'team_id': team_ids[i % len(team_ids)]}
+                                             for i, user_id in enumerate(user_ids)])
+        challenge_ids = [row.id for row in db.session.execute(
+            insert(Challenge).returning(Challenge.id, sort_by_parameter_order=True),
+            [{'title': f'Desafio {i}', 'description': 'Benchmark', 'expected_answer': f'r{i}'}
+             for i in range(args.challenges)])]
+        rng = random.Random(42)
+        db.session.execute(insert(UserChallenge), [
+            {'user_id': user_id, 'challenge_id': challenge_id, 'completed_at': now}
+            for user_id in user_ids
+            for challenge_id in rng.sample(challenge_ids, min(args.completions_per_user, len(challenge_ids)))])
+        db.session.execute(insert(ChatMessage), [
+            {'user_id': user_id, 'message': f'Pergunta {n}', 'response': 'Resposta ' * 10, 'timestamp': now}
+            for user_id in user_ids for n in range(args.messages_per_user)])
+        event = GlobalEvent(name='Boss Benchmark', description='Benchmark', total_hp=10 ** 9, current_hp=10 ** 9,
+                            end_date=now + timedelta(days=1), is_active=True)
+        boss = BossFight(name='Boss Benchmark', description='Benchmark', reward_points=100)
+        db.session.add_all([event, boss])
+        db.session.flush()
+        db.session.execute(insert(GlobalEventContribution), [
+            {'event_id': event.id, 'user_id': user_id, 'contribution_points': 10} for user_id in user_ids])
+        stage = BossFightStage(boss_fight_id=boss.id, name='Etapa', order=1)
+        db.session.add(stage)
+        db.session.flush()
+        step = BossFightStep(stage_id=stage.id, description='Tarefa', expected_answer='x')
+        db.session.add(step)
+        db.session.flush()
+        db.session.execute(insert(TeamBossProgress), [
+            {'team_id': team_id, 'step_id': step.id, 'completed_by_user_id': user_ids[i], 'completed_at': now}
+            for i, team_id in enumerate(team_ids)])
+        db.session.commit()
+
+        snapshot_dir = os.path.join(workdir, 'snapshot')
+        started = time.perf_counter()
+        manifest = export_snapshot(snapshot_dir)
+        export_time = time.perf_counter() - started
+        total = sum(entry['rows'] for entry in manifest['tables'])
+        size = sum(os.path.getsize(os.path.join(snapshot_dir, chunk['file']))
+                   for entry in manifest['tables'] for chunk in entry['chunks'])
+
+        target = create_engine('sqlite:///' + os.path.join(workdir, 'target.db'))
+        db.metadata.create_all(target)
+        started = time.perf_counter()
+        restore_snapshot(snapshot_dir, engine=target)
+        restore_time = time.perf_counter() - started
+
+        with target.connect() as conn:
+            restored = conn.execute(select(func.count()).select_from(UserChallenge.__table__)).scalar()
+            teams_restored = conn.execute(select(func.count()).select_from(User.__table__).where(User.team_id.isnot(None))).scalar()
+
+    print(f'Linhas no snapshot: {total} ({size / (1024 * 1024):.1f} MB comprimidos)')
+    print(f'Exportação: {export_time:.2f}s ({total / export_time:.0f} linhas/s)')
+    print(f'Reposição: {restore_time:.2f}s ({total / restore_time:.0f} linhas/s)')
+    print(f'Verificação: {restored} desafios concluídos, {teams_restored} utilizadores com equipa')
+
+
+if __name__ == '__main__':
+    main()
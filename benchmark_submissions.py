@@ -0,0 +1,106 @@
+"""
+Benchmark da submissão de desafios (/challenges/submit).
+
+Cria uma base de dados SQLite temporária com utilizadores, equipas em batalha,
+uma trilha, um evento global ativo e conquistas, e mede quantas submissões
+corretas por segundo a aplicação processa e quantas instruções SQL cada uma executa.
+
+Uso:
+    python benchmark_submissions.py --users 50 --challenges 40
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--challenges', type=int, default=40)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_submissions_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from sqlalchemy import event
+    from werkzeug.security import generate_password_hash
+    from app import (app, db, User, Level, Team, Challenge, LearningPath, PathChallenge, GlobalEvent,
+                     TeamBattle, TeamBattleChallenge, Achievement, DailyChallenge)
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        level = Level.query.order_by(Level.min_points).first()
+        password = generate_password_hash('benchmark')
+        users = [User(name=f'Aluno {i}', email=f'aluno{i}@bench.local', password=password, level_id=level.id)
+                 for i in range(args.users)]
+        db.session.add_all(users)
+        challenges = [Challenge(title=f'Desafio {i}', description='Benchmark', expected_answer=f'resposta {i}',
+                                points_reward=10, level_required=level.name)
+                      for i in range(args.challenges)]
+        db.session.add_all(challenges)
+        db.session.flush()
+
+        teams = [Team(name=f'Equipa {i}', owner_id=users[i].id) for i in range(2)]
+        db.session.add_all(teams)
+        db.session.flush()
+        for i, user in enumerate(users):
+            user.team_id = teams[i % 2].id
+
+        battle = TeamBattle(challenging_team_id=teams[0].id, challenged_team_id=teams[1].id,
+                            end_time=datetime.utcnow() + timedelta(days=2))
+        db.session.add(battle)
+        db.session.flush()
+        db.session.add_all([TeamBattleChallenge(battle_id=battle.id, challenge_id=c.id) for c in challenges[:5]])
+
+        path = LearningPath(name='Trilha Benchmark', reward_points=50)
+        db.session.add(path)
+        db.session.flush()
+        db.session.add_all([PathChallenge(path_id=path.id, challenge_id=c.id, step=i + 1)
+                            for i, c in enumerate(challenges[:10])])
+
+        db.session.add(GlobalEvent(name='Boss Benchmark', description='Benchmark', total_hp=10 ** 9, current_hp=10 ** 9,
+                                   start_date=datetime.utcnow() - timedelta(hours=1),
+                                   end_date=datetime.utcnow() + timedelta(days=1), is_active=True))
+        db.session.add(DailyChallenge(challenge_id=challenges[0].id))
+        db.session.add_all([
+            Achievement(name='Primeiro Passo', description='1 desafio', trigger_type='challenges_completed', trigger_value=1),
+            Achievement(name='Veterano', description='20 desafios', trigger_type='challenges_completed', trigger_value=20),
+            Achievement(name='Rico', description='100 pontos', trigger_type='points_earned', trigger_value=100),
+            Achievement(name='Explorador', description='1 trilha', trigger_type='paths_completed', trigger_value=1),
+        ])
+        db.session.commit()
+        credentials = [(u.email, c.id, c.expected_answer) for u in users for c in challenges]
+        statements = {'count': 0}
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_statement(*_):
+            statements['count'] += 1
+
+    clients = {}
+    for email, _, _ in credentials:
+        if email not in clients:
+            client = app.test_client()
+            client.post('/login', data={'email': email, 'password': 'benchmark'})
+            clients[email] = client
+
+    statements['count'] = 0
+    started = time.perf_counter()
+    for email, challenge_id, answer in credentials:
+        response = clients[email].post(f'/challenges/submit/{challenge_id}', data={'answer': answer})
+        assert response.status_code == 302, response.status_code
+    elapsed = time.perf_counter() - started
+
+    total = len(credentials)
+    print(f'Submissões corretas: {total}')
+    print(f'Tempo total: {elapsed:.2f}s')
+    print(f'Submissões por segundo: {total / elapsed:.1f}')
+    print(f'Instruções SQL por submissão: {statements["count"] / total:.1f}')
+
+
+if __name__ == '__main__':
+    main()